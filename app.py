@@ -1,13 +1,32 @@
-from flask import Flask, request, redirect, url_for, render_template, jsonify
+from flask import Flask, request, redirect, url_for, render_template, jsonify, Response, stream_with_context, g
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from dotenv import load_dotenv
-import sqlite3
 import os
+import io
+import logging
+import threading
+import json
+import zlib
+
+import db
+import migrations
+import dice
+import transfer
+import journal
+import simulate
+import stores
+import search
+import levels
+from catalog import Catalog
 
 # Charger les variables d'environnement depuis le fichier .env
 load_dotenv()
 
 app = Flask(__name__)
+
+# Mode lecture seule : l'interface tourne dans des processus séparés (voir wsgi.py)
+# et le bot reste le seul à écrire dans la base
+READ_ONLY = os.getenv('WEB_READ_ONLY', '0') == '1'
 app.secret_key = 'une_clé_secrète_très_sécurisée'  # Clé secrète pour les sessions
 
 # Configuration de Flask-Login
@@ -52,40 +71,43 @@ def logout():
 def index():
     return "Bienvenue sur la page d'accueil"
 
-# Connexion à la base de données
+# Connexions à la base : une par thread, réutilisée d'une requête à l'autre (DB_POOL=0 pour comparer sans)
+app.config['DB_POOL'] = os.getenv('DB_POOL', '1') != '0'
+
+def _open_connection():
+    if READ_ONLY:
+        return db.connect_readonly()
+    return db.connect()
+
+_pool = db.ConnectionPool(_open_connection, enabled=app.config['DB_POOL'])
+
+# Connexion de la requête en cours, rendue au pool à la fin de la requête
 def get_db_connection():
-    conn = sqlite3.connect('rpg_bot.db', check_same_thread=False)
-    conn.row_factory = sqlite3.Row  # Pour accéder aux colonnes par nom
-    return conn
+    if 'db' not in g:
+        g.db = _pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        _pool.release(conn)
 
-# Initialisation de la base de données
+# Initialisation de la base de données (migrations partagées avec le bot)
 def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS characters (
-            user_id TEXT PRIMARY KEY,
-            name TEXT,
-            race TEXT,
-            class TEXT,
-            level INTEGER,
-            xp INTEGER,
-            hp INTEGER,
-            strength INTEGER,
-            dexterity INTEGER,
-            constitution INTEGER,
-            intelligence INTEGER,
-            wisdom INTEGER,
-            charisma INTEGER,
-            invisible_until INTEGER,
-            last_spell_used INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    if READ_ONLY:
+        return  # Les migrations sont faites par le bot
+    # Connexion à part : elle ne doit pas être héritée par les processus web (fork)
+    conn = db.connect()
+    try:
+        migrations.migrate(conn)
+    finally:
+        conn.close()
 
 # Appeler init_db() au démarrage de l'application
-init_db()
+# (pas dans les processus de simulation, qui réimportent le programme principal : voir simulate.py)
+if __name__ != '__mp_main__':
+    init_db()
 
 # Route pour afficher les personnages
 @app.route('/characters')
@@ -94,37 +116,202 @@ def characters():
     print(f"Utilisateur connecté : {current_user.id}")
     return render_template('characters.html')
 
+# Route pour afficher les quêtes (même table que les commandes !*_quest)
+@app.route('/quests')
+@login_required
+def quests_page():
+    return render_template('quests.html', quests=stores.fetch_quests(get_db_connection()), read_only=READ_ONLY)
+
+# Route pour créer une quête
+@app.route('/create_quest', methods=['POST'])
+@login_required
+def create_quest():
+    if READ_ONLY:
+        return "Interface en lecture seule : les quêtes se créent avec la commande !create_quest", 403
+    quest_name = request.form.get('name')
+    quest_description = request.form.get('description')
+    if quest_name and quest_description:
+        conn = get_db_connection()
+        stores.insert_quest(conn, quest_name, quest_description)
+        conn.commit()
+        logging.info(f"Quête '{quest_name}' créée via l'interface web.")
+    return redirect(url_for('quests_page'))
+
+# Champs exposés par l'API, avec la colonne correspondante
+CHARACTER_FIELDS = {"id": "user_id", **{column: column for column in db.CHARACTER_COLUMNS[1:]}}
+
+# Taille des pages de /api/characters
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Dernière version connue de la table characters, avec l'état des fichiers de la base
+_characters_version = {"signature": None, "version": None}
+
+def _database_signature():
+    signature = []
+    for path in (db.DB_PATH, db.DB_PATH + '-wal'):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+# Version de la table characters : tant que les fichiers de la base n'ont pas bougé,
+# la version en mémoire est réutilisée sans aucune requête
+def characters_version():
+    signature = _database_signature()
+    if signature != _characters_version["signature"]:
+        _characters_version["version"] = db.table_version(get_db_connection(), 'characters')
+        _characters_version["signature"] = signature
+    return _characters_version["version"]
+
 # Route API pour récupérer les personnages au format JSON
+# Pagination par clé (?after=<id>&limit=100), projection (?fields=name,level,hp) et ETag
 @app.route('/api/characters', methods=['GET'])
 def get_characters():
+    fields = request.args.get('fields')
+    fields = [field.strip() for field in fields.split(',')] if fields else list(CHARACTER_FIELDS)
+    unknown = [field for field in fields if field not in CHARACTER_FIELDS]
+    if unknown:
+        return jsonify({"error": f"Champs inconnus : {', '.join(unknown)}"}), 400
+    after = request.args.get('after', '')
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # Le tableau de bord inchangé reçoit un 304 sans requête sur la base
+    etag = f"characters-{characters_version()}-{zlib.crc32(request.query_string):08x}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    columns = ', '.join(f'"{CHARACTER_FIELDS[field]}"' for field in fields)
+
+    def generate():
+        # La connexion est rendue au pool après la fin du flux (stream_with_context)
+        conn = get_db_connection()
+        # user_id en premier : il sert de curseur pour la page suivante
+        cursor = conn.execute(
+            f'SELECT user_id, {columns} FROM characters WHERE user_id > ? ORDER BY user_id LIMIT ?',
+            (after, limit)
+        )
+        yield '{"characters": ['
+        last_id = None
+        count = 0
+        while True:
+            rows = cursor.fetchmany(200)
+            if not rows:
+                break
+            for row in rows:
+                character = dict(zip(fields, tuple(row)[1:]))
+                yield (',' if count else '') + json.dumps(character, ensure_ascii=False)
+                last_id = row[0]
+                count += 1
+        next_cursor = last_id if count == limit else None
+        yield f'], "next": {json.dumps(next_cursor)}}}'
+
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    response.set_etag(etag)
+    # Le navigateur garde la page mais la revalide à chaque fois (If-None-Match)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Statistiques agrégées, gardées en mémoire jusqu'à la prochaine écriture de personnage
+_stats_cache = {"version": None, "stats": None}
+
+def compute_stats(conn):
+    stats = {}
+    for key, column in (("levels", "level"), ("classes", "class"), ("races", "race")):
+        rows = conn.execute(
+            f'SELECT "{column}", COUNT(*) FROM characters GROUP BY "{column}" ORDER BY "{column}"'
+        ).fetchall()
+        stats[key] = {str(value): count for value, count in rows}
+    row = conn.execute('''
+        SELECT COUNT(*), MIN(hp), MAX(hp), AVG(hp), SUM(hp), MIN(xp), MAX(xp), AVG(xp), SUM(xp)
+        FROM characters
+    ''').fetchone()
+    stats["count"] = row[0]
+    stats["hp"] = {"min": row[1], "max": row[2], "avg": row[3], "total": row[4]}
+    stats["xp"] = {"min": row[5], "max": row[6], "avg": row[7], "total": row[8]}
+    return stats
+
+# Route API pour les statistiques (répartition des niveaux, classes, races, résumés PV/XP)
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    # Les écritures du bot (autre processus) changent la version de la table
+    version = characters_version()
+    if _stats_cache["stats"] is None or _stats_cache["version"] != version:
+        _stats_cache["stats"] = compute_stats(get_db_connection())
+        _stats_cache["version"] = version
+    return jsonify(_stats_cache["stats"])
+
+# Route API pour les probabilités exactes d'un lancer (ex: /api/odds?expr=1d20%2Bdexterity&dexterity=12&target=15)
+@app.route('/api/odds', methods=['GET'])
+def get_odds():
+    expression = request.args.get('expr', '')
+    target = request.args.get('target', type=int)
+    variables = {name: request.args.get(name, type=int) for name in set(dice.VARIABLES.values())}
+    try:
+        result = dice.odds(expression, variables)
+    except dice.DiceError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result.to_dict(target))
+
+# Simulations depuis l'interface web : moins de combats que !simulate, et une seule à la fois
+# par processus (le calcul occupe tout le pool de processus)
+WEB_MAX_FIGHTS = 200_000
+_simulation_lock = threading.Lock()
+
+# Route API pour simuler des combats (ex: /api/simulate?party=123,456&opponents=3xGobelin:7:1d6%2B2&fights=100000)
+@app.route('/api/simulate', methods=['GET'])
+@login_required
+def get_simulation():
+    user_ids = [user_id for user_id in request.args.get('party', '').split(',') if user_id]
+    fights = request.args.get('fights', simulate.DEFAULT_FIGHTS, type=int)
+    seed = request.args.get('seed', type=int)
+    if not 1 <= fights <= WEB_MAX_FIGHTS:
+        return jsonify({"error": f"Le nombre de combats doit être entre 1 et {WEB_MAX_FIGHTS}."}), 400
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM characters')
-    characters = cursor.fetchall()
-    conn.close()
-
-    # Convertir les données en une liste de dictionnaires
-    characters_list = []
-    for character in characters:
-        characters_list.append({
-            "id": character[0],
-            "name": character[1],
-            "race": character[2],
-            "class": character[3],
-            "level": character[4],
-            "xp": character[5],
-            "hp": character[6],
-            "strength": character[7],
-            "dexterity": character[8],
-            "constitution": character[9],
-            "intelligence": character[10],
-            "wisdom": character[11],
-            "charisma": character[12],
-            "invisible_until": character[13],
-            "last_spell_used": character[14]
-        })
-    
-    return jsonify(characters_list)
+    characters = []
+    for user_id in user_ids:
+        row = conn.execute('SELECT * FROM characters WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            return jsonify({"error": f"Personnage inconnu : {user_id}"}), 404
+        characters.append(db.row_to_character(row))
+    try:
+        party = simulate.party_from_characters(characters)
+        opponents = simulate.parse_opponents(request.args.get('opponents', ''))
+    except simulate.SimulationError as e:
+        return jsonify({"error": str(e)}), 400
+    if not _simulation_lock.acquire(blocking=False):
+        return jsonify({"error": "Une simulation est déjà en cours, réessayer dans quelques secondes."}), 429
+    try:
+        result = simulate.simulate(party, opponents, fights, seed, simulate.get_executor())
+    except simulate.SimulationError as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        _simulation_lock.release()
+    return jsonify(result)
+
+# Index plein texte des sorts et objets de rpg.db, en mémoire (rpg.db n'est lu qu'en lecture seule)
+catalog_index = search.CatalogIndex(Catalog())
+
+# Route API de recherche plein texte (ex: /api/search?q=boule%20feu&kind=spell,item&page=2&per_page=20)
+@app.route('/api/search', methods=['GET'])
+def get_search():
+    kinds = [kind for kind in request.args.get('kind', '').split(',') if kind] or search.KINDS
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', search.PAGE_SIZE, type=int)
+    try:
+        result = search.search(get_db_connection(), request.args.get('q', ''), kinds, page, per_page, catalog_index)
+    except search.SearchError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+# Progression du bot (LEVEL_THRESHOLDS) : un personnage créé au niveau N reçoit l'XP cumulée de ce niveau
+LEVELS = levels.from_environment()
 
 # Route pour créer un personnage
 @app.route('/create_character', methods=['GET', 'POST'])
@@ -132,6 +319,8 @@ def get_characters():
 def create_character():
     if not current_user.is_authenticated:
         return redirect(url_for('login'))  # Rediriger vers la page de connexion si l'utilisateur n'est pas connecté
+    if READ_ONLY:
+        return "Interface en lecture seule : les personnages se créent avec la commande !create", 403
 
     if request.method == 'POST':
         # Récupérer les données du formulaire
@@ -171,7 +360,7 @@ def create_character():
             "race": race,
             "class": character_class,
             "level": level,
-            "xp": 0,
+            "xp": LEVELS.threshold(level),  # XP cumulée : le seuil du niveau choisi
             "hp": hp,
             "strength": strength,
             "dexterity": dexterity,
@@ -209,8 +398,48 @@ def save_character(user_id, character):
         character.get('invisible_until', 0),
         character.get('last_spell_used', 0)
     ))
+    db._append_journal(conn, [journal.character_entry(user_id, character, 'web')])
     conn.commit()
-    conn.close()
+    # Les statistiques en mémoire ne sont plus à jour
+    _stats_cache["stats"] = None
+
+# Route pour exporter tous les personnages (CSV ou JSON Lines), envoyés au fil de la lecture
+@app.route('/export/characters.<format>')
+@login_required
+def export_characters(format):
+    if format not in ('csv', 'jsonl'):
+        return "Format inconnu (csv ou jsonl)", 404
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    chunks = transfer.export_characters(get_db_connection(), format)
+    return Response(
+        stream_with_context(chunk.encode('utf-8') for chunk in chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=characters.{format}"}
+    )
+
+# Route pour importer des personnages depuis un fichier CSV ou JSON Lines
+@app.route('/import_characters', methods=['GET', 'POST'])
+@login_required
+def import_characters():
+    if READ_ONLY:
+        return "Interface en lecture seule : l'import se fait avec python transfer.py import", 403
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if upload is None or not upload.filename:
+            return "Aucun fichier envoyé", 400
+        try:
+            format = request.form.get('format') or transfer.detect_format(upload.filename)
+            # Le fichier est lu ligne par ligne, sans être chargé en entier
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            result = transfer.import_characters(get_db_connection(), transfer.read_records(stream, format))
+        except (transfer.TransferError, UnicodeDecodeError) as e:
+            return f"Import impossible : {e}", 400
+        except db.DatabaseBusy as e:
+            return f"Import impossible : {e}", 409
+        # Les statistiques en mémoire ne sont plus à jour
+        _stats_cache["stats"] = None
+        return render_template('import_characters.html', result=result)
+    return render_template('import_characters.html', result=None)
 
 # Démarrer l'application Flask
 if __name__ == '__main__':
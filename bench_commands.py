@@ -0,0 +1,161 @@
+"""Banc d'essai hors ligne des commandes du bot.
+
+Les vraies coroutines des commandes (roll, create, sheet, use_eclair, join,
+next_turn, gain_xp...) sont appelées avec un faux contexte Discord : N guildes
+de M joueurs jouent en parallèle, sans connexion à Discord, sur une base
+temporaire. Le résultat est écrit en JSON pour comparer les versions :
+
+    python bench_commands.py --guilds 10 --players 10 --rounds 20 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from fakes import FakeChannel, FakeContext, FakeGuild, FakeMember, StubTransport
+from metrics import summarize
+from outbox import Outbox
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_bot(workdir):
+    """Importe bot_mj dans un répertoire temporaire (base et logs neufs)."""
+    os.chdir(workdir)
+    os.environ.setdefault('LOG_FILE', os.path.join(workdir, 'bench.log'))
+    sys.path.insert(0, ROOT)
+    import bot_mj
+    bot_mj.prepare()
+    return bot_mj
+
+
+async def run(bot_mj, guilds, players, rounds, seed, api_latency=0.02):
+    rng = random.Random(seed)
+    random.seed(seed)
+    # Mêmes limites que le bot, transport local à la place de Discord
+    transport = StubTransport(api_latency)
+    bot_mj.outbox = Outbox(transport=transport)
+    # Les sorts doivent toucher la base à chaque appel, pas seulement la première fois
+    bot_mj.SPELL_COOLDOWN = 0
+    channels = {}
+    bot_mj.bot.get_channel = channels.get
+
+    async def ready():
+        return None
+    bot_mj.bot.wait_until_ready = ready
+
+    bot_mj.character_cache.start()
+    await bot_mj.effects.start()
+    latencies = {}
+
+    async def call(name, ctx, *args, **kwargs):
+        callback = bot_mj.bot.get_command(name).callback
+        start = time.perf_counter()
+        await callback(ctx, *args, **kwargs)
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    members = {}
+    for g in range(guilds):
+        guild = FakeGuild(1000 + g)
+        channel = channels[2000 + g] = FakeChannel(2000 + g)
+        members[guild] = [(FakeMember(g * players + p + 1, f"joueur{g}-{p}"), channel) for p in range(players)]
+
+    async def player(guild, member, channel, others):
+        ctx = FakeContext(bot_mj, member, guild, channel)
+        await call('create', ctx, member.name)
+        await call('join', ctx, member.name)
+        for _ in range(rounds):
+            action = rng.random()
+            if action < 0.30:
+                await call('roll', ctx, expression=rng.choice(('1d20', '1d20+dexterity', '4d6kh3', '8d6')))
+            elif action < 0.45:
+                await call('sheet', ctx)
+            elif action < 0.60:
+                await call('use_eclair', ctx, rng.choice(others))
+            elif action < 0.75:
+                await call('gain_xp', ctx, rng.randint(10, 200))
+            elif action < 0.85:
+                await call('next_turn', ctx)
+            elif action < 0.95:
+                await call('take_damage', ctx, rng.randint(1, 5))
+            else:
+                await call('add_item', ctx, rng.choice(('Potion', 'Corde', 'Torche')))
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        player(guild, member, channel, [other for other, _ in guild_members if other is not member] or [member])
+        for guild, guild_members in members.items()
+        for member, channel in guild_members
+    ))
+    elapsed = time.perf_counter() - start
+    # Les écritures différées font partie du coût mesuré
+    flush_start = time.perf_counter()
+    await bot_mj.character_cache.close()
+    flush = time.perf_counter() - flush_start
+    outbox_depth = bot_mj.outbox.depth
+    drain_start = time.perf_counter()
+    await bot_mj.outbox.close(timeout=600)
+    drain = time.perf_counter() - drain_start
+    bot_mj.effects.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    queries = bot_mj.metrics.queries
+    writes = sum(histogram.count for (kind, _), histogram in queries.items() if kind == 'write')
+    reads = sum(histogram.count for (kind, _), histogram in queries.items() if kind == 'read')
+    total_elapsed = elapsed + flush
+    return {
+        "config": {"guilds": guilds, "players": players, "rounds": rounds, "seed": seed},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "elapsed_s": elapsed,
+        "final_flush_s": flush,
+        "commands_per_s": len(all_latencies) / elapsed if elapsed else 0.0,
+        "latency": summarize(all_latencies),
+        "commands": {name: summarize(values) for name, values in sorted(latencies.items())},
+        "db": {
+            "writes": writes,
+            "reads": reads,
+            "writes_per_s": writes / total_elapsed if total_elapsed else 0.0,
+        },
+        "cache": bot_mj.character_cache.stats(),
+        "outbox": {
+            **bot_mj.outbox.stats(),
+            "depth_after_commands": outbox_depth,
+            "drain_s": drain,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai hors ligne des commandes du bot")
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--players', type=int, default=10, help="joueurs par guilde")
+    parser.add_argument('--rounds', type=int, default=20, help="commandes par joueur")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--api-latency', type=float, default=0.02, help="durée simulée d'un appel à Discord (s)")
+    parser.add_argument('--output', help="fichier JSON (par défaut : sortie standard)")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory(prefix='rpg-bench-') as workdir:
+        bot_mj = import_bot(workdir)
+        try:
+            result = asyncio.run(run(bot_mj, args.guilds, args.players, args.rounds, args.seed, args.api_latency))
+        finally:
+            bot_mj.repository.close()
+            os.chdir(ROOT)
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Banc d'essai de l'API web (app.py) : requêtes par seconde sans puis avec le pool de connexions.
+
+Une base temporaire est remplie de personnages, puis chaque thread envoie des
+requêtes /api/characters (pages et projections variées, sans ETag) avec le
+client de test de Flask. Le résultat est écrit en JSON :
+
+    python bench_web.py --characters 5000 --requests 2000 --threads 4
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def populate(db, count):
+    conn = db.connect()
+    rows = [
+        (f"{100000 + i}", f"Héros {i}", random.choice(('Humain', 'Elfe', 'Nain')),
+         random.choice(('Guerrier', 'Mage', 'Voleur')), random.randint(1, 20), random.randint(0, 50000),
+         random.randint(1, 120), 10, 12, 14, 10, 11, 9, 0, 0)
+        for i in range(count)
+    ]
+    db._insert_characters(conn, rows)
+    conn.commit()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def run(app, ids, requests, threads):
+    urls = [
+        '/api/characters?limit=50&after={after}',
+        '/api/characters?fields=name,level,hp&limit=100&after={after}',
+        '/api/characters?fields=id,class&limit=20&after={after}',
+    ]
+    per_thread = requests // threads
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        for _ in range(per_thread):
+            url = rng.choice(urls).format(after=rng.choice(ids))
+            response = client.get(url)
+            response.get_data()
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    total = per_thread * threads
+    return {
+        "requests": total,
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "requests_per_s": total / elapsed if elapsed else 0.0,
+        "mean_ms": elapsed / total * threads * 1000 if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai de l'API web")
+    parser.add_argument('--characters', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--output', help="fichier JSON (par défaut : sortie standard)")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory(prefix='rpg-bench-web-') as workdir:
+        os.chdir(workdir)
+        sys.path.insert(0, ROOT)
+        import db
+        import app as web
+        ids = populate(db, args.characters)
+        result = {"config": vars(args)}
+        # Avant : une connexion ouverte et fermée par requête ; après : une connexion par thread
+        for label, enabled in (("before", False), ("after", True)):
+            web._pool.enabled = enabled
+            run(web.app, ids, min(args.requests, 200), args.threads)  # préchauffage
+            result[label] = run(web.app, ids, args.requests, args.threads)
+        os.chdir(ROOT)
+    before = result["before"]["requests_per_s"]
+    result["speedup"] = result["after"]["requests_per_s"] / before if before else None
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,130 +2,164 @@ import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 import os
-import sqlite3
+import asyncio
 import random
 import logging
 import time
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, request, jsonify, render_template, redirect, url_for, Response
 from flask_httpauth import HTTPBasicAuth
 from threading import Thread
 from functools import wraps
+from contextlib import closing
+
+import db
+import migrations
+import dice
+from db import Delta
+from cache import CharacterCache
+from combat import CombatTracker
+from effects import EffectScheduler
+from catalog import Catalog
+import stores
+import logs
+from metrics import Metrics, serve as serve_metrics
+from outbox import Outbox
+from sharding import RemoteCharacterCache, shard_for
+import simulate
+import journal
+import levels
+import spells
+import search
 
 # Charger les variables d'environnement
 load_dotenv()
 
-# Configuration des logs
-logging.basicConfig(
-    filename='rpg_bot.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-logging.info("Démarrage du bot RPG")
-
-# Vérifier que le token est bien chargé
-token = os.getenv('DISCORD_TOKEN')
-if token is None:
-    logging.error("Le token Discord n'a pas été trouvé dans le fichier .env")
-    raise ValueError("Le token Discord n'a pas été trouvé dans le fichier .env")
-
 # Configuration des intents
 intents = discord.Intents.default()
 intents.message_content = True  # Pour accéder au contenu des messages
 
+# Contexte des commandes : les messages texte passent par la file d'envoi (regroupement, limites de Discord)
+class RPGContext(commands.Context):
+    async def send(self, content=None, **kwargs):
+        if content is None or kwargs:
+            # Envoi direct (embed, fichier...) : les messages texte déjà en file dans ce salon partent avant
+            await outbox.flush(self.channel)
+            return await super().send(content, **kwargs)
+        await outbox.send(self.channel, content)
+
+# Bot qui démarre et vide le cache des personnages avec la boucle d'événements
+class RPGBot(commands.Bot):
+    async def get_context(self, origin, *, cls=RPGContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def setup_hook(self):
+        character_cache.start()
+        await effects.start()
+        self.loop_monitor = asyncio.create_task(metrics.monitor_loop())
+        # En mode multi-processus, le coordinateur se charge des instantanés
+        self.snapshots = asyncio.create_task(journal.snapshot_loop(repository)) if SHARD_ID is None else None
+
+    async def close(self):
+        self.loop_monitor.cancel()
+        if self.snapshots is not None:
+            self.snapshots.cancel()
+        effects.stop()
+        # Rien n'est perdu lors d'un arrêt propre : le cache est écrit avant la fermeture
+        await character_cache.close()
+        await outbox.close()
+        simulate.shutdown()
+        await super().close()
+
+# Mode multi-processus (sharding.py) : ce processus ne reçoit que les guildes de son shard
+SHARD_ID = int(os.getenv('SHARD_ID')) if os.getenv('SHARD_ID') else None
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '1'))
+shard_options = {"shard_id": SHARD_ID, "shard_count": SHARD_COUNT} if SHARD_ID is not None else {}
+
 # Configuration du bot
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = RPGBot(command_prefix="!", intents=intents, **shard_options)
 
 # Désactiver la commande help par défaut
 bot.remove_command('help')
 
-# Connexion à la base de données SQLite
-conn = sqlite3.connect('rpg_bot.db', check_same_thread=False)
-cursor = conn.cursor()
-
-# Supprimer la table si elle existe
-cursor.execute('DROP TABLE IF EXISTS characters')
-
-# Recréer la table avec la bonne structure
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS characters (
-        user_id TEXT PRIMARY KEY,
-        name TEXT,
-        race TEXT,
-        class TEXT,
-        level INTEGER,
-        xp INTEGER,
-        hp INTEGER,
-        strength INTEGER,
-        dexterity INTEGER,
-        constitution INTEGER,
-        intelligence INTEGER,
-        wisdom INTEGER,
-        charisma INTEGER,
-        invisible_until INTEGER,
-        last_spell_used INTEGER
+# Verrou de la base tenu par ce processus (voir prepare)
+cache_lock = None
+
+# Préparation du processus : logs, verrou et schéma de la base
+# Appelée au lancement du bot et par les outils qui l'importent (bench_commands.py, sharding.py),
+# jamais à l'import : les processus de simulation (simulate.py) réimportent ce module
+def prepare():
+    global cache_lock
+    # Logs JSON (UTF-8), écrits par un thread dédié, rotation par taille et chaque nuit
+    # LOG_SAMPLING="roll=10" ne garde qu'un message sur 10 pour !roll
+    logs.setup_logging(
+        os.getenv('LOG_FILE', 'rpg_bot.log'),
+        level=logging.INFO,
+        sampling=logs.parse_sampling(os.getenv('LOG_SAMPLING', 'roll=10'))
     )
-''')
-
-# Valider les changements
-conn.commit()
-
-print("La table 'characters' a été mise à jour avec succès.")
+    logging.info("Démarrage du bot RPG")
+
+    # Tant que ce processus garde les personnages en cache, les imports directs dans la base sont refusés
+    # (en mode multi-processus, c'est le coordinateur qui les garde)
+    cache_lock = None if os.getenv('RPG_COORDINATOR') else db.hold_cache_lock()
+
+    # Mise à jour du schéma de la base : aucune donnée n'est supprimée, rien n'est fait si elle est à jour
+    with closing(db.connect()) as conn:
+        migrations.migrate(conn)
+        # Table characters perdue (vide) : reconstruite depuis le dernier instantané et la fin du journal
+        journal.recover(conn)
+
+# Mesures exposées sur /metrics et par !stats
+metrics = Metrics()
+
+# Accès asynchrone à la base : les requêtes ne bloquent plus la boucle d'événements
+repository = db.CharacterRepository(observer=metrics.observe_query)
+
+# Cache des personnages en écriture différée (flush toutes les 5 secondes et à l'arrêt)
+# En mode multi-processus, les personnages (partagés entre guildes) sont gardés par le coordinateur
+if os.getenv('RPG_COORDINATOR'):
+    character_cache = RemoteCharacterCache(os.getenv('RPG_COORDINATOR'), os.getenv('RPG_COORDINATOR_TOKEN', ''))
+else:
+    character_cache = CharacterCache(repository, max_size=1024, flush_interval=5.0)
+metrics.gauge('rpg_cache_hits_total', 'Personnages trouvés dans le cache', lambda: character_cache.hits, 'counter')
+metrics.gauge('rpg_cache_misses_total', 'Personnages chargés depuis la base', lambda: character_cache.misses, 'counter')
+metrics.gauge('rpg_cache_entries', 'Personnages en cache', lambda: character_cache.stats()['size'])
+metrics.gauge('rpg_cache_dirty', 'Personnages en attente d\'écriture', lambda: character_cache.stats()['dirty'])
+
+# File d'envoi des messages : un message par salon et par fenêtre de 50 ms, dans les limites de Discord
+outbox = Outbox()
+metrics.gauge('rpg_outbox_depth', 'Messages en attente d\'envoi', lambda: outbox.depth)
+metrics.gauge('rpg_outbox_posts_total', 'Messages postés sur Discord', lambda: outbox.posts, 'counter')
+metrics.gauge('rpg_outbox_edits_total', 'Messages complétés par édition', lambda: outbox.edits, 'counter')
 
 # Fonction pour sauvegarder un personnage
-def save_character(user_id, character):
-    cursor.execute('''
-        INSERT OR REPLACE INTO characters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        user_id,
-        character['name'],
-        character['race'],
-        character['class'],
-        character['level'],
-        character['xp'],
-        character['hp'],
-        character['strength'],
-        character['dexterity'],
-        character['constitution'],
-        character['intelligence'],
-        character['wisdom'],
-        character['charisma'],
-        character.get('invisible_until', 0),
-        character.get('last_spell_used', 0)
-    ))
-    conn.commit()
+async def save_character(user_id, character):
+    await character_cache.put(user_id, character)
     logging.info(f"Personnage {character['name']} sauvegardé pour l'utilisateur {user_id}")
 
 # Fonction pour charger un personnage
-def load_character(user_id):
-    cursor.execute('SELECT * FROM characters WHERE user_id = ?', (user_id,))
-    row = cursor.fetchone()
-    if row:
-        return {
-            "user_id": row[0],
-            "name": row[1],
-            "race": row[2],
-            "class": row[3],
-            "level": row[4],
-            "xp": row[5],
-            "hp": row[6],
-            "strength": row[7],
-            "dexterity": row[8],
-            "constitution": row[9],
-            "intelligence": row[10],
-            "wisdom": row[11],
-            "charisma": row[12],
-            "invisible_until": row[13],
-            "last_spell_used": row[14]
-        }
-    return None
-
-# Dictionnaires pour gérer les quêtes, l'inventaire et les compétences
-quests = {}
-inventory = {}
-skills = {}
-
-# Dictionnaire pour gérer les combats en cours
-combat = {}
+async def load_character(user_id):
+    return await character_cache.get(user_id)
+
+# Fonction pour modifier quelques champs d'un personnage (ex: hp=Delta(-5))
+async def update_character(user_id, **fields):
+    return await character_cache.update(user_id, **fields)
+
+# Fonction pour modifier plusieurs personnages dans la même transaction
+async def update_characters(changes):
+    return await character_cache.update_many(changes)
+
+# Au-delà de ce nombre de dés, !roll calcule le tirage dans un thread
+DICE_THREAD_THRESHOLD = 10000
+
+# Quêtes, inventaire et compétences, stockés dans la base
+# Inventaires et compétences suivent le joueur d'une guilde à l'autre : pas de cache local entre shards
+STORE_CACHE_SIZE = 0 if SHARD_ID is not None else 1024
+quests = stores.QuestStore(repository)
+inventory = stores.InventoryStore(repository, max_users=STORE_CACHE_SIZE)
+skills = stores.SkillStore(repository, max_users=STORE_CACHE_SIZE)
+
+# Combats en cours, persistés dans la base (survivent à un redémarrage)
+combat = CombatTracker(repository)
 
 # Événement : Quand le bot est prêt
 @bot.event
@@ -133,6 +167,34 @@ async def on_ready():
     logging.info(f'Bot connecté en tant que {bot.user}')
     print(f'Bot connecté en tant que {bot.user}')
 
+# Avant chaque commande : son nom accompagne les logs (et sert à l'échantillonnage)
+@bot.before_invoke
+async def before_command(ctx):
+    logs.current_command.set(ctx.command.qualified_name)
+    ctx.started_at = time.perf_counter()
+
+# Après chaque commande (réussie ou non) : durée et erreurs
+@bot.after_invoke
+async def after_command(ctx):
+    started_at = getattr(ctx, 'started_at', None)
+    if started_at is not None:
+        metrics.observe_command(ctx.command.qualified_name, time.perf_counter() - started_at, ctx.command_failed)
+
+# Commande : !stats (administrateurs)
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def stats(ctx):
+    """Affiche les mesures de performance du bot (ex: !stats)."""
+    cache_stats = character_cache.stats()
+    outbox_stats = outbox.stats()
+    await ctx.send(
+        f"```\n{metrics.summary()}\n"
+        f"Cache : {cache_stats['size']}/{cache_stats['max_size']} personnages, "
+        f"taux de succès {cache_stats['hit_rate']:.0%}, {cache_stats['dirty']} en attente d'écriture\n"
+        f"Messages : {outbox_stats['depth']} en file, {outbox_stats['posts']} postés, "
+        f"{outbox_stats['edits']} édités, {outbox_stats['coalesced']} regroupés\n```"
+    )
+
 # Commande : !ping
 @bot.command()
 async def ping(ctx):
@@ -141,20 +203,103 @@ async def ping(ctx):
 
 # Commande : !roll
 @bot.command()
-async def roll(ctx, dice: str):
-    """Lance des dés (ex: !roll 1d20)."""
+async def roll(ctx, *, expression: str):
+    """Lance des dés (ex: !roll 1d20, !roll 4d6kh3+2, !roll 1d6!)."""
     try:
-        num_dice, dice_type = map(int, dice.split('d'))
-        if num_dice < 1 or dice_type < 2:
-            await ctx.send("Format invalide. Utilisez !roll NdM (ex: !roll 1d20).")
-            return
-        rolls = [random.randint(1, dice_type) for _ in range(num_dice)]
-        total = sum(rolls)
-        await ctx.send(f'Résultat : {rolls} (Total: {total})')
-        logging.info(f"Commande !roll utilisée par {ctx.author} : {dice} -> {rolls} (Total: {total})")
-    except Exception as e:
-        await ctx.send("Format invalide. Utilisez !roll NdM (ex: !roll 1d20).")
+        compiled = dice.parse(expression)
+        variables = None
+        if compiled.variables:
+            # Les caractéristiques (ex: 1d20+dexterity) viennent du personnage du joueur
+            variables = await load_character(str(ctx.author.id))
+        # Les gros tirages sont calculés hors de la boucle d'événements
+        if compiled.dice_count > DICE_THREAD_THRESHOLD:
+            result = await asyncio.to_thread(dice.roll, compiled, variables)
+        else:
+            result = dice.roll(compiled, variables)
+    except dice.DiceError as e:
+        await ctx.send(f"{e} Exemples : !roll 1d20, !roll 4d6kh3+2, !roll 2d20kl1, !roll 1d6!, !roll 3d6r1.")
         logging.error(f"Erreur avec la commande !roll : {e}")
+        return
+    message = f"Résultat : {result.describe()}"
+    if len(message) > 2000:  # Limite de Discord
+        message = f"Résultat : {compiled} = {result.total}"
+    await ctx.send(message)
+    logging.info(f"Commande !roll utilisée par {ctx.author} : {expression} -> {result.total}")
+
+# Commande : !odds
+@bot.command()
+async def odds(ctx, *, expression: str):
+    """Affiche les probabilités exactes d'un lancer (ex: !odds 8d6, !odds 1d20+dexterity >= 15)."""
+    target = None
+    if '>=' in expression:
+        expression, target_text = expression.split('>=', 1)
+        try:
+            target = int(target_text.strip())
+        except ValueError:
+            await ctx.send("La difficulté doit être un nombre (ex: !odds 1d20+dexterity >= 15).")
+            return
+    try:
+        compiled = dice.parse(expression)
+        variables = None
+        if compiled.variables:
+            # Les caractéristiques (ex: dexterity) viennent du personnage du joueur
+            variables = await load_character(str(ctx.author.id))
+            if variables is None:
+                await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
+                return
+        result = await asyncio.to_thread(dice.odds, compiled, variables)
+    except dice.DiceError as e:
+        await ctx.send(f"{e} Exemples : !odds 8d6, !odds 4d6kh3, !odds 1d20+dexterity >= 15.")
+        logging.error(f"Erreur avec la commande !odds : {e}")
+        return
+    percentiles = ', '.join(f"{percent}% → {result.percentile(percent)}" for percent in dice.PERCENTILES)
+    message = (
+        f"Probabilités de {compiled} : min {result.low}, max {result.high}, "
+        f"moyenne {result.mean:.2f} (écart-type {result.stdev:.2f})\n"
+        f"Percentiles : {percentiles}"
+    )
+    if target is not None:
+        message += f"\nChance d'obtenir au moins {target} : {result.at_least(target) * 100:.1f} %"
+    await ctx.send(message)
+    logging.info(f"Commande !odds utilisée par {ctx.author} : {expression}")
+
+# Commande : !simulate
+@bot.command(name='simulate')
+async def simulate_fight(ctx, *, opponents: str):
+    """Simule des milliers de combats contre des adversaires (ex: !simulate 3xGobelin:7:1d6+2 Ogre:59:2d8+4)."""
+    # Le groupe : les participants du combat en cours, sinon le personnage du joueur
+    encounter = await combat.get(ctx.guild.id)
+    if encounter is not None and len(encounter):
+        user_ids = [participant['user_id'] for participant in encounter.participants]
+    else:
+        user_ids = [str(ctx.author.id)]
+    characters = [await load_character(user_id) for user_id in user_ids]
+    try:
+        party = simulate.party_from_characters(characters)
+        foes = simulate.parse_opponents(opponents)
+        # Les combats sont joués dans d'autres processus : la boucle du bot reste disponible
+        result = await asyncio.to_thread(
+            simulate.simulate, party, foes, simulate.DEFAULT_FIGHTS, None, simulate.get_executor()
+        )
+    except simulate.SimulationError as e:
+        await ctx.send(f"{e} Exemple : !simulate 3xGobelin:7:1d6+2 Ogre:59:2d8+4:1.")
+        logging.error(f"Erreur avec la commande !simulate : {e}")
+        return
+    rates = result["rates"]
+    lines = [
+        f"{result['fights']} combats simulés : victoire {rates['win'] * 100:.1f} %, "
+        f"défaite {rates['loss'] * 100:.1f} %, nul {rates['draw'] * 100:.1f} % "
+        f"({result['rounds']['mean']:.1f} tours en moyenne)"
+    ]
+    for member in result["party"]:
+        percentiles = member["final_hp"]["percentiles"]
+        lines.append(
+            f"{member['name']} : survit dans {member['survival_rate'] * 100:.1f} % des combats, "
+            f"PV restants {member['final_hp']['mean']:.1f}/{member['hp']} en moyenne "
+            f"(5 % → {percentiles['5']}, 50 % → {percentiles['50']}, 95 % → {percentiles['95']})"
+        )
+    await ctx.send("\n".join(lines))
+    logging.info(f"Commande !simulate utilisée par {ctx.author} : {opponents} ({result['elapsed_s']:.2f} s)")
 
 # Commande : !create
 @bot.command()
@@ -177,7 +322,7 @@ async def create(ctx, name: str):
         "invisible_until": 0,
         "last_spell_used": 0
     }
-    save_character(user_id, character)
+    await save_character(user_id, character)
     await ctx.send(f"Personnage {name} créé !")
     logging.info(f"Personnage {name} créé par {ctx.author}")
 
@@ -186,102 +331,266 @@ async def create(ctx, name: str):
 async def sheet(ctx):
     """Affiche la fiche d'un personnage (ex: !sheet)."""
     user_id = str(ctx.author.id)
-    character = load_character(user_id)
+    character = await load_character(user_id)
     if character:
-        await ctx.send(f"Fiche de {character['name']}:\n{character}")
+        message = f"Fiche de {character['name']}:\n{character}"
+        next_threshold = LEVELS.next_threshold(character["level"])
+        if next_threshold is not None:
+            message += f"\nProchain niveau à {next_threshold} XP."
+        await ctx.send(message)
         logging.info(f"Fiche de personnage affichée pour {ctx.author}")
     else:
         await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
         logging.warning(f"{ctx.author} a tenté d'afficher une fiche de personnage inexistante.")
 
+# Catalogue des sorts et objets de rpg.db, rechargé quand la base change
+catalog = Catalog()
+# Index plein texte des sorts et objets, pour !search (en mémoire, rpg.db reste intact)
+catalog_index = search.CatalogIndex(catalog)
+
+# Réponse commune à !spell et !item
+def describe_entries(kind, query, found, approximate):
+    if not found:
+        return f"{kind} {query} introuvable."
+    if approximate:
+        return f"{kind} {query} introuvable. Vouliez-vous dire : {', '.join(name for name, _ in found)} ?"
+    if len(found) == 1:
+        name, description = found[0]
+        return f"{name} : {description}"
+    return f"Plusieurs résultats pour {query} : {', '.join(name for name, _ in found)}"
+
 # Commande : !spell
 @bot.command()
-async def spell(ctx, spell_name: str):
-    """Affiche les détails d'un sort (ex: !spell Boule de Feu)."""
-    spells = {
-        "boule de feu": "Inflige 8d6 dégâts de feu dans une zone.",
-        "soin": "Restaure 2d8 points de vie.",
-        "invisibilité": "Rend le personnage invisible pendant 1 minute ou jusqu'à ce qu'il attaque ou lance un sort.",
-        "éclair": "Inflige 1d10 dégâts de foudre à une cible."
-    }
-    spell_name_lower = spell_name.lower()
-    if spell_name_lower in spells:
-        await ctx.send(f"{spell_name} : {spells[spell_name_lower]}")
-    else:
-        await ctx.send(f"Sort {spell_name} introuvable.")
+async def spell(ctx, *, spell_name: str):
+    """Affiche les détails d'un sort (ex: !spell Boule de Feu, !spell eclair, !spell feu)."""
+    found, approximate = catalog.spell(spell_name)
+    await ctx.send(describe_entries("Sort", spell_name, found, approximate))
+
+# Commande : !item
+@bot.command()
+async def item(ctx, *, item_name: str):
+    """Affiche les détails d'un objet du catalogue (ex: !item Potion de soin)."""
+    found, approximate = catalog.item(item_name)
+    await ctx.send(describe_entries("Objet", item_name, found, approximate))
+
+# Libellés des types de résultats de !search
+SEARCH_KINDS = {'character': "Personnage", 'quest': "Quête", 'spell': "Sort", 'item': "Objet"}
+
+# Commande : !search
+@bot.command(name='search')
+async def search_all(ctx, *, text: str):
+    """Cherche dans les personnages, quêtes, sorts et objets (ex: !search feu, !search elfe mage page:2)."""
+    page = 1
+    words = []
+    for word in text.split():
+        if word.startswith('page:') and word[5:].isdigit():
+            page = int(word[5:])
+        else:
+            words.append(word)
+    try:
+        found = await repository.read(search.search, ' '.join(words), search.KINDS, page, search.PAGE_SIZE, catalog_index, ('**', '**'))
+    except search.SearchError as e:
+        await ctx.send(str(e))
+        return
+    if not found["results"]:
+        await ctx.send(f"Aucun résultat pour {' '.join(words)}." if page == 1 else f"Pas de page {page} pour {' '.join(words)}.")
+        return
+    lines = [f"Résultats pour {' '.join(words)} (page {page}) :"]
+    lines += [f"{SEARCH_KINDS[hit['kind']]} **{hit['title']}** : {hit['detail']}" for hit in found["results"]]
+    if found["has_more"]:
+        lines.append(f"Suite : `!search {' '.join(words)} page:{page + 1}`")
+    await ctx.send('\n'.join(lines))
+    logging.info(f"{ctx.author} a cherché '{text}' ({len(found['results'])} résultats en {found['elapsed_ms']} ms)")
+
+# Durées des sorts, en secondes
+SPELL_COOLDOWN = 60
+INVISIBILITY_DURATION = 60
+
+# Effets temporaires : leur fin est annoncée à l'heure dite, même après un redémarrage
+# Chaque shard ne recharge que les effets de ses guildes
+def owns_guild(guild_id):
+    return SHARD_ID is None or shard_for(guild_id, SHARD_COUNT) == SHARD_ID
+
+effects = EffectScheduler(repository, owns=owns_guild)
+
+# Envoyer un message dans un salon à partir de son identifiant
+async def announce(channel_id, message):
+    await bot.wait_until_ready()
+    channel = bot.get_channel(channel_id) if channel_id else None
+    if channel is not None:
+        await outbox.send(channel, message)
+
+# Fin de l'invisibilité
+async def end_invisibility(user_id, channel_id):
+    character = await update_character(user_id, invisible_until=0)
+    if character:
+        await announce(channel_id, f"{character['name']} redevient visible.")
+        logging.info(f"Fin de l'invisibilité de {character['name']}.")
+
+# Fin du cooldown des sorts
+async def end_spell_cooldown(user_id, channel_id):
+    await announce(channel_id, f"<@{user_id}> ton sort est de nouveau disponible.")
+
+effects.on('invisibility', end_invisibility)
+effects.on('cooldown', end_spell_cooldown)
+
+# Démarrer le cooldown après un sort
+async def start_spell_cooldown(ctx, user_id, current_time):
+    await effects.schedule(
+        user_id, 'cooldown', current_time + SPELL_COOLDOWN, ctx.channel.id, getattr(ctx.guild, 'id', None)
+    )
 
 # Commande : !use_soin
 @bot.command()
 async def use_soin(ctx):
     """Utilise le sort Soin pour restaurer des points de vie."""
     user_id = str(ctx.author.id)
-    character = load_character(user_id)
-    if character:
-        current_time = int(time.time())
-        if current_time - character.get('last_spell_used', 0) < 60:  # Cooldown de 60 secondes
-            await ctx.send("Vous devez attendre avant de pouvoir utiliser un sort à nouveau.")
-            return
-        heal_amount = random.randint(2, 16)  # 2d8
-        character["hp"] += heal_amount
-        character["last_spell_used"] = current_time
-        save_character(user_id, character)
-        await ctx.send(f"{character['name']} a été soigné de {heal_amount} PV. Il a maintenant {character['hp']} PV.")
-        logging.info(f"{ctx.author} a utilisé le sort Soin et a restauré {heal_amount} PV.")
-    else:
+    current_time = int(time.time())
+    heal_amount = random.randint(2, 16)  # 2d8
+    cooling_down = False
+
+    # Cooldown vérifié et sort appliqué d'un seul bloc : deux lancers simultanés (même sur deux shards) ne soignent qu'une fois
+    def heal(character):
+        nonlocal cooling_down
+        cooling_down = current_time - character.get('last_spell_used', 0) < SPELL_COOLDOWN
+        if cooling_down:
+            return None
+        return {"hp": Delta(heal_amount), "last_spell_used": current_time}
+
+    character = await character_cache.modify(user_id, heal)
+    if character is None:
         await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
+        return
+    if cooling_down:
+        await ctx.send("Vous devez attendre avant de pouvoir utiliser un sort à nouveau.")
+        return
+    await start_spell_cooldown(ctx, user_id, current_time)
+    await ctx.send(f"{character['name']} a été soigné de {heal_amount} PV. Il a maintenant {character['hp']} PV.")
+    logging.info(f"{ctx.author} a utilisé le sort Soin et a restauré {heal_amount} PV.")
 
 # Commande : !use_invisibilite
 @bot.command()
 async def use_invisibilite(ctx):
     """Utilise le sort Invisibilité pour rendre le personnage invisible."""
     user_id = str(ctx.author.id)
-    character = load_character(user_id)
-    if character:
-        current_time = int(time.time())
-        if current_time - character.get('last_spell_used', 0) < 60:  # Cooldown de 60 secondes
-            await ctx.send("Vous devez attendre avant de pouvoir utiliser un sort à nouveau.")
-            return
-        character["invisible_until"] = current_time + 60  # Invisible pendant 60 secondes
-        character["last_spell_used"] = current_time
-        save_character(user_id, character)
-        await ctx.send(f"{character['name']} devient invisible pendant 1 minute ou jusqu'à ce qu'il attaque ou lance un sort.")
-        logging.info(f"{ctx.author} a utilisé le sort Invisibilité.")
-    else:
+    current_time = int(time.time())
+    cooling_down = False
+
+    # Comme !use_soin : cooldown et invisibilité décidés sur l'état le plus récent
+    def vanish(character):
+        nonlocal cooling_down
+        cooling_down = current_time - character.get('last_spell_used', 0) < SPELL_COOLDOWN
+        if cooling_down:
+            return None
+        return {"invisible_until": current_time + INVISIBILITY_DURATION, "last_spell_used": current_time}
+
+    character = await character_cache.modify(user_id, vanish)
+    if character is None:
         await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
+        return
+    if cooling_down:
+        await ctx.send("Vous devez attendre avant de pouvoir utiliser un sort à nouveau.")
+        return
+    await effects.schedule(
+        user_id, 'invisibility', current_time + INVISIBILITY_DURATION, ctx.channel.id, getattr(ctx.guild, 'id', None)
+    )
+    await start_spell_cooldown(ctx, user_id, current_time)
+    await ctx.send(f"{character['name']} devient invisible pendant 1 minute ou jusqu'à ce qu'il attaque ou lance un sort.")
+    logging.info(f"{ctx.author} a utilisé le sort Invisibilité.")
+
+# Sorts de dégâts (voir catalog.DEFAULT_SPELLS)
+LIGHTNING = spells.Spell("Éclair", "1d10", "foudre")
+FIREBALL = spells.Spell("Boule de Feu", "8d6", "feu")
+
+# Lancer un sort de dégâts : dégâts de toutes les cibles et cooldown du lanceur d'un seul bloc
+# Renvoie ({user_id: personnage}, {user_id: dégâts}) ; dégâts à None si le sort est en recharge
+async def cast_damage_spell(ctx, spell, target_ids):
+    user_id = str(ctx.author.id)
+    current_time = int(time.time())
+    damages = None
+
+    def resolve(characters):
+        nonlocal damages
+        changes, damages = spell.resolve(user_id, characters, target_ids, current_time, SPELL_COOLDOWN)
+        return changes
+
+    characters = await character_cache.modify_many(list(dict.fromkeys([user_id, *target_ids])), resolve)
+    if characters is not None and damages is not None:
+        await start_spell_cooldown(ctx, user_id, current_time)
+    return characters, damages
 
 # Commande : !use_eclair
 @bot.command()
 async def use_eclair(ctx, target: discord.Member = None):
     """Utilise le sort Éclair pour infliger des dégâts à une cible."""
     user_id = str(ctx.author.id)
-    character = load_character(user_id)
+    character = await load_character(user_id)
     if character:
-        current_time = int(time.time())
-        if current_time - character.get('last_spell_used', 0) < 60:  # Cooldown de 60 secondes
-            await ctx.send("Vous devez attendre avant de pouvoir utiliser un sort à nouveau.")
-            return
         if target is None:
             await ctx.send("Vous devez cibler un joueur pour utiliser ce sort.")
             return
-        target_character = load_character(str(target.id))
-        if target_character is None:
+        target_id = str(target.id)
+        if await load_character(target_id) is None:
+            await ctx.send("La cible n'a pas de personnage.")
+            return
+        characters, damages = await cast_damage_spell(ctx, LIGHTNING, [target_id])
+        if characters is None:
             await ctx.send("La cible n'a pas de personnage.")
             return
-        damage = random.randint(1, 10)  # 1d10
-        target_character["hp"] -= damage
-        save_character(str(target.id), target_character)
-        character["last_spell_used"] = current_time
-        save_character(user_id, character)
-        await ctx.send(f"{character['name']} lance Éclair et inflige {damage} dégâts de foudre à {target_character['name']} !")
+        if damages is None:
+            await ctx.send("Vous devez attendre avant de pouvoir utiliser un sort à nouveau.")
+            return
+        damage = damages[target_id]
+        await ctx.send(f"{character['name']} lance Éclair et inflige {damage} dégâts de foudre à {characters[target_id]['name']} !")
         logging.info(f"{ctx.author} a utilisé le sort Éclair et a infligé {damage} dégâts à {target}.")
     else:
         await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
 
+# Commande : !use_boule_de_feu
+@bot.command()
+async def use_boule_de_feu(ctx, *members: discord.Member):
+    """Lance Boule de Feu (8d6 par cible) sur les joueurs mentionnés, sinon sur les autres participants du combat."""
+    user_id = str(ctx.author.id)
+    character = await load_character(user_id)
+    if character is None:
+        await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
+        return
+    if members:
+        target_ids = list(dict.fromkeys(str(member.id) for member in members))
+    else:
+        encounter = await combat.get(ctx.guild.id)
+        participants = encounter.participants if encounter is not None else []
+        target_ids = [participant['user_id'] for participant in participants if participant['user_id'] != user_id]
+    # Les joueurs sans personnage ne sont pas touchés
+    target_ids = [target_id for target_id in target_ids if await load_character(target_id) is not None]
+    if not target_ids:
+        await ctx.send("Aucune cible : mentionne des joueurs, ou lance le sort pendant un combat.")
+        return
+    if len(target_ids) > spells.MAX_TARGETS:
+        await ctx.send(f"Pas plus de {spells.MAX_TARGETS} cibles pour un sort de zone.")
+        return
+    characters, damages = await cast_damage_spell(ctx, FIREBALL, target_ids)
+    if characters is None:
+        await ctx.send("Une des cibles n'a plus de personnage.")
+        return
+    if damages is None:
+        await ctx.send("Vous devez attendre avant de pouvoir utiliser un sort à nouveau.")
+        return
+    lines = [f"{character['name']} lance Boule de Feu ! {len(target_ids)} cible(s) touchée(s) :"]
+    for target_id in target_ids:
+        target = characters[target_id]
+        line = f"- {target['name']} : {damages[target_id]} dégâts de feu, {target['hp']} PV"
+        if target["hp"] <= 0:
+            line += " (hors de combat)"
+        lines.append(line)
+    await ctx.send("\n".join(lines))
+    logging.info(f"{ctx.author} a utilisé le sort Boule de Feu sur {len(target_ids)} cible(s) ({sum(damages.values())} dégâts au total).")
+
 # Commande : !start_combat
 @bot.command()
 async def start_combat(ctx):
     """Démarre un combat."""
-    combat[ctx.guild.id] = {'participants': [], 'turn': 0}
+    await combat.start(ctx.guild.id)
     await ctx.send("Combat démarré ! Utilisez !join pour rejoindre.")
     logging.info(f"Combat démarré par {ctx.author}.")
 
@@ -290,14 +599,15 @@ async def start_combat(ctx):
 async def join(ctx, name: str):
     """Rejoint un combat avec un personnage (ex: !join Nom)."""
     user_id = str(ctx.author.id)
-    character = load_character(user_id)
+    character = await load_character(user_id)
     if character:
         initiative = random.randint(1, 20) + character["dexterity"]  # Ajouter la dextérité à l'initiative
-        if ctx.guild.id not in combat:
-            combat[ctx.guild.id] = {'participants': [], 'turn': 0}
-        combat[ctx.guild.id]['participants'].append({'name': name, 'initiative': initiative})
-        await ctx.send(f"{name} a rejoint le combat avec une initiative de {initiative}.")
-        logging.info(f"{ctx.author} a rejoint le combat avec {name} (initiative: {initiative}).")
+        if await combat.join(ctx.guild.id, user_id, name, initiative):
+            await ctx.send(f"{name} a rejoint le combat avec une initiative de {initiative}.")
+            logging.info(f"{ctx.author} a rejoint le combat avec {name} (initiative: {initiative}).")
+        else:
+            await ctx.send("Tu participes déjà à ce combat.")
+            logging.warning(f"{ctx.author} a tenté de rejoindre deux fois le même combat.")
     else:
         await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
         logging.warning(f"{ctx.author} a tenté de rejoindre un combat sans personnage.")
@@ -306,13 +616,10 @@ async def join(ctx, name: str):
 @bot.command()
 async def next_turn(ctx):
     """Passe au tour suivant."""
-    if ctx.guild.id in combat:
-        participants = combat[ctx.guild.id]['participants']
-        if participants:
-            participants.sort(key=lambda x: x['initiative'], reverse=True)
-            current_turn = combat[ctx.guild.id]['turn'] % len(participants)
-            current_player = participants[current_turn]
-            combat[ctx.guild.id]['turn'] += 1
+    encounter = await combat.get(ctx.guild.id)
+    if encounter is not None:
+        current_player = await combat.next_turn(ctx.guild.id)
+        if current_player:
             await ctx.send(f"C'est au tour de {current_player['name']} !")
             logging.info(f"Tour suivant dans le combat : {current_player['name']}.")
         else:
@@ -326,7 +633,7 @@ async def next_turn(ctx):
 @bot.command()
 async def create_quest(ctx, name: str, description: str):
     """Crée une quête."""
-    quests[name] = {"description": description, "completed": False}
+    await quests.create(name, description)
     await ctx.send(f"Quête '{name}' créée !")
     logging.info(f"Quête '{name}' créée par {ctx.author}.")
 
@@ -334,8 +641,7 @@ async def create_quest(ctx, name: str, description: str):
 @bot.command()
 async def start_quest(ctx, name: str):
     """Démarre une quête."""
-    if name in quests:
-        quests[name]["started"] = True
+    if await quests.start(name):
         await ctx.send(f"Quête '{name}' démarrée !")
         logging.info(f"Quête '{name}' démarrée par {ctx.author}.")
     else:
@@ -346,8 +652,7 @@ async def start_quest(ctx, name: str):
 @bot.command()
 async def complete_quest(ctx, name: str):
     """Termine une quête."""
-    if name in quests:
-        quests[name]["completed"] = True
+    if await quests.complete(name):
         await ctx.send(f"Quête '{name}' terminée !")
         logging.info(f"Quête '{name}' terminée par {ctx.author}.")
     else:
@@ -359,9 +664,7 @@ async def complete_quest(ctx, name: str):
 async def add_item(ctx, item: str):
     """Ajoute un objet à l'inventaire."""
     user_id = str(ctx.author.id)
-    if user_id not in inventory:
-        inventory[user_id] = []
-    inventory[user_id].append(item)
+    await inventory.add(user_id, item)
     await ctx.send(f"{item} ajouté à ton inventaire !")
     logging.info(f"{ctx.author} a ajouté '{item}' à son inventaire.")
 
@@ -370,8 +673,7 @@ async def add_item(ctx, item: str):
 async def remove_item(ctx, item: str):
     """Retire un objet de l'inventaire."""
     user_id = str(ctx.author.id)
-    if user_id in inventory and item in inventory[user_id]:
-        inventory[user_id].remove(item)
+    if await inventory.remove(user_id, item):
         await ctx.send(f"{item} retiré de ton inventaire !")
         logging.info(f"{ctx.author} a retiré '{item}' de son inventaire.")
     else:
@@ -383,8 +685,10 @@ async def remove_item(ctx, item: str):
 async def show_inventory(ctx):
     """Affiche l'inventaire du joueur."""
     user_id = str(ctx.author.id)
-    if user_id in inventory and inventory[user_id]:
-        await ctx.send(f"Inventaire : {', '.join(inventory[user_id])}")
+    items = await inventory.get(user_id)
+    if items:
+        listing = ', '.join(f"{item} x{count}" if count > 1 else item for item, count in items.items())
+        await ctx.send(f"Inventaire : {listing}")
         logging.info(f"{ctx.author} a affiché son inventaire.")
     else:
         await ctx.send("Ton inventaire est vide.")
@@ -395,9 +699,7 @@ async def show_inventory(ctx):
 async def add_skill(ctx, skill: str):
     """Ajoute une compétence au personnage."""
     user_id = str(ctx.author.id)
-    if user_id not in skills:
-        skills[user_id] = []
-    skills[user_id].append(skill)
+    await skills.add(user_id, skill)
     await ctx.send(f"Compétence '{skill}' ajoutée !")
     logging.info(f"{ctx.author} a ajouté la compétence '{skill}'.")
 
@@ -406,7 +708,7 @@ async def add_skill(ctx, skill: str):
 async def use_skill(ctx, skill: str):
     """Utilise une compétence."""
     user_id = str(ctx.author.id)
-    if user_id in skills and skill in skills[user_id]:
+    if await skills.has(user_id, skill):
         await ctx.send(f"Tu utilises la compétence '{skill}' !")
         logging.info(f"{ctx.author} a utilisé la compétence '{skill}'.")
     else:
@@ -418,14 +720,12 @@ async def use_skill(ctx, skill: str):
 async def take_damage(ctx, amount: int):
     """Inflige des dégâts au personnage."""
     user_id = str(ctx.author.id)
-    character = load_character(user_id)
+    character = await update_character(user_id, hp=Delta(-amount))
     if character:
-        character["hp"] -= amount
         if character["hp"] <= 0:
             await ctx.send(f"{character['name']} est mort !")
         else:
             await ctx.send(f"{character['name']} a perdu {amount} PV. Il lui reste {character['hp']} PV.")
-        save_character(user_id, character)
         logging.info(f"{ctx.author} a subi {amount} dégâts. PV restants : {character['hp']}.")
     else:
         await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
@@ -436,35 +736,87 @@ async def take_damage(ctx, amount: int):
 async def heal(ctx, amount: int):
     """Soigne le personnage."""
     user_id = str(ctx.author.id)
-    character = load_character(user_id)
+    character = await update_character(user_id, hp=Delta(amount))
     if character:
-        character["hp"] += amount
         await ctx.send(f"{character['name']} a été soigné de {amount} PV. Il a maintenant {character['hp']} PV.")
-        save_character(user_id, character)
         logging.info(f"{ctx.author} a été soigné de {amount} PV. PV restants : {character['hp']}.")
     else:
         await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
         logging.warning(f"{ctx.author} a tenté de se soigner sans personnage.")
 
+# Progression : XP cumulée par niveau, configurable (ex: LEVEL_THRESHOLDS=0,300,900,2700)
+LEVELS = levels.from_environment()
+
+# Annonce d'un passage de niveau (un gain important peut en faire passer plusieurs)
+def describe_level_up(character, previous_level):
+    if character["level"] == previous_level + 1:
+        return f"Félicitations ! {character['name']} est maintenant niveau {character['level']}."
+    return f"Félicitations ! {character['name']} passe du niveau {previous_level} au niveau {character['level']}."
+
 # Commande : !gain_xp
 @bot.command()
 async def gain_xp(ctx, amount: int):
     """Ajoute de l'expérience au personnage."""
+    if amount <= 0:
+        await ctx.send("Le montant d'XP doit être positif.")
+        return
     user_id = str(ctx.author.id)
-    character = load_character(user_id)
+    previous_level = None
+
+    # Décision prise sur l'état le plus récent, sans qu'une autre commande puisse s'intercaler
+    def add_xp(character):
+        nonlocal previous_level
+        previous_level = character["level"]
+        return LEVELS.award(character, amount)
+
+    character = await character_cache.modify(user_id, add_xp)
     if character:
-        character["xp"] += amount
-        if character["xp"] >= 100:  # Exemple : 100 XP pour monter de niveau
-            character["level"] += 1
-            character["xp"] = 0
-            await ctx.send(f"Félicitations ! {character['name']} est maintenant niveau {character['level']}.")
-        save_character(user_id, character)
+        if character["level"] > previous_level:
+            await ctx.send(describe_level_up(character, previous_level))
         await ctx.send(f"{amount} XP ajoutés à {character['name']}.")
         logging.info(f"{ctx.author} a gagné {amount} XP. Niveau actuel : {character['level']}.")
     else:
         await ctx.send("Tu n'as pas encore de personnage. Utilise `!create` pour en créer un.")
         logging.warning(f"{ctx.author} a tenté de gagner de l'XP sans personnage.")
 
+# Commande : !award_xp (administrateurs)
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def award_xp(ctx, amount: int, *members: discord.Member):
+    """Donne de l'XP à tout le groupe : les joueurs mentionnés, sinon les participants du combat (ex: !award_xp 300)."""
+    if amount <= 0:
+        await ctx.send("Le montant d'XP doit être positif.")
+        return
+    if members:
+        user_ids = list(dict.fromkeys(str(member.id) for member in members))
+    else:
+        encounter = await combat.get(ctx.guild.id)
+        user_ids = [participant['user_id'] for participant in encounter.participants] if encounter is not None else []
+    if not user_ids:
+        await ctx.send("Personne à récompenser : mentionne des joueurs, ou lance un combat (!start_combat, !join).")
+        return
+    # Les joueurs sans personnage sont ignorés
+    user_ids = [user_id for user_id in user_ids if await load_character(user_id) is not None]
+    previous_levels = {}
+
+    # Tout le groupe d'un bloc : une seule transaction au prochain flush
+    def award(characters):
+        previous_levels.update((user_id, character["level"]) for user_id, character in characters.items())
+        return {user_id: LEVELS.award(character, amount) for user_id, character in characters.items()}
+
+    characters = await character_cache.modify_many(user_ids, award) if user_ids else None
+    if not characters:
+        await ctx.send("Aucun de ces joueurs n'a de personnage.")
+        return
+    lines = [f"{amount} XP pour {len(characters)} personnage(s) :"]
+    for user_id, character in characters.items():
+        line = f"- {character['name']} : {character['xp']} XP, niveau {character['level']}"
+        if character["level"] > previous_levels[user_id]:
+            line += f" (niveau {previous_levels[user_id]} → {character['level']} !)"
+        lines.append(line)
+    await ctx.send("\n".join(lines))
+    logging.info(f"{ctx.author} a donné {amount} XP à {len(characters)} personnage(s).")
+
 # Interface Web avec Flask
 app = Flask(__name__)
 auth = HTTPBasicAuth()
@@ -487,14 +839,18 @@ def index():
 @app.route('/characters')
 @auth.login_required
 def characters():
-    cursor.execute('SELECT * FROM characters')
-    characters = cursor.fetchall()
+    # Connexion propre au thread Flask : aucun curseur partagé avec le bot
+    with closing(db.connect()) as conn:
+        characters = conn.execute('SELECT * FROM characters').fetchall()
     return render_template('characters.html', characters=characters)
 
 @app.route('/quests')
 @auth.login_required
 def quests_page():
-    return render_template('quests.html', quests=quests)
+    # Même table que les commandes !*_quest
+    with closing(db.connect()) as conn:
+        all_quests = stores.fetch_quests(conn)
+    return render_template('quests.html', quests=all_quests)
 
 @app.route('/create_quest', methods=['POST'])
 @auth.login_required
@@ -502,16 +858,50 @@ def create_quest():
     quest_name = request.form.get('name')
     quest_description = request.form.get('description')
     if quest_name and quest_description:
-        quests[quest_name] = {"description": quest_description, "completed": False}
+        with closing(db.connect()) as conn:
+            stores.insert_quest(conn, quest_name, quest_description)
+            conn.commit()
         logging.info(f"Quête '{quest_name}' créée via l'interface web.")
     return redirect(url_for('quests_page'))
 
+@app.route('/metrics')
+@auth.login_required
+def metrics_page():
+    # Format texte de Prometheus (scrape avec basic_auth)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Lancer le serveur Flask dans un thread séparé
 def run_flask():
     app.run(port=5000)
 
-flask_thread = Thread(target=run_flask)
-flask_thread.start()
-
-# Lancer le bot
-bot.run(token)
\ No newline at end of file
+# Le module peut être importé sans se connecter à Discord ni toucher à la base (ex: bench_commands.py)
+if __name__ == '__main__':
+    prepare()
+
+    # Vérifier que le token est bien chargé
+    token = os.getenv('DISCORD_TOKEN')
+    if token is None:
+        logging.error("Le token Discord n'a pas été trouvé dans le fichier .env")
+        raise ValueError("Le token Discord n'a pas été trouvé dans le fichier .env")
+
+    # Métriques Prometheus servies par le bot, avec ou sans interface web (un port par shard)
+    metrics_port = int(os.getenv('METRICS_PORT', '9100'))
+    if metrics_port:
+        try:
+            serve_metrics(
+                metrics, os.getenv('METRICS_HOST', '127.0.0.1'), metrics_port + (SHARD_ID or 0),
+                ("admin", users["admin"])
+            )
+        except OSError as e:
+            logging.error(f"Métriques non servies sur le port {metrics_port + (SHARD_ID or 0)} : {e}")
+
+    # EMBEDDED_WEB=0 : l'interface est servie à part par des processus en lecture seule (wsgi.py)
+    if os.getenv('EMBEDDED_WEB', '1') != '0':
+        flask_thread = Thread(target=run_flask)
+        flask_thread.start()
+
+    # Lancer le bot
+    bot.run(token, log_handler=None)  # Les logs de discord.py passent par la même file
+
+    # Attendre les dernières écritures avant de quitter
+    repository.close()
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+import db
+import journal
+
+
+class _PendingWrite:
+    """Modifications d'un personnage en attente d'écriture."""
+
+    __slots__ = ('character', 'full', 'fields')
+
+    def __init__(self, character, full=False):
+        self.character = character  # état courant en mémoire
+        self.full = full  # ligne complète à insérer (création ou remplacement)
+        self.fields = {}  # colonne -> valeur ou Delta, fusionnés
+
+    def merge(self, fields):
+        for column, value in fields.items():
+            previous = self.fields.get(column)
+            if isinstance(value, db.Delta) and previous is not None:
+                # Delta après Delta : on additionne ; Delta après une valeur : nouvelle valeur
+                if isinstance(previous, db.Delta):
+                    self.fields[column] = previous + value
+                else:
+                    self.fields[column] = previous + value.amount
+            else:
+                self.fields[column] = value
+
+
+class CharacterCache:
+    """Cache mémoire (LRU) en écriture différée devant la table characters.
+
+    Les lectures sont servies depuis la mémoire quand c'est possible. Les
+    écritures modifient uniquement le cache et marquent l'entrée comme sale :
+    plusieurs écritures successives sur le même personnage fusionnent en une
+    seule opération, écrite lors du prochain flush (périodique ou à l'arrêt)
+    dans une seule transaction pour tout le lot.
+
+    Les modifications partielles (update, update_many) s'appliquent à l'état
+    le plus récent en mémoire, dans l'ordre d'arrivée des commandes, et sont
+    écrites sous forme de mises à jour ciblées (SET hp = hp + ?) plutôt que
+    de réécrire toute la ligne.
+
+    Chaque modification est aussi notée, telle quelle et dans l'ordre, pour
+    le journal (journal.py) : les entrées partent dans la transaction du
+    flush, avec les personnages qu'elles décrivent.
+    """
+
+    def __init__(self, repository, max_size=1024, flush_interval=5.0):
+        self.repository = repository
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()  # user_id -> personnage, du moins au plus récent
+        self._dirty = {}  # user_id -> _PendingWrite (survit à l'éviction)
+        self._flushing = {}  # lot en cours d'écriture
+        self._journal = []  # entrées de journal en attente, dans l'ordre des modifications
+        self._loading = {}  # user_id -> Future du chargement en cours
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+
+    def _remember(self, user_id, character):
+        self._entries[user_id] = character
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            # Une entrée sale évincée reste dans _dirty jusqu'au prochain flush
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _pending(self, user_id):
+        pending = self._dirty.get(user_id) or self._flushing.get(user_id)
+        return pending.character if pending else None
+
+    def _current(self, user_id):
+        character = self._entries.get(user_id)
+        if character is None:
+            character = self._pending(user_id)
+        return character
+
+    async def _live(self, user_id):
+        """Renvoie l'objet personnage du cache (pas une copie), ou None."""
+        character = self._current(user_id)
+        if character is not None:
+            self.hits += 1
+            self._remember(user_id, character)
+            return character
+
+        self.misses += 1
+        # Un seul chargement par personnage, même si plusieurs commandes arrivent en même temps
+        future = self._loading.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self.repository.load(user_id))
+            self._loading[user_id] = future
+            future.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        loaded = await asyncio.shield(future)
+        # Une écriture a pu arriver pendant le chargement : elle est prioritaire
+        character = self._current(user_id)
+        if character is None:
+            if loaded is None:
+                return None
+            character = loaded
+        self._remember(user_id, character)
+        return character
+
+    async def get(self, user_id):
+        """Renvoie une copie du personnage, ou None s'il n'existe pas."""
+        character = await self._live(user_id)
+        return dict(character) if character is not None else None
+
+    async def put(self, user_id, character):
+        """Enregistre le personnage en mémoire ; il sera écrit au prochain flush."""
+        # Même forme qu'un personnage chargé depuis la base
+        character = db.row_to_character(db.character_to_row(user_id, character))
+        self._remember(user_id, character)
+        self._dirty[user_id] = _PendingWrite(character, full=True)
+        self._journal.append(journal.character_entry(user_id, character))
+
+    def _apply(self, user_id, character, fields):
+        unknown = set(fields) - set(db.CHARACTER_COLUMNS[1:])
+        if unknown:
+            raise ValueError(f"Colonnes inconnues : {', '.join(sorted(unknown))}")
+        for column, value in fields.items():
+            if isinstance(value, db.Delta):
+                character[column] += value.amount
+            else:
+                character[column] = value
+        pending = self._dirty.get(user_id)
+        if pending is None:
+            pending = self._dirty[user_id] = _PendingWrite(character)
+        pending.character = character
+        if not pending.full:
+            pending.merge(fields)
+        self._journal.append(journal.entry(user_id, journal.UPDATE, fields))
+        self._remember(user_id, character)
+
+    async def modify(self, user_id, fn):
+        """Applique fn(personnage) -> champs à modifier, sans interruption possible.
+
+        fn reçoit une copie de l'état le plus récent et renvoie un dict de
+        colonnes (valeurs ou Delta), ou None pour ne rien changer. Renvoie le
+        personnage après modification, ou None s'il n'existe pas.
+        """
+        character = await self._live(user_id)
+        if character is None:
+            return None
+        fields = fn(dict(character))
+        if fields:
+            self._apply(user_id, character, fields)
+        return dict(character)
+
+    async def update(self, user_id, **fields):
+        """Modifie quelques colonnes (ex: hp=Delta(-5)) et renvoie le personnage."""
+        return await self.modify(user_id, lambda character: fields)
+
+    async def modify_many(self, user_ids, fn):
+        """Comme modify, pour plusieurs personnages d'un seul bloc.
+
+        fn reçoit {user_id: copie} et renvoie {user_id: champs} (ou None).
+        Les modifications sont appliquées ensemble ou pas du tout (si un des
+        personnages n'existe pas, renvoie None) et partent dans la même
+        transaction au prochain flush. Renvoie {user_id: personnage}.
+        """
+        loaded = {}
+        for user_id in user_ids:
+            loaded[user_id] = await self._live(user_id)
+        if any(character is None for character in loaded.values()):
+            return None
+        # Reprendre les objets courants : un autre put a pu les remplacer pendant le chargement
+        current = {user_id: self._current(user_id) or character for user_id, character in loaded.items()}
+        changes = fn({user_id: dict(character) for user_id, character in current.items()}) or {}
+        for user_id, fields in changes.items():
+            if fields:
+                self._apply(user_id, current[user_id], fields)
+        return {user_id: dict(character) for user_id, character in current.items()}
+
+    async def update_many(self, changes):
+        """Modifie plusieurs personnages ({user_id: champs}) d'un seul bloc (voir modify_many)."""
+        return await self.modify_many(list(changes), lambda characters: changes)
+
+    async def flush(self):
+        """Écrit toutes les modifications en attente dans une seule transaction."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            batch, self._dirty = self._dirty, {}
+            entries, self._journal = self._journal, []
+            self._flushing = batch
+            rows = []
+            updates = []
+            for user_id, pending in batch.items():
+                if pending.full:
+                    rows.append(db.character_to_row(user_id, pending.character))
+                elif pending.fields:
+                    updates.append((user_id, dict(pending.fields)))
+            try:
+                await self.repository.write_batch(rows, updates, entries)
+            except Exception:
+                self._journal[:0] = entries
+                # Remettre le lot en attente, devant les modifications arrivées entre-temps
+                for user_id, pending in batch.items():
+                    newer = self._dirty.get(user_id)
+                    if newer is not None and not newer.full:
+                        pending.merge(newer.fields)
+                        pending.character = newer.character
+                    elif newer is not None:
+                        continue
+                    self._dirty[user_id] = pending
+                raise
+            finally:
+                self._flushing = {}
+            self.flushes += 1
+            logging.debug(f"Cache des personnages : {len(batch)} personnage(s) écrit(s)")
+            return len(batch)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Erreur lors de l'écriture du cache des personnages : {e}")
+
+    def start(self):
+        """Démarre le flush périodique (à appeler depuis la boucle d'événements)."""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Arrête le flush périodique et écrit tout ce qui est en attente."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "flushes": self.flushes
+        }
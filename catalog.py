@@ -0,0 +1,136 @@
+import bisect
+import difflib
+import logging
+import os
+import sqlite3
+import unicodedata
+
+CATALOG_PATH = 'rpg.db'
+
+# Sorts connus même si la table spells de rpg.db est vide ; la base est prioritaire
+DEFAULT_SPELLS = {
+    "Boule de Feu": "Inflige 8d6 dégâts de feu dans une zone.",
+    "Soin": "Restaure 2d8 points de vie.",
+    "Invisibilité": "Rend le personnage invisible pendant 1 minute ou jusqu'à ce qu'il attaque ou lance un sort.",
+    "Éclair": "Inflige 1d10 dégâts de foudre à une cible."
+}
+
+MAX_RESULTS = 10
+
+
+def normalize(text):
+    """Clé de recherche : sans accents, sans casse, espaces simplifiés ("Éclair " -> "eclair")."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(folded.casefold().split())
+
+
+class Index:
+    """Entrées d'une table (sorts ou objets), indexées pour la recherche.
+
+    Chaque nom est indexé à partir de chacun de ses mots dans une liste triée :
+    une recherche par préfixe est une bisection ("feu" trouve "Boule de Feu").
+    """
+
+    def __init__(self, entries):
+        self.entries = {}  # clé normalisée -> (nom, description)
+        for name, description in entries.items():
+            self.entries[normalize(name)] = (name, description)
+        suffixes = set()
+        for key in self.entries:
+            words = key.split(' ')
+            for i in range(len(words)):
+                suffixes.add((' '.join(words[i:]), key))
+        self._suffixes = sorted(suffixes)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def prefix(self, query, limit=MAX_RESULTS):
+        key = normalize(query)
+        start = bisect.bisect_left(self._suffixes, (key, ''))
+        found = []
+        for suffix, entry_key in self._suffixes[start:]:
+            if not suffix.startswith(key):
+                break
+            if entry_key not in found:
+                found.append(entry_key)
+                if len(found) >= limit:
+                    break
+        return [self.entries[entry_key] for entry_key in found]
+
+    def fuzzy(self, query, limit=3):
+        keys = difflib.get_close_matches(normalize(query), self.entries, n=limit, cutoff=0.6)
+        return [self.entries[key] for key in keys]
+
+    def search(self, query):
+        """Renvoie (résultats, approché) : l'entrée exacte, sinon les préfixes, sinon les noms proches."""
+        entry = self.entries.get(normalize(query))
+        if entry is not None:
+            return [entry], False
+        found = self.prefix(query)
+        if found:
+            return found, False
+        return self.fuzzy(query), True
+
+
+def _load_table(conn, table):
+    rows = conn.execute(f'SELECT name, description FROM {table} ORDER BY id').fetchall()
+    return {name: description or '' for name, description in rows}
+
+
+class Catalog:
+    """Sorts et objets de rpg.db, gardés en mémoire.
+
+    Les tables ne sont relues que lorsque les fichiers de la base changent :
+    une recherche ne coûte qu'un stat() et une bisection.
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self._signature = None
+        self.version = 0  # incrémenté à chaque rechargement (voir search.CatalogIndex)
+        self.spells = Index(DEFAULT_SPELLS)
+        self.items = Index({})
+
+    def _database_signature(self):
+        signature = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reload(self):
+        spells = dict(DEFAULT_SPELLS)
+        items = {}
+        try:
+            # Lecture seule : ne crée pas de base vide si rpg.db est absent
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            try:
+                spells.update(_load_table(conn, 'spells'))
+                items.update(_load_table(conn, 'items'))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Catalogue {self.path} illisible : {e}")
+        self.spells = Index(spells)
+        self.items = Index(items)
+        self.version += 1
+        logging.info(f"Catalogue chargé : {len(self.spells)} sort(s), {len(self.items)} objet(s)")
+
+    def refresh(self):
+        signature = self._database_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self.reload()
+
+    def spell(self, query):
+        self.refresh()
+        return self.spells.search(query)
+
+    def item(self, query):
+        self.refresh()
+        return self.items.search(query)
@@ -0,0 +1,159 @@
+import asyncio
+import bisect
+import time
+
+
+class Encounter:
+    """Combat d'une guilde.
+
+    Les participants sont insérés une seule fois à leur place dans l'ordre
+    d'initiative (décroissante, puis ordre d'arrivée) ; passer au tour suivant
+    n'est qu'un déplacement d'index.
+    """
+
+    __slots__ = ('guild_id', 'order', 'names', 'next_index', 'turn', 'next_seq')
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.order = []  # tuples (-initiative, seq, user_id), triés
+        self.names = {}  # user_id -> (nom, initiative)
+        self.next_index = 0  # position du prochain participant à jouer
+        self.turn = 0  # nombre de tours joués
+        self.next_seq = 0
+
+    @property
+    def participants(self):
+        return [
+            {'user_id': user_id, 'name': self.names[user_id][0], 'initiative': -negative}
+            for negative, _, user_id in self.order
+        ]
+
+    def __contains__(self, user_id):
+        return user_id in self.names
+
+    def __len__(self):
+        return len(self.order)
+
+    def _insert(self, user_id, name, initiative, seq):
+        entry = (-initiative, seq, user_id)
+        position = bisect.bisect_left(self.order, entry)
+        self.order.insert(position, entry)
+        self.names[user_id] = (name, initiative)
+        self.next_seq = max(self.next_seq, seq + 1)
+        # Un participant inséré avant le prochain à jouer ne doit pas lui voler son tour
+        if position < self.next_index:
+            self.next_index += 1
+
+    def advance(self):
+        """Renvoie le participant dont c'est le tour et passe au suivant."""
+        if not self.order:
+            return None
+        index = self.next_index % len(self.order)
+        _, _, user_id = self.order[index]
+        self.next_index = index + 1
+        self.turn += 1
+        name, initiative = self.names[user_id]
+        return {'user_id': user_id, 'name': name, 'initiative': initiative}
+
+
+class CombatTracker:
+    """Combats en cours, persistés ligne par ligne dans la base.
+
+    Un combat n'est chargé qu'à la première commande de sa guilde après un
+    redémarrage ; chaque modification n'écrit que la ligne concernée.
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+        self._encounters = {}  # guild_id -> Encounter, ou None si aucun combat
+        self._loading = {}
+
+    async def get(self, guild_id):
+        """Renvoie le combat de la guilde, ou None s'il n'y en a pas."""
+        if guild_id in self._encounters:
+            return self._encounters[guild_id]
+        future = self._loading.get(guild_id)
+        if future is None:
+            future = asyncio.ensure_future(self.repository.read(_load_encounter, guild_id))
+            self._loading[guild_id] = future
+            future.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+        encounter = await asyncio.shield(future)
+        # Un start a pu arriver pendant le chargement : il est prioritaire
+        return self._encounters.setdefault(guild_id, encounter)
+
+    async def start(self, guild_id):
+        """Démarre (ou redémarre) le combat de la guilde."""
+        encounter = Encounter(guild_id)
+        self._encounters[guild_id] = encounter
+        await self.repository.write(_start_encounter, guild_id, int(time.time()))
+        return encounter
+
+    async def join(self, guild_id, user_id, name, initiative):
+        """Ajoute un participant ; renvoie False s'il est déjà dans le combat."""
+        encounter = await self.get(guild_id)
+        if encounter is None:
+            # Combat créé implicitement : la ligne du combat est créée avec le participant
+            encounter = self._encounters[guild_id] = Encounter(guild_id)
+        if user_id in encounter:
+            return False
+        seq = encounter.next_seq
+        encounter._insert(user_id, name, initiative, seq)
+        await self.repository.write(
+            _add_participant, guild_id, user_id, name, initiative, seq, encounter.next_index, int(time.time())
+        )
+        return True
+
+    async def next_turn(self, guild_id):
+        """Renvoie le participant dont c'est le tour, ou None."""
+        encounter = await self.get(guild_id)
+        if encounter is None:
+            return None
+        participant = encounter.advance()
+        if participant is not None:
+            await self.repository.write(_save_position, guild_id, encounter.next_index, encounter.turn)
+        return participant
+
+
+def _load_encounter(conn, guild_id):
+    row = conn.execute(
+        'SELECT next_index, turn FROM combat_encounters WHERE guild_id = ?', (guild_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    encounter = Encounter(guild_id)
+    rows = conn.execute(
+        'SELECT user_id, name, initiative, seq FROM combat_participants WHERE guild_id = ? ORDER BY seq',
+        (guild_id,)
+    ).fetchall()
+    for user_id, name, initiative, seq in rows:
+        encounter._insert(user_id, name, initiative, seq)
+    encounter.next_index = row['next_index']
+    encounter.turn = row['turn']
+    return encounter
+
+
+def _start_encounter(conn, guild_id, started_at):
+    conn.execute('DELETE FROM combat_participants WHERE guild_id = ?', (guild_id,))
+    conn.execute(
+        'INSERT OR REPLACE INTO combat_encounters (guild_id, next_index, turn, started_at) VALUES (?, 0, 0, ?)',
+        (guild_id, started_at)
+    )
+
+
+def _add_participant(conn, guild_id, user_id, name, initiative, seq, next_index, started_at):
+    conn.execute(
+        'INSERT OR IGNORE INTO combat_encounters (guild_id, next_index, turn, started_at) VALUES (?, 0, 0, ?)',
+        (guild_id, started_at)
+    )
+    conn.execute(
+        'INSERT INTO combat_participants (guild_id, user_id, name, initiative, seq) VALUES (?, ?, ?, ?, ?)',
+        (guild_id, user_id, name, initiative, seq)
+    )
+    conn.execute('UPDATE combat_encounters SET next_index = ? WHERE guild_id = ?', (next_index, guild_id))
+
+
+def _save_position(conn, guild_id, next_index, turn):
+    conn.execute(
+        'UPDATE combat_encounters SET next_index = ?, turn = ? WHERE guild_id = ?',
+        (next_index, turn, guild_id)
+    )
@@ -0,0 +1,344 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou, importer bot arrêté
+    fcntl = None
+
+# Chemin de la base de données partagée par le bot et l'interface web
+DB_PATH = 'rpg_bot.db'
+
+# Colonnes de la table characters, dans l'ordre de la table
+CHARACTER_COLUMNS = (
+    "user_id",
+    "name",
+    "race",
+    "class",
+    "level",
+    "xp",
+    "hp",
+    "strength",
+    "dexterity",
+    "constitution",
+    "intelligence",
+    "wisdom",
+    "charisma",
+    "invisible_until",
+    "last_spell_used"
+)
+
+
+# Requêtes préparées gardées par connexion (réutilisées tant que le texte SQL est identique)
+CACHED_STATEMENTS = 256
+
+
+# Réglages communs : cache de pages de 16 Mo, lecture par mmap (256 Mo), tables temporaires en mémoire
+def _tune(conn):
+    conn.execute('PRAGMA cache_size=-16000')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA temp_store=MEMORY')
+
+
+# Ouvrir une connexion SQLite configurée pour un accès concurrent
+def connect(path=DB_PATH):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30, cached_statements=CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row  # Pour accéder aux colonnes par nom
+    # WAL : les lecteurs ne bloquent pas l'écrivain et inversement
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    # INSERT OR REPLACE déclenche aussi les triggers DELETE de la ligne remplacée (index de recherche)
+    conn.execute('PRAGMA recursive_triggers=ON')
+    _tune(conn)
+    return conn
+
+
+# Ouvrir une connexion en lecture seule (processus web séparés du bot)
+# La base doit déjà exister et être en WAL : c'est le bot, seul écrivain, qui la crée
+def connect_readonly(path=DB_PATH):
+    conn = sqlite3.connect(
+        f'file:{path}?mode=ro', uri=True, check_same_thread=False, timeout=30, cached_statements=CACHED_STATEMENTS
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA query_only=ON')
+    _tune(conn)
+    return conn
+
+
+class ConnectionPool:
+    """Une connexion par thread, ouverte à la première demande puis réutilisée.
+
+    Les PRAGMA et les requêtes préparées d'une connexion servent ainsi à
+    toutes les requêtes HTTP traitées par le même thread. La connexion d'un
+    thread terminé est fermée avec lui. Avec enabled=False, chaque
+    acquire() ouvre une nouvelle connexion, fermée par release().
+    """
+
+    def __init__(self, factory, enabled=True):
+        self.factory = factory
+        self.enabled = enabled
+        self._local = threading.local()
+
+    def acquire(self):
+        if not self.enabled:
+            return self.factory()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.factory()
+        return conn
+
+    def release(self, conn):
+        if not self.enabled:
+            conn.close()
+            return
+        # Pas de transaction laissée ouverte (elle bloquerait le point de contrôle du WAL)
+        if conn.in_transaction:
+            conn.rollback()
+
+    def close(self):
+        """Ferme la connexion du thread courant."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# Version courante d'une table (change à chaque écriture)
+def table_version(conn, name):
+    row = conn.execute('SELECT version FROM table_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+class DatabaseBusy(RuntimeError):
+    """Un bot ou un coordinateur garde les personnages de la base en cache."""
+
+
+# Verrou à côté de la base : partagé pendant toute la vie du processus qui garde le
+# cache des personnages (bot ou coordinateur), exclusif pour les écritures directes
+# dans characters (import). Le système le rend à la mort du processus : pas de
+# verrou orphelin après un arrêt brutal.
+def _lock(path, mode):
+    handle = open(path + '.lock', 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle, mode)
+        except OSError:
+            handle.close()
+            raise
+    return handle
+
+
+def hold_cache_lock(path=DB_PATH):
+    """Pris par le processus qui garde le cache des personnages ; attend la fin d'un import en cours.
+
+    Renvoie le fichier du verrou, à garder ouvert : le fermer rend le verrou.
+    """
+    if fcntl is None:
+        return _lock(path, None)
+    try:
+        return _lock(path, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logging.warning(f"Import en cours dans {path} : démarrage à la fin de l'import")
+        return _lock(path, fcntl.LOCK_SH)
+
+
+@contextlib.contextmanager
+def exclusive_access(path=DB_PATH):
+    """Écritures qui contournent le cache des personnages : refusées si un bot ou un coordinateur tourne."""
+    if fcntl is None:
+        yield
+        return
+    try:
+        handle = _lock(path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise DatabaseBusy(
+            "Le bot (ou le coordinateur) utilise la base et garde les personnages en cache : "
+            "l'arrêter avant d'importer ou de restaurer des personnages"
+        ) from None
+    with handle:
+        yield
+
+
+# Convertir un personnage (dict) en tuple dans l'ordre des colonnes
+def character_to_row(user_id, character):
+    return (
+        user_id,
+        character['name'],
+        character['race'],
+        character['class'],
+        character['level'],
+        character['xp'],
+        character['hp'],
+        character['strength'],
+        character['dexterity'],
+        character['constitution'],
+        character['intelligence'],
+        character['wisdom'],
+        character['charisma'],
+        character.get('invisible_until', 0),
+        character.get('last_spell_used', 0)
+    )
+
+
+# Convertir une ligne de la table en personnage (dict)
+def row_to_character(row):
+    return {column: row[index] for index, column in enumerate(CHARACTER_COLUMNS)}
+
+
+def _insert_characters(conn, rows):
+    conn.executemany('''
+        INSERT OR REPLACE INTO characters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+
+# Journal des modifications (voir journal.py) : entrées (at, user_id, kind, action, data)
+def _append_journal(conn, entries):
+    conn.executemany('INSERT INTO journal (at, user_id, kind, action, data) VALUES (?, ?, ?, ?, ?)', entries)
+
+
+class Delta:
+    """Variation relative d'une colonne numérique (ex: hp=Delta(-5))."""
+
+    __slots__ = ('amount',)
+
+    def __init__(self, amount):
+        self.amount = amount
+
+    def __add__(self, other):
+        return Delta(self.amount + other.amount)
+
+    def __repr__(self):
+        return f"Delta({self.amount})"
+
+
+# Mise à jour ciblée : UPDATE characters SET hp = hp + ?, last_spell_used = ? WHERE user_id = ?
+def _update_character(conn, user_id, fields):
+    unknown = set(fields) - set(CHARACTER_COLUMNS[1:])
+    if unknown:
+        raise ValueError(f"Colonnes inconnues : {', '.join(sorted(unknown))}")
+    if not fields:
+        return False
+    assignments = []
+    params = []
+    for column, value in fields.items():
+        if isinstance(value, Delta):
+            assignments.append(f'"{column}" = "{column}" + ?')
+            params.append(value.amount)
+        else:
+            assignments.append(f'"{column}" = ?')
+            params.append(value)
+    cursor = conn.execute(
+        f"UPDATE characters SET {', '.join(assignments)} WHERE user_id = ?",
+        (*params, user_id)
+    )
+    return cursor.rowcount > 0
+
+
+class CharacterRepository:
+    """Accès asynchrone à la base : les requêtes tournent dans des threads dédiés.
+
+    Les écritures passent par un unique thread écrivain (elles sont donc
+    sérialisées dans l'ordre de soumission), les lectures par un petit pool
+    de threads lecteurs. Chaque thread possède sa propre connexion : la boucle
+    d'événements de discord.py n'attend jamais le disque.
+    """
+
+    def __init__(self, path=DB_PATH, readers=2, observer=None):
+        self.path = path
+        # observer(kind, requête, secondes) : appelé après chaque requête, depuis son thread
+        self.observer = observer
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rpg-db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='rpg-db-reader')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _observe(self, kind, fn, start):
+        if self.observer is not None:
+            # CharacterRepository.load.<locals>.query -> CharacterRepository.load
+            self.observer(kind, fn.__qualname__.split('.<locals>', 1)[0], time.perf_counter() - start)
+
+    def _read(self, fn, args):
+        start = time.perf_counter()
+        try:
+            return fn(self._connection(), *args)
+        finally:
+            self._observe('read', fn, start)
+
+    def _write(self, fn, args):
+        start = time.perf_counter()
+        conn = self._connection()
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._observe('write', fn, start)
+
+    async def read(self, fn, *args):
+        """Exécute fn(conn, *args) dans un thread lecteur."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(self._read, fn, args))
+
+    async def write(self, fn, *args):
+        """Exécute fn(conn, *args) dans le thread écrivain, en une seule transaction."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, functools.partial(self._write, fn, args))
+
+    async def load(self, user_id):
+        def query(conn, user_id):
+            row = conn.execute('SELECT * FROM characters WHERE user_id = ?', (user_id,)).fetchone()
+            return row_to_character(row) if row else None
+        return await self.read(query, user_id)
+
+    async def save(self, user_id, character):
+        await self.write(_insert_characters, [character_to_row(user_id, character)])
+
+    async def write_batch(self, rows=(), updates=(), journal=()):
+        """Écrit un lot de modifications en une seule transaction.
+
+        rows : personnages complets (tuples) à insérer ou remplacer.
+        updates : tuples (user_id, champs) où chaque valeur est soit une
+        nouvelle valeur, soit un Delta appliqué directement en SQL.
+        journal : entrées du journal (journal.entry) décrivant ces modifications.
+        """
+        def query(conn, rows, updates, journal):
+            if rows:
+                _insert_characters(conn, rows)
+            for user_id, fields in updates:
+                _update_character(conn, user_id, fields)
+            if journal:
+                _append_journal(conn, journal)
+        await self.write(query, list(rows), list(updates), list(journal))
+
+    async def update(self, user_id, **fields):
+        """Met à jour quelques colonnes d'un personnage (ex: hp=Delta(-5), xp=0)."""
+        return await self.write(_update_character, user_id, fields)
+
+    def close(self):
+        """Attend la fin des requêtes en cours puis ferme les connexions."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        logging.info("Connexions à la base de données fermées")
@@ -0,0 +1,548 @@
+import bisect
+import math
+import random
+import re
+from collections import Counter
+from functools import lru_cache
+
+# Limites de travail par lancer : au-delà, le lancer est refusé
+MAX_EXPRESSION_LENGTH = 200
+MAX_TERMS = 20
+MAX_DICE = 1_000_000  # dés tirés au total (relances et explosions comprises)
+MAX_SIDES = 1_000_000
+MAX_EXPLOSIONS = 20  # explosions successives d'un même dé
+
+# En dessous de ce nombre de dés, chaque dé est conservé et affiché
+DETAIL_LIMIT = 50
+
+# Taille des lots pour les gros tirages (mémoire constante quel que soit le nombre de dés)
+BATCH_SIZE = 65536
+
+_TOKEN = re.compile(r'([+-]?)([^+-]+)')
+_DICE = re.compile(r'^(\d*)d(\d+|%)((?:kh\d+|kl\d+|k\d+|!|r<?\d+)*)$')
+_MODIFIER = re.compile(r'kh\d+|kl\d+|k\d+|!|r<?\d+')
+_VARIABLE = re.compile(r'^[a-zéè_]+$')
+
+# Caractéristiques utilisables dans une expression (ex: 1d20+dexterity), avec leurs noms français
+VARIABLES = {
+    "strength": "strength",
+    "dexterity": "dexterity",
+    "constitution": "constitution",
+    "intelligence": "intelligence",
+    "wisdom": "wisdom",
+    "charisma": "charisma",
+    "level": "level",
+    "force": "strength",
+    "dextérité": "dexterity",
+    "dexterite": "dexterity",
+    "sagesse": "wisdom",
+    "charisme": "charisma",
+    "niveau": "level"
+}
+
+# Limites du calcul exact des probabilités (!odds)
+ODDS_MAX_SUPPORT = 2000  # nombre de totaux possibles d'une expression
+ODDS_MAX_KEEP_WORK = 2_000_000  # étapes du calcul d'un groupe avec kh/kl
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class DiceError(ValueError):
+    """Expression de dés invalide ou trop coûteuse."""
+
+
+class DicePool:
+    """Un groupe de dés identiques : 4d6kh3, 1d6!, 2d20r1..."""
+
+    __slots__ = ('count', 'sides', 'keep', 'explode', 'reroll_values')
+
+    @property
+    def key(self):
+        return (self.count, self.sides, self.keep, self.explode, self.reroll_values)
+
+    def __init__(self, count, sides, keep=None, explode=False, reroll_values=frozenset()):
+        self.count = count
+        self.sides = sides
+        self.keep = keep  # ('h', n) ou ('l', n)
+        self.explode = explode
+        self.reroll_values = reroll_values  # faces relancées une fois
+
+    def __str__(self):
+        text = f"{self.count}d{self.sides}"
+        if self.reroll_values:
+            text += f"r<{max(self.reroll_values)}" if len(self.reroll_values) > 1 else f"r{min(self.reroll_values)}"
+        if self.explode:
+            text += "!"
+        if self.keep:
+            text += f"k{self.keep[0]}{self.keep[1]}"
+        return text
+
+
+class Expression:
+    """Expression compilée : somme signée de groupes de dés et de constantes."""
+
+    __slots__ = ('text', 'terms', 'dice_count', 'variables')
+
+    def __init__(self, text, terms):
+        self.text = text
+        self.terms = terms  # tuple de (signe, DicePool, int ou nom de caractéristique)
+        self.dice_count = sum(term.count for _, term in terms if isinstance(term, DicePool))
+        self.variables = frozenset(term for _, term in terms if isinstance(term, str))
+
+    def bind(self, variables):
+        """Remplace les caractéristiques par leur valeur (ex: {"dexterity": 12})."""
+        if not self.variables:
+            return self
+        terms = []
+        for sign, term in self.terms:
+            if isinstance(term, str):
+                if variables is None or variables.get(term) is None:
+                    raise DiceError(f"Caractéristique inconnue : {term}")
+                term = int(variables[term])
+            terms.append((sign, term))
+        return Expression(self.text, tuple(terms))
+
+    def __str__(self):
+        return self.text
+
+
+class PoolResult:
+    """Résultat d'un groupe de dés : les dés s'ils sont peu nombreux, sinon un résumé."""
+
+    __slots__ = ('pool', 'total', 'dice', 'kept', 'low', 'high')
+
+    def __init__(self, pool, total, dice, kept, low, high):
+        self.pool = pool
+        self.total = total
+        self.dice = dice  # liste des valeurs, ou None pour un gros tirage
+        self.kept = kept  # indices des dés conservés (keep), ou None
+        self.low = low
+        self.high = high
+
+    def describe(self):
+        if self.dice is None:
+            return f"{self.pool} (min {self.low}, max {self.high}, total {self.total})"
+        if self.kept is None:
+            return f"{self.pool} {self.dice}"
+        shown = [str(value) if index in self.kept else f"~~{value}~~" for index, value in enumerate(self.dice)]
+        return f"{self.pool} [{', '.join(shown)}]"
+
+
+class RollResult:
+    __slots__ = ('expression', 'total', 'parts')
+
+    def __init__(self, expression, total, parts):
+        self.expression = expression
+        self.total = total
+        self.parts = parts  # liste de (signe, PoolResult ou int)
+
+    def describe(self):
+        text = ''
+        for index, (sign, part) in enumerate(self.parts):
+            piece = part.describe() if isinstance(part, PoolResult) else str(part)
+            if index == 0:
+                text = piece if sign > 0 else f"-{piece}"
+            else:
+                text += f" {'+' if sign > 0 else '-'} {piece}"
+        return f"{text} = {self.total}"
+
+
+def _parse_pool(count, sides, modifiers):
+    count = int(count) if count else 1
+    sides = 100 if sides == '%' else int(sides)
+    if count < 1 or sides < 2:
+        raise DiceError("Il faut au moins un dé d'au moins deux faces.")
+    if sides > MAX_SIDES:
+        raise DiceError(f"Pas plus de {MAX_SIDES} faces par dé.")
+    keep = None
+    explode = False
+    reroll_values = frozenset()
+    for modifier in _MODIFIER.findall(modifiers):
+        if modifier == '!':
+            explode = True
+        elif modifier.startswith('r'):
+            if modifier.startswith('r<'):
+                reroll_values = frozenset(range(1, int(modifier[2:]) + 1))
+            else:
+                reroll_values = frozenset({int(modifier[1:])})
+            if not reroll_values or len(reroll_values) >= sides or max(reroll_values) > sides:
+                raise DiceError("Relance impossible : il doit rester des faces acceptées.")
+        else:
+            kind = 'l' if modifier.startswith('kl') else 'h'
+            keep = (kind, int(modifier.lstrip('khl')))
+            if keep[1] < 1 or keep[1] > count:
+                raise DiceError("Le nombre de dés conservés doit être entre 1 et le nombre de dés.")
+    if explode and sides in reroll_values:
+        raise DiceError("Un dé ne peut pas à la fois exploser et relancer sa face maximale.")
+    return DicePool(count, sides, keep, explode, reroll_values)
+
+
+@lru_cache(maxsize=1024)
+def _compile(text):
+    if not text:
+        raise DiceError("Expression vide.")
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise DiceError(f"Expression trop longue (max {MAX_EXPRESSION_LENGTH} caractères).")
+    terms = []
+    position = 0
+    for match in _TOKEN.finditer(text):
+        if match.start() != position:
+            break
+        position = match.end()
+        sign = -1 if match.group(1) == '-' else 1
+        token = match.group(2)
+        if token.isdigit():
+            terms.append((sign, int(token)))
+            continue
+        dice = _DICE.match(token)
+        if dice is not None:
+            terms.append((sign, _parse_pool(*dice.groups())))
+        elif _VARIABLE.match(token) and token in VARIABLES:
+            terms.append((sign, VARIABLES[token]))
+        else:
+            raise DiceError(f"Terme invalide : {token}")
+    if position != len(text) or not terms:
+        raise DiceError(f"Expression invalide : {text}")
+    if len(terms) > MAX_TERMS:
+        raise DiceError(f"Pas plus de {MAX_TERMS} termes par expression.")
+    expression = Expression(text, tuple(terms))
+    if expression.dice_count > MAX_DICE:
+        raise DiceError(f"Pas plus de {MAX_DICE} dés par lancer.")
+    return expression
+
+
+def parse(text):
+    """Compile une expression (ex: 4d6kh3+2, 1d20r1+1d4!, 1d20+dexterity). Le résultat est mis en cache."""
+    return _compile(text.replace(' ', '').lower())
+
+
+class _Budget:
+    """Compte les dés tirés pendant un lancer pour respecter MAX_DICE."""
+
+    def __init__(self):
+        self.rolled = 0
+
+    def spend(self, count):
+        self.rolled += count
+        if self.rolled > MAX_DICE:
+            raise DiceError(f"Lancer interrompu : plus de {MAX_DICE} dés tirés.")
+
+
+def _roll_histogram(count, sides, budget, rng):
+    """Tire count dés à sides faces et renvoie {face: nombre}, par lots."""
+    budget.spend(count)
+    histogram = Counter()
+    binomial = getattr(rng, 'binomialvariate', None)
+    if binomial is not None and count > sides:
+        # Multinomiale par binomiales successives : coût proportionnel au nombre de faces
+        remaining = count
+        for face in range(1, sides):
+            if remaining == 0:
+                break
+            drawn = binomial(remaining, 1 / (sides - face + 1))
+            if drawn:
+                histogram[face] = drawn
+            remaining -= drawn
+        if remaining:
+            histogram[sides] = remaining
+        return histogram
+    faces = range(1, sides + 1)
+    while count > 0:
+        batch = min(count, BATCH_SIZE)
+        histogram.update(rng.choices(faces, k=batch))
+        count -= batch
+    return histogram
+
+
+def _apply_rerolls(histogram, pool, budget, rng):
+    rerolled = sum(histogram.pop(face, 0) for face in pool.reroll_values)
+    if rerolled:
+        histogram.update(_roll_histogram(rerolled, pool.sides, budget, rng))
+
+
+def _apply_explosions(histogram, pool, budget, rng):
+    # Un dé qui explose k fois puis donne f vaut sides * k + f
+    pending = histogram.pop(pool.sides, 0)
+    depth = 1
+    while pending:
+        extra = _roll_histogram(pending, pool.sides, budget, rng)
+        pending = extra.pop(pool.sides, 0)
+        for face, number in extra.items():
+            histogram[pool.sides * depth + face] += number
+        if depth == MAX_EXPLOSIONS:
+            histogram[pool.sides * (depth + 1)] += pending
+            break
+        depth += 1
+
+
+def _kept_total(histogram, keep):
+    kind, remaining = keep
+    total = 0
+    for value in sorted(histogram, reverse=(kind == 'h')):
+        taken = min(remaining, histogram[value])
+        total += value * taken
+        remaining -= taken
+        if remaining == 0:
+            break
+    return total
+
+
+def _roll_die(pool, budget, rng):
+    budget.spend(1)
+    value = rng.randint(1, pool.sides)
+    if value in pool.reroll_values:
+        budget.spend(1)
+        value = rng.randint(1, pool.sides)
+    if pool.explode:
+        face = value
+        depth = 0
+        while face == pool.sides and depth < MAX_EXPLOSIONS:
+            budget.spend(1)
+            face = rng.randint(1, pool.sides)
+            value += face
+            depth += 1
+    return value
+
+
+def _roll_pool(pool, budget, rng):
+    if pool.count <= DETAIL_LIMIT:
+        dice = [_roll_die(pool, budget, rng) for _ in range(pool.count)]
+        kept = None
+        if pool.keep:
+            kind, number = pool.keep
+            order = sorted(range(len(dice)), key=dice.__getitem__, reverse=(kind == 'h'))
+            kept = set(order[:number])
+            total = sum(dice[index] for index in kept)
+        else:
+            total = sum(dice)
+        return PoolResult(pool, total, dice, kept, min(dice), max(dice))
+
+    # Gros tirage : seul l'histogramme des valeurs est conservé
+    histogram = _roll_histogram(pool.count, pool.sides, budget, rng)
+    if pool.reroll_values:
+        _apply_rerolls(histogram, pool, budget, rng)
+    if pool.explode:
+        _apply_explosions(histogram, pool, budget, rng)
+    if pool.keep:
+        total = _kept_total(histogram, pool.keep)
+    else:
+        total = sum(value * number for value, number in histogram.items())
+    return PoolResult(pool, total, None, None, min(histogram), max(histogram))
+
+
+def roll(expression, variables=None, rng=random):
+    """Lance une expression (texte ou Expression compilée) et renvoie un RollResult."""
+    if isinstance(expression, str):
+        expression = parse(expression)
+    expression = expression.bind(variables)
+    budget = _Budget()
+    parts = []
+    total = 0
+    for sign, term in expression.terms:
+        if isinstance(term, DicePool):
+            part = _roll_pool(term, budget, rng)
+            total += sign * part.total
+        else:
+            part = term
+            total += sign * term
+        parts.append((sign, part))
+    return RollResult(expression, total, parts)
+
+
+class Distribution:
+    """Loi exacte d'un total : probabilité de chaque valeur de offset à offset + len(probs) - 1."""
+
+    __slots__ = ('offset', 'probs')
+
+    def __init__(self, offset, probs):
+        self.offset = offset
+        self.probs = probs  # tuple de probabilités
+
+    @property
+    def low(self):
+        return self.offset
+
+    @property
+    def high(self):
+        return self.offset + len(self.probs) - 1
+
+    def negate(self):
+        return Distribution(-self.high, self.probs[::-1])
+
+    def shift(self, amount):
+        return Distribution(self.offset + amount, self.probs)
+
+
+def _convolve(a, b):
+    probs = [0.0] * (len(a.probs) + len(b.probs) - 1)
+    for i, p in enumerate(a.probs):
+        if p:
+            for j, q in enumerate(b.probs):
+                probs[i + j] += p * q
+    return Distribution(a.offset + b.offset, tuple(probs))
+
+
+@lru_cache(maxsize=256)
+def _die_distribution(sides, explode, reroll_values):
+    """Loi d'un seul dé, relance et explosion comprises (mêmes règles que roll)."""
+    face = 1 / sides
+    rerolled = len(reroll_values) * face
+    single = [face * rerolled + (0 if value in reroll_values else face) for value in range(1, sides + 1)]
+    if not explode:
+        return Distribution(1, tuple(single))
+    # Un dé qui explose k fois puis donne f vaut sides * k + f
+    probs = [0.0] * (sides * (MAX_EXPLOSIONS + 1))
+    chain = single[-1]
+    for value in range(1, sides):
+        probs[value - 1] = single[value - 1]
+    for depth in range(1, MAX_EXPLOSIONS + 1):
+        for value in range(1, sides):
+            probs[sides * depth + value - 1] = chain * face
+        chain *= face
+    probs[sides * (MAX_EXPLOSIONS + 1) - 1] = chain
+    return Distribution(1, tuple(probs))
+
+
+@lru_cache(maxsize=1024)
+def _sum_distribution(die_key, count):
+    """Loi de la somme de count dés identiques, par puissances mémoïsées (4d6 = 2d6 * 2d6)."""
+    if count == 1:
+        return _die_distribution(*die_key)
+    half = count // 2
+    return _convolve(_sum_distribution(die_key, half), _sum_distribution(die_key, count - half))
+
+
+def _keep_distribution(pool):
+    """Loi de la somme des dés conservés (kh/kl), par programmation dynamique sur les valeurs."""
+    die = _die_distribution(pool.sides, pool.explode, pool.reroll_values)
+    kind, keep = pool.keep
+    values = [(die.offset + index, p) for index, p in enumerate(die.probs) if p]
+    if kind == 'h':
+        values.reverse()
+    # états : (dés déjà placés, somme conservée) -> probabilité
+    states = {(0, 0): 1.0}
+    remaining_mass = 1.0
+    for value, p in values:
+        q = p / remaining_mass if remaining_mass > 0 else 1.0
+        q = min(q, 1.0)
+        next_states = Counter()
+        for (placed, kept_sum), weight in states.items():
+            free = pool.count - placed
+            for number in range(free + 1):
+                chance = math.comb(free, number) * q ** number * (1 - q) ** (free - number)
+                if chance == 0:
+                    continue
+                kept = min(number, max(keep - placed, 0))
+                next_states[(placed + number, kept_sum + kept * value)] += weight * chance
+        states = next_states
+        remaining_mass -= p
+    totals = Counter()
+    for (placed, kept_sum), weight in states.items():
+        if placed == pool.count:
+            totals[kept_sum] += weight
+    low = min(totals)
+    return Distribution(low, tuple(totals.get(value, 0.0) for value in range(low, max(totals) + 1)))
+
+
+@lru_cache(maxsize=512)
+def _pool_distribution(key):
+    count, sides, keep, explode, reroll_values = key
+    pool = DicePool(count, sides, keep, explode, reroll_values)
+    if keep:
+        return _keep_distribution(pool)
+    return _sum_distribution((sides, explode, reroll_values), count)
+
+
+def _check_odds_size(expression):
+    support = 1
+    for _, term in expression.terms:
+        if isinstance(term, DicePool):
+            die_span = term.sides * (MAX_EXPLOSIONS + 1 if term.explode else 1) - 1
+            if term.keep:
+                work = die_span * (term.count + 1) ** 2 * (term.keep[1] * die_span + 1)
+                if work > ODDS_MAX_KEEP_WORK:
+                    raise DiceError("Trop de dés conservés ou de faces pour un calcul exact avec kh/kl.")
+            dice = term.keep[1] if term.keep else term.count
+            support += dice * die_span
+    if support > ODDS_MAX_SUPPORT:
+        raise DiceError(f"Trop de totaux possibles pour un calcul exact (max {ODDS_MAX_SUPPORT}).")
+
+
+class Odds:
+    """Loi exacte du total d'une expression, avec ses statistiques."""
+
+    def __init__(self, expression, distribution):
+        self.expression = expression
+        self.distribution = distribution
+        values = range(distribution.low, distribution.high + 1)
+        self.mean = sum(value * p for value, p in zip(values, distribution.probs))
+        variance = sum((value - self.mean) ** 2 * p for value, p in zip(values, distribution.probs))
+        self.stdev = math.sqrt(max(variance, 0.0))
+        self._cumulative = []
+        total = 0.0
+        for p in distribution.probs:
+            total += p
+            self._cumulative.append(total)
+
+    @property
+    def low(self):
+        return self.distribution.low
+
+    @property
+    def high(self):
+        return self.distribution.high
+
+    def percentile(self, percent):
+        """Plus petit total t tel que P(total <= t) >= percent %."""
+        index = bisect.bisect_left(self._cumulative, percent / 100 - 1e-12)
+        return self.distribution.low + min(index, len(self._cumulative) - 1)
+
+    def at_least(self, target):
+        """Probabilité d'obtenir au moins target (ex: un degré de difficulté)."""
+        index = target - self.distribution.low
+        if index <= 0:
+            return 1.0
+        if index >= len(self._cumulative):
+            return 0.0
+        return max(0.0, 1.0 - self._cumulative[index - 1])
+
+    def sample(self, count, rng=random):
+        """Tire count totaux d'un seul appel dans cette loi (ex: les dégâts de toutes les cibles d'un sort)."""
+        return rng.choices(range(self.low, self.high + 1), cum_weights=self._cumulative, k=count)
+
+    def to_dict(self, target=None):
+        result = {
+            "expression": str(self.expression),
+            "min": self.low,
+            "max": self.high,
+            "mean": round(self.mean, 4),
+            "stdev": round(self.stdev, 4),
+            "percentiles": {str(percent): self.percentile(percent) for percent in PERCENTILES},
+            "distribution": [
+                {"total": self.low + index, "probability": p}
+                for index, p in enumerate(self.distribution.probs) if p
+            ]
+        }
+        if target is not None:
+            result["target"] = target
+            result["at_least"] = self.at_least(target)
+        return result
+
+
+def odds(expression, variables=None):
+    """Calcule la loi exacte d'une expression (texte ou Expression compilée).
+
+    Les lois des dés et de leurs sommes sont mémoïsées : 16d6 réutilise 8d6,
+    et une expression déjà demandée ne coûte presque plus rien.
+    """
+    if isinstance(expression, str):
+        expression = parse(expression)
+    expression = expression.bind(variables)
+    _check_odds_size(expression)
+    distribution = Distribution(0, (1.0,))
+    for sign, term in expression.terms:
+        if isinstance(term, DicePool):
+            part = _pool_distribution(term.key)
+            distribution = _convolve(distribution, part if sign > 0 else part.negate())
+        else:
+            distribution = distribution.shift(sign * term)
+    return Odds(expression, distribution)
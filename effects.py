@@ -0,0 +1,142 @@
+import asyncio
+import heapq
+import logging
+import time
+
+
+class EffectScheduler:
+    """Expiration des effets temporaires (invisibilité, cooldown des sorts...).
+
+    Les échéances sont rangées dans un tas ; un seul minuteur de la boucle
+    d'événements est armé, sur la plus proche. Aucune vérification périodique :
+    le rappel de chaque type d'effet est appelé à l'heure dite, et les effets
+    en attente sont enregistrés dans la base pour survivre à un redémarrage.
+    """
+
+    def __init__(self, repository, owns=None):
+        self.repository = repository
+        # owns(guild_id) : en mode multi-processus, seuls les effets des guildes du shard sont rechargés
+        self.owns = owns
+        self._handlers = {}  # type d'effet -> coroutine(user_id, channel_id)
+        self._heap = []  # (expires_at, seq, (user_id, kind))
+        self._active = {}  # (user_id, kind) -> (expires_at, seq, channel_id)
+        self._seq = 0
+        self._timer = None
+        self._tasks = set()
+        self._undeleted = []  # effets expirés restés dans la base après une erreur d'écriture
+
+    def on(self, kind, handler):
+        """Enregistre la coroutine appelée à l'expiration des effets de ce type."""
+        self._handlers[kind] = handler
+
+    def __len__(self):
+        return len(self._active)
+
+    def _push(self, user_id, kind, expires_at, channel_id):
+        self._seq += 1
+        key = (user_id, kind)
+        self._active[key] = (expires_at, self._seq, channel_id)
+        heapq.heappush(self._heap, (expires_at, self._seq, key))
+        # Les entrées remplacées restent dans le tas : on le reconstruit s'il grossit trop
+        if len(self._heap) > 2 * len(self._active) + 1024:
+            self._heap = [(at, seq, key) for key, (at, seq, _) in self._active.items()]
+            heapq.heapify(self._heap)
+
+    def _arm(self):
+        """Arme le minuteur sur l'échéance la plus proche."""
+        while self._heap:
+            expires_at, seq, key = self._heap[0]
+            active = self._active.get(key)
+            if active is not None and active[1] == seq:
+                break
+            heapq.heappop(self._heap)  # entrée annulée ou remplacée
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._heap:
+            delay = max(0.0, self._heap[0][0] - time.time())
+            self._timer = asyncio.get_running_loop().call_later(delay, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        now = time.time()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self._heap)
+            active = self._active.get(key)
+            if active is None or active[1] != seq:
+                continue
+            del self._active[key]
+            expired.append((key, active))
+        if expired:
+            task = asyncio.create_task(self._expire(expired))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._arm()
+
+    async def _expire(self, expired):
+        # Une erreur de la base ne doit pas empêcher d'annoncer la fin des effets :
+        # les lignes non supprimées le seront avec le prochain lot d'effets expirés
+        rows = self._undeleted + [(user_id, kind, expires_at) for (user_id, kind), (expires_at, _, _) in expired]
+        self._undeleted = []
+        try:
+            await self.repository.write(_delete_effects, rows)
+        except Exception as e:
+            logging.error(f"Erreur à la suppression de {len(rows)} effet(s) expiré(s) : {e}")
+            self._undeleted = rows
+        for (user_id, kind), (_, _, channel_id) in expired:
+            handler = self._handlers.get(kind)
+            if handler is None:
+                continue
+            try:
+                await handler(user_id, channel_id)
+            except Exception as e:
+                logging.error(f"Erreur à l'expiration de l'effet {kind} de {user_id} : {e}")
+
+    async def start(self):
+        """Recharge les effets en attente depuis la base et arme le minuteur."""
+        rows = await self.repository.read(_load_effects)
+        loaded = 0
+        for user_id, kind, expires_at, channel_id, guild_id in rows:
+            if self.owns is not None and not self.owns(guild_id):
+                continue
+            if (user_id, kind) not in self._active:
+                self._push(user_id, kind, expires_at, channel_id)
+                loaded += 1
+        self._arm()
+        logging.info(f"{loaded} effet(s) en attente rechargé(s)")
+
+    async def schedule(self, user_id, kind, expires_at, channel_id=None, guild_id=None):
+        """Programme (ou reprogramme) l'expiration d'un effet à expires_at (timestamp)."""
+        self._push(user_id, kind, expires_at, channel_id)
+        self._arm()
+        await self.repository.write(_save_effect, user_id, kind, expires_at, channel_id, guild_id)
+
+    async def cancel(self, user_id, kind):
+        if self._active.pop((user_id, kind), None) is not None:
+            self._arm()
+            await self.repository.write(_delete_effects, [(user_id, kind, None)])
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def _load_effects(conn):
+    return conn.execute('SELECT user_id, kind, expires_at, channel_id, guild_id FROM effects').fetchall()
+
+
+def _save_effect(conn, user_id, kind, expires_at, channel_id, guild_id):
+    conn.execute(
+        'INSERT OR REPLACE INTO effects (user_id, kind, expires_at, channel_id, guild_id) VALUES (?, ?, ?, ?, ?)',
+        (user_id, kind, expires_at, channel_id, guild_id)
+    )
+
+
+def _delete_effects(conn, effects):
+    # expires_at à None : suppression quelle que soit l'échéance (annulation)
+    conn.executemany(
+        'DELETE FROM effects WHERE user_id = ? AND kind = ? AND (?3 IS NULL OR expires_at = ?3)',
+        effects
+    )
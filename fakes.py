@@ -0,0 +1,71 @@
+"""Faux objets Discord, partagés par le banc d'essai, les shards simulés (sharding.py) et les tests.
+
+Ni connexion à Discord, ni effet à l'import : les commandes du bot sont
+appelées avec ces objets, et la file d'envoi passe par StubTransport.
+"""
+import asyncio
+
+
+class FakeMember:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.mention = f"<@{id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+
+class FakeChannel:
+    """Salon qui compte les messages au lieu de les envoyer."""
+
+    def __init__(self, id):
+        self.id = id
+        self.messages = 0
+
+    async def send(self, content=None, **kwargs):
+        self.messages += 1
+        return FakeMessage(self, content)
+
+
+class StubTransport:
+    """Transport local de la file d'envoi : simule la durée d'un appel à l'API de Discord."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.posts = 0
+        self.edits = 0
+
+    async def post(self, channel, content):
+        await asyncio.sleep(self.latency)
+        self.posts += 1
+        return await channel.send(content)
+
+    async def edit(self, message, content):
+        await asyncio.sleep(self.latency)
+        self.edits += 1
+        message.content = content
+
+
+class FakeContext:
+    """Comme RPGContext : les messages passent par la file d'envoi du bot."""
+
+    def __init__(self, bot_mj, author, guild, channel):
+        self.bot_mj = bot_mj
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+
+    async def send(self, content=None, **kwargs):
+        await self.bot_mj.outbox.send(self.channel, content)
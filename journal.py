@@ -0,0 +1,368 @@
+"""Journal des modifications des personnages, instantanés et relecture.
+
+Chaque modification d'un personnage (!create, !take_damage, !heal, !gain_xp,
+sorts...) est ajoutée à la table journal, jamais modifiée ni effacée : le
+cache des personnages (cache.py) les accumule et les écrit par lots, dans la
+même transaction que les personnages eux-mêmes. La table characters reste
+l'état courant ; le journal permet de retrouver n'importe quel état passé :
+
+    python journal.py history 1234                         # dernières modifications
+    python journal.py show 1234 --at 2026-10-18T21:30      # état à une date
+    python journal.py restore --user 1234 --at 2026-10-18T21:30   # annuler une erreur
+    python journal.py restore                              # reconstruire toute la table
+    python journal.py verify                               # comparer table et journal
+    python journal.py snapshot
+
+Un état se reconstruit à partir du dernier instantané (copie de la table
+characters) puis des entrées qui le suivent. Le bot prend un instantané dès
+que SNAPSHOT_EVERY entrées se sont accumulées : la reconstruction au
+démarrage (table characters vide) ne relit qu'une queue de journal bornée.
+
+Les restaurations modifient la base directement : elles sont refusées tant
+qu'un bot ou un coordinateur la garde en cache (verrou de db.exclusive_access),
+sinon son cache réécrirait les anciennes valeurs.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from contextlib import closing
+from datetime import datetime
+
+import db
+import logs
+import migrations
+
+# Entrées de journal entre deux instantanés
+SNAPSHOT_EVERY = 10_000
+# Intervalle de vérification du nombre d'entrées depuis le dernier instantané (en secondes)
+SNAPSHOT_CHECK_INTERVAL = 60.0
+# Instantanés gardés en plus du premier (qui permet de remonter jusqu'au début du journal)
+KEEP_SNAPSHOTS = 3
+
+# Types d'entrées : personnage complet, modification de quelques colonnes, suppression
+PUT = 'put'
+UPDATE = 'update'
+DELETE = 'delete'
+
+
+class JournalError(ValueError):
+    pass
+
+
+def _encode(fields):
+    # Delta(-5) -> [-5] ; une valeur absolue reste telle quelle
+    return json.dumps(
+        {column: [value.amount] if isinstance(value, db.Delta) else value for column, value in fields.items()},
+        separators=(',', ':'), ensure_ascii=False
+    )
+
+
+def entry(user_id, kind, fields=None, action=None, at=None):
+    """Entrée de journal prête à écrire (db._append_journal).
+
+    action : nom de la commande à l'origine de la modification (par défaut
+    celle en cours, voir logs.current_command).
+    """
+    return (
+        time.time() if at is None else at,
+        user_id,
+        kind,
+        action if action is not None else logs.current_command.get(),
+        _encode(fields) if fields is not None else None
+    )
+
+
+def character_entry(user_id, character, action=None, at=None):
+    """Entrée PUT d'un personnage complet (dict)."""
+    row = db.character_to_row(user_id, character)
+    return entry(user_id, PUT, dict(zip(db.CHARACTER_COLUMNS[1:], row[1:])), action, at)
+
+
+def _apply(characters, user_id, kind, data):
+    if kind == DELETE:
+        characters.pop(user_id, None)
+        return True
+    fields = json.loads(data)
+    if kind == PUT:
+        characters[user_id] = {"user_id": user_id, **fields}
+        return True
+    character = characters.get(user_id)
+    if character is None:
+        return False  # Modification d'un personnage inconnu à cette date
+    for column, value in fields.items():
+        if isinstance(value, list):
+            character[column] = (character[column] or 0) + value[0]
+        else:
+            character[column] = value
+    return True
+
+
+def latest_snapshot(conn, at=None):
+    """Dernier instantané (id, seq, created_at), pris au plus tard à la date at."""
+    if at is None:
+        return conn.execute('SELECT id, seq, created_at FROM snapshots ORDER BY seq DESC, id DESC LIMIT 1').fetchone()
+    return conn.execute(
+        'SELECT id, seq, created_at FROM snapshots WHERE created_at <= ? ORDER BY seq DESC, id DESC LIMIT 1', (at,)
+    ).fetchone()
+
+
+def replay(conn, at=None, user_ids=None):
+    """Reconstruit les personnages (tous, ou seulement user_ids) tels qu'ils étaient à la date at.
+
+    Renvoie ({user_id: personnage}, numéro de la dernière entrée relue).
+    """
+    snapshot = latest_snapshot(conn, at)
+    if snapshot is None:
+        raise JournalError("Aucun instantané avant cette date : l'historique commence plus tard.")
+    snapshot_id, seq, _ = snapshot
+    where = ''
+    params = []
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        where = f" AND user_id IN ({', '.join('?' * len(user_ids))})"
+        params = user_ids
+    characters = {}
+    columns = ', '.join(f'"{column}"' for column in db.CHARACTER_COLUMNS)
+    for row in conn.execute(
+        f'SELECT {columns} FROM snapshot_characters WHERE snapshot_id = ?{where}', (snapshot_id, *params)
+    ):
+        characters[row[0]] = db.row_to_character(row)
+    query = f'SELECT seq, user_id, kind, data FROM journal WHERE seq > ?{where}'
+    if at is not None:
+        query += ' AND at <= ?'
+        params = params + [at]
+    last = seq
+    skipped = 0
+    cursor = conn.execute(query + ' ORDER BY seq', (seq, *params))
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            break
+        for last, user_id, kind, data in rows:
+            if not _apply(characters, user_id, kind, data):
+                skipped += 1
+    if skipped:
+        logging.warning(f"Journal : {skipped} modification(s) de personnages absents ignorée(s)")
+    return characters, last
+
+
+def history(conn, user_id, limit=20):
+    """Dernières entrées du journal d'un personnage, de la plus récente à la plus ancienne."""
+    return [
+        {"seq": seq, "at": at, "kind": kind, "action": action, "data": json.loads(data) if data else None}
+        for seq, at, kind, action, data in conn.execute(
+            'SELECT seq, at, kind, action, data FROM journal WHERE user_id = ? ORDER BY seq DESC LIMIT ?',
+            (user_id, limit)
+        )
+    ]
+
+
+def snapshot(conn):
+    """Copie la table characters dans un nouvel instantané ; renvoie son id.
+
+    À appeler dans une transaction : l'instantané correspond exactement au
+    journal à la même date. Seuls le premier et les KEEP_SNAPSHOTS derniers
+    instantanés sont gardés.
+    """
+    seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM journal').fetchone()[0]
+    cursor = conn.execute(
+        'INSERT INTO snapshots (seq, created_at, characters) SELECT ?, ?, COUNT(*) FROM characters',
+        (seq, time.time())
+    )
+    snapshot_id = cursor.lastrowid
+    conn.execute('INSERT INTO snapshot_characters SELECT ?, * FROM characters', (snapshot_id,))
+    obsolete = [row[0] for row in conn.execute(
+        'SELECT id FROM snapshots WHERE id != (SELECT MIN(id) FROM snapshots) ORDER BY id DESC LIMIT -1 OFFSET ?',
+        (KEEP_SNAPSHOTS,)
+    )]
+    for old_id in obsolete:
+        conn.execute('DELETE FROM snapshot_characters WHERE snapshot_id = ?', (old_id,))
+        conn.execute('DELETE FROM snapshots WHERE id = ?', (old_id,))
+    logging.info(f"Instantané {snapshot_id} des personnages pris (journal jusqu'à l'entrée {seq})")
+    return snapshot_id
+
+
+def snapshot_if_needed(conn, every=SNAPSHOT_EVERY):
+    """Prend un instantané si au moins every entrées ont été ajoutées depuis le dernier."""
+    last = latest_snapshot(conn)
+    since = last[1] if last else 0
+    pending = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM journal').fetchone()[0] - since
+    if pending < every:
+        return None
+    return snapshot(conn)
+
+
+async def snapshot_loop(repository, interval=SNAPSHOT_CHECK_INTERVAL, every=SNAPSHOT_EVERY):
+    """Tâche de fond : instantané dès que every entrées se sont accumulées (dans le thread écrivain)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await repository.write(snapshot_if_needed, every)
+        except Exception as e:
+            logging.error(f"Erreur lors de l'instantané des personnages : {e}")
+
+
+def restore(conn, at=None, user_ids=None, record=True):
+    """Remet les personnages (tous, ou seulement user_ids) dans leur état à la date at.
+
+    Avec record, chaque personnage modifié par la restauration reçoit une
+    entrée de journal : l'historique reste complet. Renvoie le nombre de
+    personnages modifiés. À appeler dans une transaction.
+    """
+    characters, _ = replay(conn, at, user_ids)
+    if user_ids is None:
+        current = {row[0]: db.row_to_character(row) for row in conn.execute('SELECT * FROM characters')}
+    else:
+        user_ids = list(user_ids)
+        current = {
+            row[0]: db.row_to_character(row) for row in conn.execute(
+                f"SELECT * FROM characters WHERE user_id IN ({', '.join('?' * len(user_ids))})", user_ids
+            )
+        }
+    rows = []
+    removed = []
+    for user_id, character in characters.items():
+        if current.get(user_id) != character:
+            rows.append(db.character_to_row(user_id, character))
+    for user_id in current.keys() - characters.keys():
+        removed.append(user_id)
+    if rows:
+        db._insert_characters(conn, rows)
+    conn.executemany('DELETE FROM characters WHERE user_id = ?', [(user_id,) for user_id in removed])
+    if record:
+        now = time.time()
+        db._append_journal(conn, [
+            *(entry(row[0], PUT, dict(zip(db.CHARACTER_COLUMNS[1:], row[1:])), 'restore', now) for row in rows),
+            *(entry(user_id, DELETE, action='restore', at=now) for user_id in removed)
+        ])
+    return len(rows) + len(removed)
+
+
+def restore_characters(conn, at=None, user_ids=None, dry_run=False):
+    """restore dans sa propre transaction ; avec dry_run, compte sans rien écrire.
+
+    Lève db.DatabaseBusy si un bot ou un coordinateur utilise la base : son
+    cache réécrirait les anciennes valeurs par-dessus la restauration.
+    """
+    if not dry_run:
+        with db.exclusive_access(conn.execute('PRAGMA database_list').fetchone()[2]):
+            with conn:
+                return restore(conn, at, user_ids)
+    with conn:
+        changed = restore(conn, at, user_ids)
+        conn.rollback()
+    return changed
+
+
+def recover(conn):
+    """Au démarrage : reconstruit la table characters si elle est vide alors que le journal ne l'est pas.
+
+    Renvoie le nombre de personnages restaurés.
+    """
+    if conn.execute('SELECT 1 FROM characters LIMIT 1').fetchone() is not None:
+        return 0
+    if conn.in_transaction:
+        conn.commit()
+    start = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Un autre processus a pu reconstruire la table pendant l'attente du verrou
+        if conn.execute('SELECT 1 FROM characters LIMIT 1').fetchone() is not None:
+            conn.rollback()
+            return 0
+        restored = restore(conn, record=False)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if restored:
+        logging.warning(
+            f"Table characters vide : {restored} personnage(s) reconstruit(s) depuis le journal "
+            f"en {time.perf_counter() - start:.2f} s"
+        )
+    return restored
+
+
+def verify(conn):
+    """Compare la table characters avec l'état reconstruit ; renvoie les identifiants qui diffèrent."""
+    characters, _ = replay(conn)
+    current = {row[0]: db.row_to_character(row) for row in conn.execute('SELECT * FROM characters')}
+    return sorted(
+        user_id for user_id in characters.keys() | current.keys()
+        if characters.get(user_id) != current.get(user_id)
+    )
+
+
+def parse_time(text):
+    """Date ISO (heure locale, ex: 2026-10-18T21:30) ou timestamp Unix."""
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"date invalide : {text} (ex: 2026-10-18T21:30)") from None
+
+
+def _format_time(at):
+    return datetime.fromtimestamp(at).isoformat(sep=' ', timespec='seconds')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Journal des modifications des personnages")
+    parser.add_argument('--database', default=db.DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    history_parser = commands.add_parser('history', help="dernières modifications d'un personnage")
+    history_parser.add_argument('user_id')
+    history_parser.add_argument('--limit', type=int, default=20)
+    show_parser = commands.add_parser('show', help="état d'un personnage à une date")
+    show_parser.add_argument('user_id')
+    show_parser.add_argument('--at', type=parse_time)
+    restore_parser = commands.add_parser('restore', help="remettre des personnages dans leur état à une date")
+    restore_parser.add_argument('--user', action='append', dest='users', help="identifiant (répétable) ; par défaut tous")
+    restore_parser.add_argument('--at', type=parse_time, help="date ; par défaut l'état le plus récent du journal")
+    restore_parser.add_argument('--dry-run', action='store_true')
+    commands.add_parser('verify', help="comparer la table characters et le journal")
+    commands.add_parser('snapshot', help="prendre un instantané maintenant")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        with closing(db.connect(args.database)) as conn:
+            migrations.migrate(conn)
+            if args.command == 'history':
+                for item in history(conn, args.user_id, args.limit):
+                    print(f"#{item['seq']} {_format_time(item['at'])} {item['kind']} "
+                          f"{item['action'] or '-'} {json.dumps(item['data'], ensure_ascii=False)}")
+            elif args.command == 'show':
+                characters, seq = replay(conn, args.at, [args.user_id])
+                character = characters.get(args.user_id)
+                if character is None:
+                    parser.exit(1, f"Aucun personnage {args.user_id} à cette date\n")
+                print(json.dumps({"seq": seq, "character": character}, indent=2, ensure_ascii=False))
+            elif args.command == 'restore':
+                start = time.perf_counter()
+                changed = restore_characters(conn, args.at, args.users, args.dry_run)
+                logging.info(
+                    f"{changed} personnage(s) {'à restaurer' if args.dry_run else 'restauré(s)'} "
+                    f"en {time.perf_counter() - start:.2f} s"
+                )
+            elif args.command == 'verify':
+                different = verify(conn)
+                if different:
+                    print(f"{len(different)} personnage(s) diffèrent du journal : {', '.join(different[:20])}")
+                    sys.exit(1)
+                print("La table characters correspond au journal.")
+            else:
+                with conn:
+                    snapshot(conn)
+    except (JournalError, db.DatabaseBusy) as e:
+        parser.exit(1, f"Erreur : {e}\n")
+
+
+if __name__ == '__main__':
+    main()
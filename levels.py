@@ -0,0 +1,79 @@
+import bisect
+import os
+
+from db import Delta
+
+# Règle historique : 100 XP par niveau (l'XP était remise à zéro à chaque niveau)
+XP_PER_LEVEL = 100
+MAX_LEVEL = 100
+
+
+class LevelError(ValueError):
+    """Table de progression invalide."""
+
+
+class LevelTable:
+    """Progression : XP cumulée nécessaire pour atteindre chaque niveau.
+
+    thresholds[i] est l'XP totale du niveau i + 1 (le premier seuil vaut 0).
+    Le niveau correspondant à une XP est une bisection dans la table : un
+    gain important fait passer plusieurs niveaux d'un coup, sans perdre
+    l'XP en trop.
+    """
+
+    __slots__ = ('thresholds',)
+
+    def __init__(self, thresholds):
+        thresholds = tuple(int(threshold) for threshold in thresholds)
+        if not thresholds or thresholds[0] != 0:
+            raise LevelError("Le premier seuil (niveau 1) doit être 0.")
+        if any(following <= previous for previous, following in zip(thresholds, thresholds[1:])):
+            raise LevelError("Les seuils d'XP doivent être strictement croissants.")
+        self.thresholds = thresholds
+
+    @classmethod
+    def linear(cls, step=XP_PER_LEVEL, max_level=MAX_LEVEL):
+        return cls(step * index for index in range(max_level))
+
+    @classmethod
+    def parse(cls, text):
+        """Lit une table écrite "0,300,900,2700" (XP cumulée des niveaux 1, 2, 3...)."""
+        try:
+            return cls(part for part in text.replace(' ', '').split(',') if part)
+        except ValueError as e:
+            if isinstance(e, LevelError):
+                raise
+            raise LevelError(f"Table de progression invalide : {text}") from None
+
+    @property
+    def max_level(self):
+        return len(self.thresholds)
+
+    def level_for(self, xp):
+        """Niveau atteint avec xp points d'expérience cumulés."""
+        return max(1, bisect.bisect_right(self.thresholds, xp))
+
+    def threshold(self, level):
+        """XP cumulée nécessaire pour atteindre level (niveaux au-delà de la table : dernier seuil)."""
+        return self.thresholds[min(max(level, 1), self.max_level) - 1]
+
+    def next_threshold(self, level):
+        """XP cumulée du niveau suivant, ou None au niveau maximal."""
+        return self.thresholds[level] if 0 < level < self.max_level else None
+
+    def award(self, character, amount):
+        """Champs à modifier pour ajouter amount XP à un personnage.
+
+        Le niveau ne redescend jamais (table modifiée, niveau fixé par le MJ...).
+        """
+        level = max(character["level"] or 1, self.level_for((character["xp"] or 0) + amount))
+        fields = {"xp": Delta(amount)}
+        if level != character["level"]:
+            fields["level"] = level
+        return fields
+
+
+def from_environment():
+    """Table du bot, de l'interface web et des imports : LEVEL_THRESHOLDS=0,300,900,2700, sinon linear()."""
+    text = os.getenv('LEVEL_THRESHOLDS')
+    return LevelTable.parse(text) if text else LevelTable.linear()
@@ -0,0 +1,133 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+# Commande en cours d'exécution (renseignée avant chaque commande du bot)
+current_command = contextvars.ContextVar('current_command', default=None)
+
+# Attributs standard d'un LogRecord : tout le reste (extra=...) est recopié dans le JSON
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'command'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par message : {"time", "level", "logger", "message", "command", ...}."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        command = getattr(record, 'command', None)
+        if command is not None:
+            entry["command"] = command
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RotatingFileHandler(TimedRotatingFileHandler):
+    """Rotation à heure fixe (par défaut à minuit) et dès que le fichier dépasse max_bytes."""
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, when='midnight', backup_count=7):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding='utf-8')
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def rotation_filename(self, default_name):
+        # Plusieurs rotations par taille dans la même période : rpg_bot.log.2025-03-08.1, .2...
+        name = super().rotation_filename(default_name)
+        index = 0
+        candidate = name
+        while os.path.exists(candidate):
+            index += 1
+            candidate = f"{name}.{index}"
+        return candidate
+
+
+class CommandSampler(logging.Filter):
+    """Ne garde qu'un message sur N pour les commandes très utilisées (ex: {"roll": 10}).
+
+    Les avertissements et erreurs sont toujours gardés. Le filtre tourne dans le
+    thread de l'appelant : un message écarté ne coûte presque rien.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._counters = {}
+
+    def filter(self, record):
+        command = current_command.get()
+        record.command = command
+        rate = self.rates.get(command, 1)
+        if rate <= 1 or record.levelno >= logging.WARNING:
+            return True
+        count = self._counters.get(command, 0)
+        self._counters[command] = count + 1
+        if count % rate:
+            return False
+        record.sampled = rate
+        return True
+
+
+def parse_sampling(text):
+    """"roll=10,odds=5" -> {"roll": 10, "odds": 5}."""
+    rates = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        command, _, rate = part.partition('=')
+        try:
+            rates[command.strip()] = max(1, int(rate))
+        except ValueError:
+            logging.warning(f"Échantillonnage des logs ignoré pour '{part}'")
+    return rates
+
+
+class _Listener(QueueListener):
+    """QueueListener qui peut être arrêté deux fois : à la main, puis à la sortie du processus."""
+
+    running = False
+
+    def start(self):
+        super().start()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            super().stop()
+
+
+def setup_logging(filename, level=logging.INFO, max_bytes=10 * 1024 * 1024, backup_count=7, sampling=None):
+    """Configure les logs : le fichier est écrit par un thread dédié, l'appelant ne fait que déposer
+    le message dans une file. Renvoie le QueueListener (arrêté automatiquement à la sortie)."""
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    handler.addFilter(CommandSampler(sampling or {}))
+    file_handler = RotatingFileHandler(filename, max_bytes=max_bytes, backup_count=backup_count)
+    file_handler.setFormatter(JsonFormatter())
+    listener = _Listener(records, file_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(level)
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    listener.start()
+    # Les messages encore dans la file sont écrits avant la fin du processus
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,214 @@
+import asyncio
+import base64
+import bisect
+import hmac
+import logging
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bornes des histogrammes, en secondes
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Histogramme cumulable au format Prometheus (une case par borne, plus +Inf)."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimation : borne supérieure de la case qui contient le quantile q."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def _render_histogram(lines, name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+    lines.append(f'{name}_sum{_labels(**labels)} {histogram.sum}')
+    lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+
+
+class Metrics:
+    """Mesures du bot : durée des commandes, requêtes SQL, cache et retard de la boucle.
+
+    Une mesure coûte un perf_counter() et une bisection : elles restent
+    actives en production. Les valeurs sont exposées au format Prometheus
+    (render) et en résumé lisible (summary, pour !stats).
+    """
+
+    def __init__(self):
+        self.commands = {}  # commande -> Histogram
+        self.errors = {}  # commande -> nombre d'échecs
+        self.queries = {}  # (read|write, requête) -> Histogram
+        self.loop_lag = Histogram()
+        self._gauges = []  # (nom, type, aide, fonction sans argument)
+
+    def observe_command(self, name, seconds, failed=False):
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands[name] = Histogram()
+        histogram.observe(seconds)
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def observe_query(self, kind, name, seconds):
+        """Appelé depuis les threads de la base."""
+        key = (kind, name)
+        histogram = self.queries.get(key)
+        if histogram is None:
+            histogram = self.queries.setdefault(key, Histogram())
+        histogram.observe(seconds)
+
+    def gauge(self, name, help, fn, kind='gauge'):
+        """Valeur lue au moment de l'export (ex: taille du cache)."""
+        self._gauges.append((name, kind, help, fn))
+
+    async def monitor_loop(self, interval=0.5):
+        """Mesure le retard de la boucle d'événements : écart entre le réveil prévu et le réveil réel."""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, time.perf_counter() - start - interval))
+
+    def render(self):
+        """Export au format texte de Prometheus (route /metrics)."""
+        lines = [
+            '# HELP rpg_command_duration_seconds Durée des commandes du bot',
+            '# TYPE rpg_command_duration_seconds histogram',
+        ]
+        for name, histogram in sorted(self.commands.items()):
+            _render_histogram(lines, 'rpg_command_duration_seconds', {'command': name}, histogram)
+        lines += [
+            '# HELP rpg_command_errors_total Commandes terminées par une erreur',
+            '# TYPE rpg_command_errors_total counter',
+        ]
+        for name, count in sorted(self.errors.items()):
+            lines.append(f'rpg_command_errors_total{_labels(command=name)} {count}')
+        lines += [
+            '# HELP rpg_db_query_duration_seconds Durée des requêtes SQL (dans les threads de la base)',
+            '# TYPE rpg_db_query_duration_seconds histogram',
+        ]
+        for (kind, name), histogram in sorted(self.queries.items()):
+            _render_histogram(lines, 'rpg_db_query_duration_seconds', {'kind': kind, 'query': name}, histogram)
+        lines += [
+            '# HELP rpg_event_loop_lag_seconds Retard de la boucle d\'événements',
+            '# TYPE rpg_event_loop_lag_seconds histogram',
+        ]
+        _render_histogram(lines, 'rpg_event_loop_lag_seconds', {}, self.loop_lag)
+        for name, kind, help, fn in self._gauges:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {fn()}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, limit=10):
+        """Résumé lisible : commandes et requêtes les plus utilisées (p50 / p95 estimés)."""
+        lines = ["Commandes (appels, erreurs, p50, p95) :"]
+        commands = sorted(self.commands.items(), key=lambda item: item[1].count, reverse=True)
+        for name, histogram in commands[:limit]:
+            lines.append(
+                f"  !{name} : {histogram.count}, {self.errors.get(name, 0)}, "
+                f"{_format_seconds(histogram.quantile(0.5))}, {_format_seconds(histogram.quantile(0.95))}"
+            )
+        lines.append("Requêtes SQL (appels, p50, p95) :")
+        queries = sorted(self.queries.items(), key=lambda item: item[1].count, reverse=True)
+        for (kind, name), histogram in queries[:limit]:
+            lines.append(
+                f"  {kind} {name} : {histogram.count}, "
+                f"{_format_seconds(histogram.quantile(0.5))}, {_format_seconds(histogram.quantile(0.95))}"
+            )
+        lines.append(f"Retard de la boucle (p95) : {_format_seconds(self.loop_lag.quantile(0.95))}")
+        return '\n'.join(lines)
+
+
+def _format_seconds(seconds):
+    if seconds == float('inf'):
+        return f"> {BUCKETS[-1]:g} s"
+    return f"≤ {seconds * 1000:g} ms"
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    """Résumé de latences mesurées, en millisecondes (banc d'essai, shards simulés)."""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "mean_ms": statistics.fmean(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000 if values else 0.0,
+    }
+
+
+def serve(metrics, host='127.0.0.1', port=9100, credentials=None):
+    """Sert GET /metrics dans un thread, indépendamment de l'interface web.
+
+    credentials : (utilisateur, mot de passe) pour exiger une authentification
+    HTTP Basic. Renvoie le serveur (shutdown() pour l'arrêter).
+    """
+    expected = None
+    if credentials is not None:
+        expected = b'Basic ' + base64.b64encode(':'.join(credentials).encode())
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            # Comparaison d'octets : compare_digest refuse les chaînes non ASCII (en-tête quelconque)
+            header = self.headers.get('Authorization', '').encode('utf-8', 'surrogateescape')
+            if expected is not None and not hmac.compare_digest(header, expected):
+                self.send_response(401)
+                self.send_header('WWW-Authenticate', 'Basic realm="metrics"')
+                self.end_headers()
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(f"/metrics : {format % args}")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Métriques servies sur http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,313 @@
+import logging
+import sqlite3
+import time
+
+import db
+
+# Durée maximale attendue de la vérification du schéma au démarrage (en secondes)
+STARTUP_BUDGET = 0.25
+
+
+# Étape 1 : schéma de base (reprend les tables créées avant les migrations)
+def _create_base_tables(conn):
+    _migrate_characters(conn)
+    # Combats en cours : une ligne par guilde et une ligne par participant
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS combat_encounters (
+            guild_id INTEGER PRIMARY KEY,
+            next_index INTEGER NOT NULL DEFAULT 0,
+            turn INTEGER NOT NULL DEFAULT 0,
+            started_at INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS combat_participants (
+            guild_id INTEGER NOT NULL,
+            user_id TEXT NOT NULL,
+            name TEXT,
+            initiative INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    # Quêtes, inventaires (quantité par objet) et compétences
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quests (
+            name TEXT PRIMARY KEY,
+            description TEXT,
+            started INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory (
+            user_id TEXT NOT NULL,
+            item TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, item)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS skills (
+            user_id TEXT NOT NULL,
+            skill TEXT NOT NULL,
+            PRIMARY KEY (user_id, skill)
+        ) WITHOUT ROWID
+    ''')
+    # Compteur de version par table, incrémenté par des triggers à chaque écriture
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('characters', 0)")
+    # La table a pu être convertie : les versions déjà distribuées ne sont plus valables
+    conn.execute("UPDATE table_versions SET version = version + 1 WHERE name = 'characters'")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS characters_version_{event.lower()}
+            AFTER {event} ON characters
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'characters';
+            END
+        ''')
+
+
+def _create_characters(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS characters (
+            user_id TEXT PRIMARY KEY,
+            name TEXT,
+            race TEXT,
+            class TEXT,
+            level INTEGER,
+            xp INTEGER,
+            hp INTEGER,
+            strength INTEGER,
+            dexterity INTEGER,
+            constitution INTEGER,
+            intelligence INTEGER,
+            wisdom INTEGER,
+            charisma INTEGER,
+            invisible_until INTEGER,
+            last_spell_used INTEGER
+        )
+    ''')
+
+
+# Valeurs des colonnes absentes d'une ancienne table characters
+_LEGACY_DEFAULTS = {"level": "1", "xp": "0", "invisible_until": "0", "last_spell_used": "0"}
+
+
+def _migrate_characters(conn):
+    """Crée la table characters, en convertissant l'ancien format (id INTEGER, sans xp) s'il existe."""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(characters)')]
+    if not columns or 'user_id' in columns:
+        _create_characters(conn)
+        return
+    # Ancien format (celui de rpg.db) : les lignes sont recopiées, rien n'est perdu
+    conn.execute('ALTER TABLE characters RENAME TO characters_legacy')
+    _create_characters(conn)
+    selected = []
+    for column in db.CHARACTER_COLUMNS:
+        if column == 'user_id':
+            selected.append('CAST(id AS TEXT)')
+        elif column in columns:
+            selected.append(f'"{column}"')
+        else:
+            selected.append(_LEGACY_DEFAULTS.get(column, 'NULL'))
+    target = ', '.join(f'"{column}"' for column in db.CHARACTER_COLUMNS)
+    cursor = conn.execute(
+        f'INSERT INTO characters ({target}) SELECT {", ".join(selected)} FROM characters_legacy'
+    )
+    conn.execute('DROP TABLE characters_legacy')
+    logging.info(f"{cursor.rowcount} personnage(s) converti(s) depuis l'ancien schéma")
+
+
+# Étape 2 : effets temporaires en attente d'expiration (un par joueur et par type)
+def _create_effects(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS effects (
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            channel_id INTEGER,
+            PRIMARY KEY (user_id, kind)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS effects_expires_at ON effects (expires_at)')
+
+
+# Étape 3 : guilde de chaque effet (en mode multi-processus, chaque shard ne recharge que les siens)
+def _add_effects_guild(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(effects)')]
+    if 'guild_id' not in columns:
+        conn.execute('ALTER TABLE effects ADD COLUMN guild_id INTEGER')
+
+
+# Étape 4 : journal des modifications des personnages et instantanés (voir journal.py)
+def _create_journal(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS journal (
+            seq INTEGER PRIMARY KEY,
+            at REAL NOT NULL,
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            action TEXT,
+            data TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS journal_user ON journal (user_id, seq)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            characters INTEGER NOT NULL
+        )
+    ''')
+    columns = ', '.join(f'"{column}"' for column in db.CHARACTER_COLUMNS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS snapshot_characters (
+            snapshot_id INTEGER NOT NULL,
+            {columns},
+            PRIMARY KEY (snapshot_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    # Instantané de départ : l'historique commence avec les personnages déjà en base
+    if conn.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0] == 0:
+        _snapshot(conn)
+
+
+# Copie de la table characters après une étape qui la modifie hors du journal (voir journal.snapshot)
+def _snapshot(conn):
+    cursor = conn.execute(
+        'INSERT INTO snapshots (seq, created_at, characters) '
+        'SELECT (SELECT COALESCE(MAX(seq), 0) FROM journal), ?, COUNT(*) FROM characters',
+        (time.time(),)
+    )
+    conn.execute('INSERT INTO snapshot_characters SELECT ?, * FROM characters', (cursor.lastrowid,))
+
+
+# Étape 5 : l'XP devient cumulée (levels.py) ; avant, elle repartait de zéro tous les 100 XP
+# L'ancienne XP restait sous 100 : une XP déjà cumulée atteint le seuil du niveau et n'est pas
+# recomptée si l'étape est rejouée
+def _cumulative_xp(conn):
+    cursor = conn.execute(
+        'UPDATE characters SET xp = COALESCE(xp, 0) + 100 * (level - 1) '
+        'WHERE level > 1 AND COALESCE(xp, 0) < 100 * (level - 1)'
+    )
+    if cursor.rowcount:
+        _snapshot(conn)
+        logging.info(f"XP de {cursor.rowcount} personnage(s) convertie(s) en XP cumulée")
+
+
+# Index plein texte (FTS5) d'une table, tenu à jour par des triggers (voir search.py)
+# Le texte reste dans la table : l'index ne stocke que les mots, sans accents ni casse
+def _create_search_index(conn, table, columns):
+    index = f'{table}_fts'
+    quoted = ', '.join(f'"{column}"' for column in columns)
+    new_values = ', '.join(f'new."{column}"' for column in columns)
+    old_values = ', '.join(f'old."{column}"' for column in columns)
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+            {quoted}, content='{table}', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {index} (rowid, {quoted}) VALUES (new.rowid, {new_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {index} ({index}, rowid, {quoted}) VALUES ('delete', old.rowid, {old_values});
+        END
+    ''')
+    # Seules les colonnes indexées comptent : les PV et l'XP changent sans toucher à l'index
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {quoted} ON {table} BEGIN
+            INSERT INTO {index} ({index}, rowid, {quoted}) VALUES ('delete', old.rowid, {old_values});
+            INSERT INTO {index} (rowid, {quoted}) VALUES (new.rowid, {new_values});
+        END
+    ''')
+    conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+
+
+# Étape 6 : recherche plein texte dans les personnages et les quêtes
+def _create_search_indexes(conn):
+    _create_search_index(conn, 'characters', ('name', 'race', 'class'))
+    _create_search_index(conn, 'quests', ('name', 'description'))
+
+
+# Migrations, dans l'ordre. Une étape publiée ne se modifie plus : on en ajoute une nouvelle.
+# Chaque étape doit pouvoir être rejouée sans effet sur une base déjà à jour.
+MIGRATIONS = [
+    (1, "Schéma de base (personnages, combats, quêtes, inventaires, compétences)", _create_base_tables),
+    (2, "Effets temporaires", _create_effects),
+    (3, "Guilde des effets temporaires", _add_effects_guild),
+    (4, "Journal des modifications des personnages", _create_journal),
+    (5, "XP cumulée", _cumulative_xp),
+    (6, "Recherche plein texte (personnages, quêtes)", _create_search_indexes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0  # Base vide, ou créée avant les migrations
+    return row[0] or 0
+
+
+def migrate(conn, budget=STARTUP_BUDGET):
+    """Applique les migrations manquantes ; renvoie la version du schéma.
+
+    Une base à jour ne coûte qu'une requête. Chaque étape est appliquée dans sa
+    propre transaction IMMEDIATE : si le bot et l'interface web démarrent en
+    même temps, le second attend le premier puis ne refait rien.
+    """
+    start = time.perf_counter()
+    version = schema_version(conn)
+    applied = []
+    if version < LATEST_VERSION:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at INTEGER
+            )
+        ''')
+        for number, description, step in MIGRATIONS:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if number <= schema_version(conn):
+                    conn.rollback()
+                    continue
+                step(conn)
+                conn.execute(
+                    'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                    (number, description, int(time.time()))
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logging.exception(f"Échec de la migration {number} ({description})")
+                raise
+            applied.append(number)
+            logging.info(f"Migration {number} appliquée : {description}")
+        version = LATEST_VERSION
+    elapsed = time.perf_counter() - start
+    message = f"Schéma de la base en version {version} ({len(applied)} migration(s) appliquée(s), {elapsed * 1000:.1f} ms)"
+    if elapsed > budget:
+        logging.warning(f"{message} : au-delà du budget de {budget * 1000:.0f} ms")
+    else:
+        logging.info(message)
+    return version
@@ -0,0 +1,219 @@
+import asyncio
+import collections
+import logging
+import time
+
+# Limite de Discord pour le contenu d'un message
+MAX_LENGTH = 2000
+
+
+class RateLimit:
+    """Seau de jetons : limit envois par période de per secondes."""
+
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+
+    def delay(self):
+        """Attente nécessaire avant le prochain envoi (0 si un jeton est disponible)."""
+        now = time.monotonic()
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.per / self.limit
+
+    async def acquire(self):
+        while True:
+            delay = self.delay()
+            if delay <= 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(delay)
+
+
+class DiscordTransport:
+    """Envoi réel : channel.send() et message.edit() de discord.py."""
+
+    async def post(self, channel, content):
+        return await channel.send(content)
+
+    async def edit(self, message, content):
+        await message.edit(content=content)
+
+
+class _ChannelQueue:
+    __slots__ = ('channel', 'pending', 'task', 'posts', 'edits', 'last_message', 'last_content', 'last_time', 'last_used')
+
+    def __init__(self, channel, posts, edits):
+        self.channel = channel
+        self.pending = collections.deque()
+        self.task = None
+        self.posts = posts  # budget POST /channels/{id}/messages
+        self.edits = edits  # budget PATCH /channels/{id}/messages/{id}
+        self.last_message = None
+        self.last_content = None
+        self.last_time = 0.0
+        self.last_used = time.monotonic()  # fin du dernier envoi (voir Outbox._evict_idle)
+
+
+class Outbox:
+    """File d'envoi des messages, par salon.
+
+    Les messages d'un salon arrivés dans la même fenêtre (window) partent en
+    un seul message. Les envois respectent un budget par salon et un budget
+    global ; quand le budget d'envoi d'un salon est épuisé, les messages sont
+    ajoutés au dernier message posté (édition) s'il est récent et qu'il reste
+    de la place, au lieu d'attendre. L'ordre des messages d'un salon est gardé.
+    Un salon inactif plus longtemps que ses budgets et la fenêtre d'édition est
+    oublié : son état n'aurait plus d'effet.
+    """
+
+    def __init__(self, transport=None, window=0.05, channel_limit=(5, 5.0), edit_limit=(5, 5.0),
+                 global_limit=(50, 1.0), edit_window=10.0):
+        self.transport = transport or DiscordTransport()
+        self.window = window
+        self.channel_limit = channel_limit
+        self.edit_limit = edit_limit
+        self.global_limit = RateLimit(*global_limit)
+        self.edit_window = edit_window
+        self._channels = {}  # channel.id -> _ChannelQueue
+        # Au-delà, les budgets d'un salon sont pleins et son dernier message n'est plus complété
+        self.idle_after = max(edit_window, channel_limit[1], edit_limit[1])
+        self._last_eviction = time.monotonic()
+        self.queued = 0
+        self.sent = 0
+        self.posts = 0
+        self.edits = 0
+        self.errors = 0
+
+    @property
+    def depth(self):
+        """Messages en attente d'envoi, tous salons confondus."""
+        return sum(len(queue.pending) for queue in list(self._channels.values()))
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "channels": len(self._channels),
+            "queued": self.queued,
+            "posts": self.posts,
+            "edits": self.edits,
+            "errors": self.errors,
+            # Messages économisés par le regroupement
+            "coalesced": self.sent - self.posts,
+        }
+
+    async def send(self, channel, content):
+        """Met le message en file et rend la main tout de suite."""
+        queue = self._channels.get(channel.id)
+        if queue is None:
+            self._evict_idle()
+            queue = self._channels[channel.id] = _ChannelQueue(
+                channel, RateLimit(*self.channel_limit), RateLimit(*self.edit_limit)
+            )
+        queue.pending.append(str(content))
+        self.queued += 1
+        if queue.task is None:
+            queue.task = asyncio.create_task(self._drain(queue))
+
+    async def _drain(self, queue):
+        try:
+            await asyncio.sleep(self.window)
+            while queue.pending:
+                await self._send_next(queue)
+        finally:
+            queue.task = None
+            queue.last_used = time.monotonic()
+
+    def _evict_idle(self):
+        """Oublie les salons inactifs depuis idle_after secondes (au plus un passage par période)."""
+        now = time.monotonic()
+        if now - self._last_eviction < self.idle_after:
+            return
+        self._last_eviction = now
+        idle = [
+            channel_id for channel_id, queue in self._channels.items()
+            if queue.task is None and not queue.pending and now - queue.last_used >= self.idle_after
+        ]
+        for channel_id in idle:
+            del self._channels[channel_id]
+
+    async def flush(self, channel):
+        """Attend l'envoi des messages déjà en file pour ce salon (avant un envoi direct : embed, fichier)."""
+        queue = self._channels.get(channel.id)
+        if queue is not None and queue.task is not None:
+            # shield : annuler l'appelant n'interrompt pas l'envoi des autres messages du salon
+            await asyncio.shield(queue.task)
+
+    def _take(self, pending, limit):
+        """Retire des messages de la file tant qu'ils tiennent ensemble dans limit caractères."""
+        first = pending.popleft()
+        if len(first) > limit:
+            # Message trop long : découpé au dernier retour à la ligne (retiré, il sépare les deux
+            # parties), sinon coupé net ; la suite reste en tête de file
+            cut = first.rfind('\n', 0, limit)
+            rest = first[cut + 1:] if cut > 0 else first[limit:]
+            cut = cut if cut > 0 else limit
+            if rest:
+                pending.appendleft(rest)
+            return first[:cut], 0
+        parts = [first]
+        length = len(first)
+        while pending and length + 1 + len(pending[0]) <= limit:
+            message = pending.popleft()
+            parts.append(message)
+            length += 1 + len(message)
+        return '\n'.join(parts), len(parts)
+
+    async def _send_next(self, queue):
+        # Budget d'envoi épuisé : compléter le dernier message s'il est récent et qu'il reste de la place
+        room = MAX_LENGTH - len(queue.last_content or '') - 1
+        can_edit = (
+            queue.last_message is not None
+            and time.monotonic() - queue.last_time < self.edit_window
+            and room >= len(queue.pending[0])
+        )
+        if can_edit and queue.posts.delay() > 0 and queue.edits.delay() <= 0:
+            content, count = self._take(queue.pending, room)
+            await queue.edits.acquire()
+            await self.global_limit.acquire()
+            merged = f"{queue.last_content}\n{content}"
+            try:
+                await self.transport.edit(queue.last_message, merged)
+                queue.last_content = merged
+                self.edits += 1
+                self.sent += count
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Échec de l'édition d'un message dans le salon {queue.channel.id} : {e}")
+            return
+        content, count = self._take(queue.pending, MAX_LENGTH)
+        await queue.posts.acquire()
+        await self.global_limit.acquire()
+        # Messages arrivés pendant l'attente du budget : ils partent avec celui-ci s'ils tiennent
+        while queue.pending and len(content) + 1 + len(queue.pending[0]) <= MAX_LENGTH:
+            content += '\n' + queue.pending.popleft()
+            count += 1
+        try:
+            queue.last_message = await self.transport.post(queue.channel, content)
+            queue.last_content = content
+            queue.last_time = time.monotonic()
+            self.posts += 1
+            self.sent += count
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Échec de l'envoi d'un message dans le salon {queue.channel.id} : {e}")
+
+    async def close(self, timeout=10.0):
+        """Attend l'envoi des messages en file (au plus timeout secondes)."""
+        tasks = [queue.task for queue in self._channels.values() if queue.task is not None]
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(f"{self.depth} message(s) non envoyé(s) à l'arrêt")
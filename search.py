@@ -0,0 +1,143 @@
+"""Recherche plein texte (FTS5) dans les personnages, les quêtes, les sorts et les objets.
+
+Les index des personnages et des quêtes sont dans rpg_bot.db (migration 6),
+tenus à jour par des triggers. Ceux des sorts et des objets sont en mémoire
+(CatalogIndex), reconstruits à partir du catalogue : rpg.db, versionné avec
+le code, n'est jamais modifié. Chaque base répond en une requête avec les
+meilleures correspondances de chacun de ses index, classées ensemble par
+pertinence (bm25), page par page. Chaque mot cherché est un préfixe
+(« bou fe » trouve « Boule de Feu »), sans accents ni casse.
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+import migrations
+
+KINDS = ('character', 'quest', 'spell', 'item')
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+MAX_PAGE = 100
+MAX_TERMS = 10
+
+_WORD = re.compile(r'\w+')
+
+# Type -> (base : rpg_bot.db ou index du catalogue, table indexée, colonne clé, détail affiché ; {index} : table de l'index)
+# Le détail est un extrait du texte, mots trouvés encadrés (paramètres :open et :close)
+_SOURCES = {
+    'character': ('main', 'characters', 'user_id', "printf('%s %s, niveau %d', t.race, t.class, t.level)"),
+    'quest': ('main', 'quests', 'name', "snippet({index}, 1, :open, :close, '…', 12)"),
+    'spell': ('catalog', 'spells', 'name', "snippet({index}, 1, :open, :close, '…', 12)"),
+    'item': ('catalog', 'items', 'name', "snippet({index}, 1, :open, :close, '…', 12)"),
+}
+
+
+class SearchError(ValueError):
+    pass
+
+
+def parse_query(text):
+    """Requête FTS5 : chaque mot devient un préfixe, tous les mots sont requis."""
+    words = _WORD.findall(text)
+    if not words:
+        raise SearchError("Recherche vide.")
+    return ' '.join(f'"{word}"*' for word in words[:MAX_TERMS])
+
+
+class CatalogIndex:
+    """Index plein texte des sorts et des objets, dans une base en mémoire.
+
+    rpg.db n'est jamais modifié : les entrées viennent de catalog.Catalog,
+    qui le lit en lecture seule, et l'index est reconstruit quand le
+    catalogue est rechargé (quelques millisecondes pour quelques centaines
+    d'entrées). Une instance par processus, partagée par tous les threads.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self._lock = threading.Lock()
+        self._version = None
+
+    def _build(self):
+        start = time.perf_counter()
+        with self._conn:
+            for table, index in (('spells', self.source.spells), ('items', self.source.items)):
+                self._conn.execute(f'DROP TABLE IF EXISTS {table}_fts')
+                self._conn.execute(f'DROP TABLE IF EXISTS {table}')
+                self._conn.execute(f'CREATE TABLE {table} (name TEXT, description TEXT)')
+                self._conn.executemany(f'INSERT INTO {table} (name, description) VALUES (?, ?)', index.entries.values())
+                migrations._create_search_index(self._conn, table, ('name', 'description'))
+        logging.info(f"Index de recherche du catalogue construit en {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def query(self, sql, params):
+        with self._lock:
+            self.source.refresh()
+            if self._version != self.source.version:
+                self._build()
+                self._version = self.source.version
+            return self._conn.execute(sql, params).fetchall()
+
+
+def _union(kinds):
+    """Une requête : les meilleurs résultats de chaque index, classés ensemble."""
+    selects = []
+    for kind in kinds:
+        _, table, key, detail = _SOURCES[kind]
+        index = f'{table}_fts'
+        detail = detail.format(index=index)
+        # Chaque index ne renvoie que ses meilleurs résultats (ORDER BY rank LIMIT : tri partiel dans FTS5)
+        selects.append(f'''
+            SELECT * FROM (
+                SELECT '{kind}' AS kind, t.{key} AS key, t.name AS title, {detail} AS detail, {index}.rank AS score
+                FROM {index} JOIN {table} AS t ON t.rowid = {index}.rowid
+                WHERE {index} MATCH :query
+                ORDER BY {index}.rank LIMIT :wanted
+            )
+        ''')
+    return ' UNION ALL '.join(selects) + ' ORDER BY score, kind, key LIMIT :wanted'
+
+
+def search(conn, text, kinds=KINDS, page=1, per_page=PAGE_SIZE, catalog_index=None, highlight=('[', ']')):
+    """Cherche text dans les types demandés ; renvoie une page de résultats classés.
+
+    {"query", "page", "per_page", "has_more", "results": [{"kind", "key", "title", "detail", "score"}], "elapsed_ms"}
+    Le score est celui de bm25 : plus il est bas, plus le résultat est pertinent.
+    Les sorts et les objets sont cherchés dans catalog_index (CatalogIndex), s'il est donné.
+    """
+    start = time.perf_counter()
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        raise SearchError(f"Type inconnu : {', '.join(sorted(unknown))} (types : {', '.join(KINDS)})")
+    if not 1 <= per_page <= MAX_PAGE_SIZE:
+        raise SearchError(f"Entre 1 et {MAX_PAGE_SIZE} résultats par page.")
+    if not 1 <= page <= MAX_PAGE:
+        raise SearchError(f"Page entre 1 et {MAX_PAGE}.")
+    query = parse_query(text)
+    offset = (page - 1) * per_page
+    wanted = offset + per_page + 1  # un de plus pour savoir s'il reste une page
+    params = {"open": highlight[0], "close": highlight[1], "query": query, "wanted": wanted}
+    rows = []
+    main = [kind for kind in kinds if _SOURCES[kind][0] == 'main']
+    if main:
+        rows += conn.execute(_union(main), params).fetchall()
+    # Sans index du catalogue, les sorts et les objets sont ignorés
+    in_catalog = [kind for kind in kinds if _SOURCES[kind][0] == 'catalog']
+    if in_catalog and catalog_index is not None:
+        rows += catalog_index.query(_union(in_catalog), params)
+    # Même ordre que dans chaque requête : score, type, clé
+    rows = sorted(rows, key=lambda row: (row[4], row[0], row[1]))[offset:wanted]
+    results = [
+        {"kind": kind, "key": key, "title": title, "detail": detail, "score": round(score, 4)}
+        for kind, key, title, detail, score in rows
+    ]
+    return {
+        "query": text,
+        "page": page,
+        "per_page": per_page,
+        "has_more": len(results) > per_page,
+        "results": results[:per_page],
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
@@ -0,0 +1,552 @@
+"""Mode multi-processus : plusieurs shards du bot, chacun responsable d'une partie des guildes.
+
+Le coordinateur (ce processus) possède le cache des personnages, partagés entre
+toutes les guildes, et le sert aux shards par une connexion locale. Chaque
+shard est un processus bot_mj qui ne reçoit que les événements de ses guildes
+(répartition de Discord : (guild_id >> 22) % nombre de shards) ; l'état propre
+à une guilde (combat, effets) n'est donc manipulé que par un seul processus.
+
+    python sharding.py --shards 4                  # connexion réelle à Discord
+    python sharding.py --shards 4 --fake-gateway   # événements simulés, sans Discord
+
+Avec --fake-gateway, une passerelle locale génère les commandes de N guildes de
+M joueurs, les envoie au shard propriétaire de chaque guilde et affiche un
+résumé JSON (événements et latences par shard).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import secrets
+import sys
+import time
+from contextlib import closing
+
+import db
+import journal
+import logs
+import migrations
+from cache import CharacterCache
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def shard_for(guild_id, shard_count):
+    """Shard propriétaire d'une guilde (même règle que Discord ; les messages privés vont au shard 0)."""
+    if guild_id is None:
+        return 0
+    return (guild_id >> 22) % shard_count
+
+
+# Les Delta traversent la connexion sous la forme {"$delta": montant}
+def _encode(value):
+    if isinstance(value, db.Delta):
+        return {"$delta": value.amount}
+    raise TypeError(f"Type non sérialisable : {type(value).__name__}")
+
+
+def _decode(obj):
+    if len(obj) == 1 and "$delta" in obj:
+        return db.Delta(obj["$delta"])
+    return obj
+
+
+def _dumps(message):
+    return (json.dumps(message, default=_encode, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class CharacterServer:
+    """Côté coordinateur : sert le cache des personnages aux shards (JSON, une ligne par requête)."""
+
+    def __init__(self, cache, token):
+        self.cache = cache
+        self.token = token
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Renvoie le port d'écoute."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        tasks = set()
+        try:
+            hello = json.loads(await reader.readline() or b'{}')
+            # Octets : compare_digest refuse les chaînes non ASCII
+            token = str(hello.get('token', '')).encode() if isinstance(hello, dict) else b''
+            if not secrets.compare_digest(token, self.token.encode()):
+                logging.warning("Connexion refusée : jeton de shard invalide")
+                return
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line, object_hook=_decode)
+                if not isinstance(request, dict):
+                    raise ValueError("objet JSON attendu")
+                # Une tâche par requête : un chargement lent ne bloque pas les suivantes
+                task = asyncio.create_task(self._answer(writer, request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        except ValueError as e:
+            # JSON illisible (ou ligne trop longue) : la connexion est fermée, le shard se reconnectera
+            logging.warning(f"Connexion de shard fermée : message invalide ({e})")
+        finally:
+            if tasks:
+                await asyncio.wait(tasks)
+            writer.close()
+
+    async def _answer(self, writer, request):
+        # Commande du shard à l'origine de l'appel : elle est recopiée dans le journal
+        # (une tâche par requête, le contexte ne déborde pas sur les autres)
+        logs.current_command.set(request.get('command'))
+        try:
+            result = await self._dispatch(request['op'], *request['args'])
+            response = {"id": request['id'], "result": result}
+        except Exception as e:
+            response = {"id": request.get('id'), "error": str(e)}
+        writer.write(_dumps(response))
+        try:
+            # Tampon d'écriture borné : un shard lent fait attendre ses réponses, pas la mémoire
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _dispatch(self, op, *args):
+        if op == 'get':
+            return await self.cache.get(*args)
+        if op == 'put':
+            return await self.cache.put(*args)
+        if op == 'update':
+            user_id, fields = args
+            return await self.cache.update(user_id, **fields)
+        if op == 'update_many':
+            return await self.cache.update_many(*args)
+        if op == 'modify_if':
+            return await self._modify_if(*args)
+        if op == 'modify_many_if':
+            return await self._modify_many_if(*args)
+        raise ValueError(f"Opération inconnue : {op}")
+
+    async def _modify_if(self, user_id, expected, fields):
+        """Applique fields seulement si le personnage n'a pas changé depuis la lecture du shard."""
+        applied = False
+
+        def check(character):
+            nonlocal applied
+            if character != expected:
+                return None
+            applied = True
+            return fields
+        character = await self.cache.modify(user_id, check)
+        return [applied, character]
+
+    async def _modify_many_if(self, expected, changes):
+        """Comme _modify_if, pour un bloc de personnages ({user_id: état lu par le shard})."""
+        applied = False
+
+        def check(characters):
+            nonlocal applied
+            if characters != expected:
+                return None
+            applied = True
+            return changes
+        characters = await self.cache.modify_many(list(expected), check)
+        return [applied, characters]
+
+
+class RemoteCharacterCache:
+    """Côté shard : même interface que CharacterCache, servie par le coordinateur."""
+
+    def __init__(self, address, token, attempts=10):
+        self.address = address  # "hôte:port"
+        self.token = token
+        self.attempts = attempts
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._connecting = asyncio.Lock()
+        self._calls = {}  # id -> Future
+        self._next_id = 0
+        self.calls = 0
+        self.conflicts = 0
+
+    async def _connect(self):
+        async with self._connecting:
+            if self._writer is not None:
+                return
+            host, port = self.address.rsplit(':', 1)
+            self._reader, self._writer = await asyncio.open_connection(host, int(port))
+            self._writer.write(_dumps({"token": self.token}))
+            await self._writer.drain()
+            self._receiver = asyncio.create_task(self._receive(self._reader))
+
+    async def _receive(self, reader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = json.loads(line, object_hook=_decode)
+                future = self._calls.pop(response['id'], None)
+                if future is None or future.done():
+                    continue
+                if 'error' in response:
+                    future.set_exception(ValueError(response['error']))
+                else:
+                    future.set_result(response['result'])
+        finally:
+            # Connexion perdue : les appels en cours échouent, le prochain reconnecte
+            self._writer = None
+            for future in self._calls.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connexion au coordinateur perdue"))
+            self._calls.clear()
+
+    async def _call(self, op, *args):
+        if self._writer is None:
+            await self._connect()
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._calls[self._next_id] = future
+        writer = self._writer
+        writer.write(_dumps({"id": self._next_id, "op": op, "args": args, "command": logs.current_command.get()}))
+        self.calls += 1
+        await writer.drain()
+        return await future
+
+    async def get(self, user_id):
+        return await self._call('get', user_id)
+
+    async def put(self, user_id, character):
+        await self._call('put', user_id, character)
+
+    async def update(self, user_id, **fields):
+        return await self._call('update', user_id, fields)
+
+    async def update_many(self, changes):
+        return await self._call('update_many', changes)
+
+    async def modify(self, user_id, fn):
+        """Lecture, fn, puis écriture conditionnelle ; recommence si un autre shard a modifié le personnage."""
+        character = await self.get(user_id)
+        for _ in range(self.attempts):
+            if character is None:
+                return None
+            fields = fn(dict(character))
+            if not fields:
+                return character
+            applied, current = await self._call('modify_if', user_id, character, fields)
+            if applied:
+                return current
+            self.conflicts += 1
+            character = current
+        raise RuntimeError(f"Personnage {user_id} modifié en continu par d'autres shards")
+
+    async def modify_many(self, user_ids, fn):
+        """Comme modify, pour un bloc de personnages (voir CharacterCache.modify_many)."""
+        characters = {}
+        for user_id in user_ids:
+            characters[user_id] = await self.get(user_id)
+        for _ in range(self.attempts):
+            if characters is None or any(character is None for character in characters.values()):
+                return None
+            changes = fn({user_id: dict(character) for user_id, character in characters.items()})
+            if not changes:
+                return characters
+            applied, current = await self._call('modify_many_if', characters, changes)
+            if applied:
+                return current
+            self.conflicts += 1
+            characters = current
+        raise RuntimeError("Personnages modifiés en continu par d'autres shards")
+
+    def start(self):
+        pass
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._receiver is not None:
+            await asyncio.gather(self._receiver, return_exceptions=True)
+
+    def stats(self):
+        # Le cache vit dans le coordinateur : seules les statistiques d'appel sont locales
+        return {
+            "size": 0,
+            "max_size": 0,
+            "dirty": 0,
+            "hits": 0,
+            "misses": 0,
+            "hit_rate": 0.0,
+            "evictions": 0,
+            "flushes": 0,
+            "remote_calls": self.calls,
+            "conflicts": self.conflicts
+        }
+
+    @property
+    def hits(self):
+        return 0
+
+    @property
+    def misses(self):
+        return 0
+
+
+def _shard_environment(shard_id, shard_count, address, token):
+    os.environ.update({
+        'SHARD_ID': str(shard_id),
+        'SHARD_COUNT': str(shard_count),
+        'RPG_COORDINATOR': address,
+        'RPG_COORDINATOR_TOKEN': token,
+        # L'interface web est servie à part (wsgi.py), et chaque shard a son fichier de logs
+        'EMBEDDED_WEB': '0',
+        'LOG_FILE': os.environ.get('LOG_FILE', 'rpg_bot.log') + f'.shard{shard_id}',
+    })
+    sys.path.insert(0, ROOT)
+
+
+def run_shard(shard_id, shard_count, address, token):
+    """Processus shard connecté à Discord : bot_mj avec SHARD_ID / SHARD_COUNT."""
+    import runpy
+    _shard_environment(shard_id, shard_count, address, token)
+    runpy.run_module('bot_mj', run_name='__main__')
+
+
+# Passerelle simulée
+
+def fake_gateway_phases(guilds, players, rounds, seed):
+    """Événements (guild_id, channel_id, user_id, nom, commande, args, kwargs), par phase.
+
+    La première phase crée les personnages et les inscrit au combat ; la
+    seconde joue les tours. Chaque phase se termine quand tous les shards
+    ont traité ses événements.
+    """
+    rng = random.Random(seed)
+    # Identifiants au format snowflake : les guildes se répartissent sur tous les shards
+    roster = []
+    for g in range(guilds):
+        guild_id = (1_000_000 + g) << 22
+        members = [(guild_id + p + 1, f"joueur{g}-{p}") for p in range(players)]
+        roster.append((guild_id, guild_id + 1, members))
+
+    setup = []
+    for guild_id, channel_id, members in roster:
+        for user_id, name in members:
+            setup.append((guild_id, channel_id, user_id, name, 'create', [name], {}))
+            setup.append((guild_id, channel_id, user_id, name, 'join', [name], {}))
+
+    play = []
+    for _ in range(rounds):
+        for guild_id, channel_id, members in roster:
+            for user_id, name in members:
+                action = rng.random()
+                if action < 0.30:
+                    command = ('roll', [], {"expression": rng.choice(('1d20', '1d20+dexterity', '4d6kh3', '8d6'))})
+                elif action < 0.45:
+                    command = ('sheet', [], {})
+                elif action < 0.60:
+                    target = rng.choice([member for member in members if member[0] != user_id] or members)
+                    command = ('use_eclair', [{"member": target}], {})
+                elif action < 0.75:
+                    command = ('gain_xp', [rng.randint(10, 200)], {})
+                elif action < 0.85:
+                    command = ('next_turn', [], {})
+                elif action < 0.95:
+                    command = ('take_damage', [rng.randint(1, 5)], {})
+                else:
+                    command = ('add_item', [rng.choice(('Potion', 'Corde', 'Torche'))], {})
+                play.append((guild_id, channel_id, user_id, name) + command)
+    return [setup, play]
+
+
+def run_fake_shard(shard_id, shard_count, address, token, events, results, api_latency):
+    """Processus shard alimenté par la passerelle simulée au lieu de Discord."""
+    _shard_environment(shard_id, shard_count, address, token)
+    import bot_mj
+    bot_mj.prepare()
+    from fakes import FakeChannel, FakeContext, FakeGuild, FakeMember, StubTransport
+    from metrics import summarize
+    from outbox import Outbox
+
+    async def main():
+        bot_mj.outbox = Outbox(transport=StubTransport(api_latency))
+        bot_mj.SPELL_COOLDOWN = 0
+        channels = {}
+        bot_mj.bot.get_channel = channels.get
+
+        async def ready():
+            return None
+        bot_mj.bot.wait_until_ready = ready
+        await bot_mj.effects.start()
+
+        latencies = {}
+        guilds = set()
+        tasks = set()
+        loop = asyncio.get_running_loop()
+
+        async def handle(event):
+            guild_id, channel_id, user_id, name, command, args, kwargs = event
+            if shard_for(guild_id, shard_count) != shard_id:
+                raise RuntimeError(f"Guilde {guild_id} reçue par le shard {shard_id}")
+            guilds.add(guild_id)
+            channel = channels.get(channel_id)
+            if channel is None:
+                channel = channels[channel_id] = FakeChannel(channel_id)
+            ctx = FakeContext(bot_mj, FakeMember(user_id, name), FakeGuild(guild_id), channel)
+            args = [FakeMember(*arg["member"]) if isinstance(arg, dict) else arg for arg in args]
+            # Comme before_command du bot : la commande accompagne les logs et le journal
+            logs.current_command.set(command)
+            start = time.perf_counter()
+            await bot_mj.bot.get_command(command).callback(ctx, *args, **kwargs)
+            latencies.setdefault(command, []).append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        while True:
+            event = await loop.run_in_executor(None, events.get)
+            if event == 'barrier' or event is None:
+                # Fin de phase : attendre les commandes en cours avant de répondre
+                if tasks:
+                    await asyncio.wait(tasks)
+                results.put(('ack', shard_id))
+                if event is None:
+                    break
+                continue
+            # Comme discord.py : une tâche par message reçu
+            task = asyncio.create_task(handle(event))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        elapsed = time.perf_counter() - start
+        await bot_mj.outbox.close(timeout=600)
+        bot_mj.effects.stop()
+        await bot_mj.character_cache.close()
+        all_latencies = [value for values in latencies.values() for value in values]
+        results.put(('result', {
+            "shard": shard_id,
+            "guilds": len(guilds),
+            "events": len(all_latencies),
+            "elapsed_s": elapsed,
+            "latency": summarize(all_latencies),
+            "commands": {name: summarize(values) for name, values in sorted(latencies.items())},
+            "outbox": bot_mj.outbox.stats(),
+            "coordinator": bot_mj.character_cache.stats(),
+        }))
+
+    try:
+        asyncio.run(main())
+    finally:
+        bot_mj.repository.close()
+
+
+async def coordinate(args):
+    # Le coordinateur garde les personnages en cache : pas d'import direct tant qu'il tourne
+    cache_lock = db.hold_cache_lock()
+    # Le schéma est mis à jour une seule fois, avant le démarrage des shards
+    with closing(db.connect()) as conn:
+        migrations.migrate(conn)
+        journal.recover(conn)
+    repository = db.CharacterRepository()
+    cache = CharacterCache(repository, max_size=args.cache_size, flush_interval=5.0)
+    cache.start()
+    snapshots = asyncio.create_task(journal.snapshot_loop(repository))
+    token = secrets.token_hex(16)
+    server = CharacterServer(cache, token)
+    port = await server.start()
+    address = f"127.0.0.1:{port}"
+    logging.info(f"Coordinateur à l'écoute sur {address} pour {args.shards} shard(s)")
+    context = multiprocessing.get_context('spawn')
+    loop = asyncio.get_running_loop()
+    try:
+        if not args.fake_gateway:
+            processes = [
+                context.Process(target=run_shard, args=(shard_id, args.shards, address, token), name=f'shard-{shard_id}')
+                for shard_id in range(args.shards)
+            ]
+            for process in processes:
+                process.start()
+            await asyncio.gather(*(loop.run_in_executor(None, process.join) for process in processes))
+            return None
+
+        queues = [context.Queue() for _ in range(args.shards)]
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=run_fake_shard,
+                args=(shard_id, args.shards, address, token, queues[shard_id], results, args.api_latency),
+                name=f'shard-{shard_id}'
+            )
+            for shard_id in range(args.shards)
+        ]
+        for process in processes:
+            process.start()
+        phases = fake_gateway_phases(args.guilds, args.players, args.rounds, args.seed)
+        # Attendre que tous les shards soient prêts : le démarrage des processus n'est pas mesuré
+        for queue in queues:
+            queue.put('barrier')
+        for _ in queues:
+            await loop.run_in_executor(None, results.get)
+        start = time.perf_counter()
+        for index, phase in enumerate(phases):
+            for event in phase:
+                queues[shard_for(event[0], args.shards)].put(event)
+            last = index == len(phases) - 1
+            for queue in queues:
+                queue.put(None if last else 'barrier')
+            for _ in queues:
+                await loop.run_in_executor(None, results.get)
+        elapsed = time.perf_counter() - start
+        shards = []
+        for _ in queues:
+            kind, result = await loop.run_in_executor(None, results.get)
+            shards.append(result)
+        await asyncio.gather(*(loop.run_in_executor(None, process.join) for process in processes))
+        events = sum(shard["events"] for shard in shards)
+        return {
+            "config": {
+                "shards": args.shards, "guilds": args.guilds, "players": args.players,
+                "rounds": args.rounds, "seed": args.seed
+            },
+            "elapsed_s": elapsed,
+            "events": events,
+            "events_per_s": events / elapsed if elapsed else 0.0,
+            "shards": sorted(shards, key=lambda shard: shard["shard"]),
+            "coordinator_cache": cache.stats(),
+        }
+    finally:
+        snapshots.cancel()
+        await server.close()
+        await cache.close()
+        repository.close()
+        cache_lock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot RPG en plusieurs processus (shards)")
+    parser.add_argument('--shards', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--cache-size', type=int, default=4096, help="personnages gardés par le coordinateur")
+    parser.add_argument('--fake-gateway', action='store_true', help="événements simulés au lieu de Discord")
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--players', type=int, default=10, help="joueurs par guilde")
+    parser.add_argument('--rounds', type=int, default=20, help="commandes par joueur")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--api-latency', type=float, default=0.02, help="durée simulée d'un appel à Discord (s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    result = asyncio.run(coordinate(args))
+    if result is not None:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""Simulation de combats (Monte-Carlo) pour équilibrer les rencontres.
+
+Un groupe de personnages (table characters) affronte une liste d'adversaires,
+des centaines de milliers de fois. Les combats sont joués en parallèle par
+NumPy : chaque lancer est un tableau (un dé par combat), tiré dans la loi
+exacte de l'expression (dice.odds), donc toutes les expressions de !roll
+sont acceptées. Les lots de combats sont répartis sur des processus.
+
+Règles simplifiées d'un combat :
+- initiative : 1d20 + dextérité pour les personnages (comme !join), 1d20 +
+  bonus pour les adversaires ; à égalité, l'ordre d'arrivée ;
+- chaque tour, un combattant vivant attaque l'adversaire vivant le plus
+  faible : Éclair (1d10) pour les personnages, les dégâts de leur fiche
+  pour les adversaires ;
+- un Mage ouvre le combat par une Boule de Feu (8d6 tirés pour chaque
+  adversaire, comme !use_boule_de_feu), une fois par combat (le temps de
+  recharge des sorts dépasse la durée d'un combat) ;
+- le combat s'arrête quand un camp est à terre, ou après MAX_ROUNDS tours
+  (match nul).
+"""
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import multiprocessing
+
+import numpy as np
+
+import dice
+
+DEFAULT_FIGHTS = 100_000
+MAX_FIGHTS = 1_000_000
+MAX_COMBATANTS = 20
+MAX_ROUNDS = 100
+
+# Combats simulés par lot (un lot = une tâche du pool de processus)
+CHUNK_FIGHTS = 25_000
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+# Dégâts des sorts (voir catalog.DEFAULT_SPELLS)
+ATTACK = "1d10"  # Éclair
+FIREBALL = "8d6"  # Boule de Feu
+FIREBALL_CLASSES = frozenset({"Mage"})
+
+# Adversaire : [Nx]nom:pv:dégâts[:initiative] (ex: 3xGobelin:7:1d6+2:2)
+_OPPONENT = re.compile(r'^(?:(\d+)x)?([^:]+):(\d+):([^:]+)(?::([+-]?\d+))?$')
+
+OUTCOMES = ("win", "loss", "draw")
+_WIN, _LOSS, _DRAW = range(3)
+
+
+class SimulationError(ValueError):
+    """Groupe ou adversaires invalides."""
+
+
+class Combatant:
+    __slots__ = ('name', 'hp', 'initiative', 'damage', 'party', 'fireball')
+
+    def __init__(self, name, hp, initiative, damage, party, fireball=False):
+        self.name = name
+        self.hp = hp
+        self.initiative = initiative  # bonus ajouté au d20
+        self.damage = damage  # expression de dés
+        self.party = party  # True : personnage du groupe
+        self.fireball = fireball
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+def party_from_characters(characters):
+    """Combattants du groupe à partir des personnages (dicts de db.row_to_character)."""
+    party = [
+        Combatant(
+            character["name"], character["hp"], character["dexterity"] or 0, ATTACK, True,
+            fireball=character["class"] in FIREBALL_CLASSES
+        )
+        for character in characters if character and (character["hp"] or 0) > 0
+    ]
+    if not party:
+        raise SimulationError("Aucun personnage en état de combattre.")
+    return party
+
+
+def parse_opponents(text):
+    """Lit les adversaires (ex: "3xGobelin:7:1d6+2:2 Ogre:59:2d8+4")."""
+    opponents = []
+    for token in text.replace(',', ' ').split():
+        match = _OPPONENT.match(token)
+        if match is None:
+            raise SimulationError(f"Adversaire invalide : {token} (format : [Nx]nom:pv:dégâts[:initiative])")
+        count, name, hp, damage, initiative = match.groups()
+        count = int(count or 1)
+        if count < 1 or len(opponents) + count > MAX_COMBATANTS:
+            raise SimulationError(f"Pas plus de {MAX_COMBATANTS} combattants.")
+        try:
+            dice.odds(damage)
+        except dice.DiceError as e:
+            raise SimulationError(f"Dégâts de {name} : {e}") from None
+        for number in range(count):
+            label = f"{name} {number + 1}" if count > 1 else name
+            opponents.append(Combatant(label, int(hp), int(initiative or 0), damage, False))
+    if not opponents:
+        raise SimulationError("Il faut au moins un adversaire.")
+    return opponents
+
+
+@lru_cache(maxsize=256)
+def _cumulative(expression):
+    """Fonction de répartition exacte d'une expression : (plus petit total, cumul)."""
+    distribution = dice.odds(expression).distribution
+    cumulative = np.cumsum(distribution.probs)
+    return distribution.low, cumulative / cumulative[-1]
+
+
+def _roll(rng, expression, size):
+    """Tire size lancers d'une expression d'un coup (inversion de la fonction de répartition) ; size : nombre ou forme."""
+    low, cumulative = _cumulative(expression)
+    indexes = np.searchsorted(cumulative, rng.random(size), side='right')
+    return np.minimum(indexes, len(cumulative) - 1).astype(np.int32) + low
+
+
+def _simulate_chunk(combatants, fights, seed):
+    """Joue un lot de combats ; renvoie les issues, les tours et les PV finaux du groupe."""
+    rng = np.random.default_rng(seed)
+    count = len(combatants)
+    party = np.array([combatant.party for combatant in combatants])
+    hp = np.tile(np.array([combatant.hp for combatant in combatants], dtype=np.int32), (fights, 1))
+    ready = np.tile(np.array([combatant.fireball for combatant in combatants]), (fights, 1))
+    bonus = np.array([combatant.initiative for combatant in combatants], dtype=np.int32)
+    initiative = rng.integers(1, 21, size=(fights, count), dtype=np.int32) + bonus
+    # Tri stable : à initiative égale, l'ordre d'arrivée (comme CombatTracker)
+    order = np.argsort(-initiative, axis=1, kind='stable')
+    outcome = np.full(fights, _DRAW, dtype=np.int8)
+    rounds = np.zeros(fights, dtype=np.int32)
+    active = np.arange(fights)
+    untargetable = np.iinfo(np.int32).max
+
+    for _ in range(MAX_ROUNDS):
+        if not active.size:
+            break
+        size = active.size
+        rows = np.arange(size)
+        h = hp[active]
+        r = ready[active]
+        turn_order = order[active]
+        rounds[active] += 1
+        # Les dégâts du tour sont tirés d'avance : une colonne par combattant
+        damage = np.empty((size, count), dtype=np.int32)
+        for column, combatant in enumerate(combatants):
+            damage[:, column] = _roll(rng, combatant.damage, size)
+        # Boule de Feu : un tirage par cible (colonne), comme spells.Spell.roll dans le bot
+        blast = _roll(rng, FIREBALL, (size, count))
+        for rank in range(count):
+            actor = turn_order[:, rank]
+            targets = (party[None, :] != party[actor][:, None]) & (h > 0)
+            acting = (h[rows, actor] > 0) & targets.any(axis=1)
+            casting = acting & r[rows, actor]
+            if casting.any():
+                h[casting] -= np.where(targets[casting], blast[casting], 0)
+                r[rows[casting], actor[casting]] = False
+            attacking = acting & ~casting
+            target = np.argmin(np.where(targets, h, untargetable), axis=1)
+            h[rows[attacking], target[attacking]] -= damage[rows[attacking], actor[attacking]]
+        hp[active] = h
+        ready[active] = r
+        party_standing = (h[:, party] > 0).any(axis=1)
+        opponents_standing = (h[:, ~party] > 0).any(axis=1)
+        outcome[active[~opponents_standing]] = _WIN
+        outcome[active[~party_standing]] = _LOSS
+        active = active[party_standing & opponents_standing]
+
+    return outcome, rounds, np.maximum(hp[:, party], 0).astype(np.int16)
+
+
+def _percentiles(values):
+    if not values.size:
+        return {}
+    points = np.percentile(values, dice.PERCENTILES, method='inverted_cdf')
+    return {str(percent): int(value) for percent, value in zip(dice.PERCENTILES, points)}
+
+
+def _summary(values):
+    return {"mean": round(float(values.mean()), 2) if values.size else 0.0, "percentiles": _percentiles(values)}
+
+
+def simulate(party, opponents, fights=DEFAULT_FIGHTS, seed=None, executor=None):
+    """Simule fights combats du groupe contre les adversaires (listes de Combatant).
+
+    Avec un executor (voir get_executor), les lots sont joués en parallèle.
+    Renvoie un dict : taux de victoire, durée des combats, PV restants par personnage.
+    """
+    if not 1 <= fights <= MAX_FIGHTS:
+        raise SimulationError(f"Le nombre de combats doit être entre 1 et {MAX_FIGHTS}.")
+    combatants = list(party) + list(opponents)
+    if len(combatants) > MAX_COMBATANTS:
+        raise SimulationError(f"Pas plus de {MAX_COMBATANTS} combattants.")
+    start = time.perf_counter()
+    sizes = [CHUNK_FIGHTS] * (fights // CHUNK_FIGHTS)
+    if fights % CHUNK_FIGHTS:
+        sizes.append(fights % CHUNK_FIGHTS)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if executor is None:
+        chunks = [_simulate_chunk(combatants, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+    else:
+        chunks = list(executor.map(_simulate_chunk, [combatants] * len(sizes), sizes, seeds))
+    outcome = np.concatenate([chunk[0] for chunk in chunks])
+    rounds = np.concatenate([chunk[1] for chunk in chunks])
+    final_hp = np.concatenate([chunk[2] for chunk in chunks])
+    counts = np.bincount(outcome, minlength=len(OUTCOMES))
+    members = [combatant for combatant in combatants if combatant.party]
+    return {
+        "fights": fights,
+        "rates": {name: float(counts[code]) / fights for code, name in enumerate(OUTCOMES)},
+        "rounds": _summary(rounds),
+        "party": [
+            {
+                "name": member.name,
+                "hp": member.hp,
+                "survival_rate": float((final_hp[:, column] > 0).mean()),
+                "final_hp": _summary(final_hp[:, column])
+            }
+            for column, member in enumerate(members)
+        ],
+        "party_hp": _summary(final_hp.sum(axis=1, dtype=np.int32)),
+        "opponents": [{"name": opponent.name, "hp": opponent.hp, "damage": opponent.damage} for opponent in opponents],
+        "elapsed_s": round(time.perf_counter() - start, 3)
+    }
+
+
+# Processus de calcul : démarrés par un serveur de fork (forkserver) qui a préchargé ce
+# module et NumPy. Le bot et l'interface web ont des threads (base, logs, Flask, boucle
+# asyncio) : un fork direct de ces processus pourrait copier un verrou tenu et bloquer
+# le fils. Les processus réimportent le programme principal (sous le nom __mp_main__) :
+# bot_mj.py et app.py n'ont donc aucun effet de bord à l'import.
+def _worker_context():
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['simulate'])
+    return context
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Pool de processus partagé, créé à la première simulation."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(MAX_WORKERS, mp_context=_worker_context())
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
@@ -0,0 +1,38 @@
+import random
+
+import dice
+from db import Delta
+
+# Cibles au plus par sort (une ligne par cible dans le message de résultat)
+MAX_TARGETS = 50
+
+
+class Spell:
+    """Sort de dégâts, à une cible (Éclair) ou de zone (Boule de Feu) : un jet de dégâts par cible."""
+
+    __slots__ = ('name', 'damage', 'odds', 'element')
+
+    def __init__(self, name, damage, element):
+        self.name = name
+        self.damage = dice.parse(damage)  # compilé une fois pour toutes
+        self.odds = dice.odds(self.damage)  # loi exacte des dégâts, calculée une fois pour toutes
+        self.element = element
+
+    def roll(self, count, rng=random):
+        """Tire les dégâts de count cibles d'un seul appel, dans la loi exacte des dégâts."""
+        return self.odds.sample(count, rng)
+
+    def resolve(self, caster_id, characters, target_ids, current_time, cooldown, rng=random):
+        """Changements d'un lancer, décidés sur l'état le plus récent (voir CharacterCache.modify_many).
+
+        characters contient le lanceur et les cibles. Renvoie (changements,
+        {user_id: dégâts}), ou (None, None) si le sort du lanceur est en recharge.
+        Le cooldown du lanceur fait partie des changements : tout part dans la
+        même transaction.
+        """
+        if current_time - (characters[caster_id]["last_spell_used"] or 0) < cooldown:
+            return None, None
+        damages = dict(zip(target_ids, self.roll(len(target_ids), rng)))
+        changes = {user_id: {"hp": Delta(-damage)} for user_id, damage in damages.items()}
+        changes.setdefault(caster_id, {})["last_spell_used"] = current_time
+        return changes, damages
@@ -0,0 +1,186 @@
+import time
+from collections import OrderedDict
+
+
+class _LRU:
+    """Petit cache borné : les entrées les moins utilisées sont oubliées en premier."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+
+# Fonctions sur une connexion, partagées par le bot et l'interface web
+
+def fetch_quests(conn):
+    """Toutes les quêtes, par nom : {nom: ligne}."""
+    rows = conn.execute('SELECT name, description, started, completed FROM quests ORDER BY name').fetchall()
+    return {row['name']: row for row in rows}
+
+
+def fetch_quest(conn, name):
+    return conn.execute(
+        'SELECT name, description, started, completed FROM quests WHERE name = ?', (name,)
+    ).fetchone()
+
+
+def insert_quest(conn, name, description):
+    # Recréer une quête existante la remet à zéro
+    conn.execute(
+        'INSERT OR REPLACE INTO quests (name, description, started, completed, created_at) VALUES (?, ?, 0, 0, ?)',
+        (name, description, int(time.time()))
+    )
+
+
+def _set_quest_flag(conn, name, column):
+    cursor = conn.execute(f'UPDATE quests SET {column} = 1 WHERE name = ?', (name,))
+    return cursor.rowcount > 0
+
+
+def _fetch_inventory(conn, user_id):
+    rows = conn.execute('SELECT item, count FROM inventory WHERE user_id = ? ORDER BY item', (user_id,)).fetchall()
+    return {item: count for item, count in rows}
+
+
+def _add_item(conn, user_id, item, count):
+    conn.execute('''
+        INSERT INTO inventory (user_id, item, count) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, item) DO UPDATE SET count = count + excluded.count
+    ''', (user_id, item, count))
+
+
+def _remove_item(conn, user_id, item):
+    cursor = conn.execute(
+        'UPDATE inventory SET count = count - 1 WHERE user_id = ? AND item = ? AND count > 0', (user_id, item)
+    )
+    conn.execute('DELETE FROM inventory WHERE user_id = ? AND item = ? AND count <= 0', (user_id, item))
+    return cursor.rowcount > 0
+
+
+def _fetch_skills(conn, user_id):
+    rows = conn.execute('SELECT skill FROM skills WHERE user_id = ?', (user_id,)).fetchall()
+    return {row[0] for row in rows}
+
+
+def _add_skill(conn, user_id, skill):
+    conn.execute('INSERT OR IGNORE INTO skills (user_id, skill) VALUES (?, ?)', (user_id, skill))
+
+
+class QuestStore:
+    """Quêtes de la campagne. Pas de cache : l'interface web écrit aussi dans la table."""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    async def get(self, name):
+        return await self.repository.read(fetch_quest, name)
+
+    async def all(self):
+        return await self.repository.read(fetch_quests)
+
+    async def create(self, name, description):
+        await self.repository.write(insert_quest, name, description)
+
+    async def start(self, name):
+        """Renvoie False si la quête n'existe pas."""
+        return await self.repository.write(_set_quest_flag, name, 'started')
+
+    async def complete(self, name):
+        """Renvoie False si la quête n'existe pas."""
+        return await self.repository.write(_set_quest_flag, name, 'completed')
+
+
+class InventoryStore:
+    """Inventaires des joueurs, stockés en quantités par objet et chargés joueur par joueur."""
+
+    def __init__(self, repository, max_users=1024):
+        self.repository = repository
+        self._cache = _LRU(max_users)
+
+    async def _load(self, user_id):
+        items = self._cache.get(user_id)
+        if items is None:
+            loaded = await self.repository.read(_fetch_inventory, user_id)
+            # Un autre chargement a pu remplir le cache pendant la lecture : il est prioritaire
+            items = self._cache.get(user_id)
+            if items is None:
+                items = loaded
+                self._cache.put(user_id, items)
+        return items
+
+    async def get(self, user_id):
+        """Renvoie {objet: quantité}."""
+        return dict(await self._load(user_id))
+
+    def _cached(self, user_id, items):
+        """items s'il est toujours en cache ; sinon oublie l'entrée rechargée pendant l'écriture (la base fait foi)."""
+        if self._cache.get(user_id) is items:
+            return items
+        self._cache.discard(user_id)
+        return None
+
+    async def add(self, user_id, item, count=1):
+        items = await self._load(user_id)
+        # Le cache n'est modifié qu'une fois l'écriture réussie : en cas d'erreur, il reste égal à la base
+        await self.repository.write(_add_item, user_id, item, count)
+        items = self._cached(user_id, items)
+        if items is not None:
+            items[item] = items.get(item, 0) + count
+
+    async def remove(self, user_id, item):
+        """Retire un exemplaire ; renvoie False si l'objet n'est pas dans l'inventaire."""
+        items = await self._load(user_id)
+        if items.get(item, 0) <= 0:
+            return False
+        removed = await self.repository.write(_remove_item, user_id, item)
+        items = self._cached(user_id, items)
+        if items is not None and removed:
+            items[item] -= 1
+            if items[item] <= 0:
+                del items[item]
+        return removed
+
+
+class SkillStore:
+    """Compétences des joueurs, chargées joueur par joueur."""
+
+    def __init__(self, repository, max_users=1024):
+        self.repository = repository
+        self._cache = _LRU(max_users)
+
+    async def _load(self, user_id):
+        skills = self._cache.get(user_id)
+        if skills is None:
+            loaded = await self.repository.read(_fetch_skills, user_id)
+            skills = self._cache.get(user_id)
+            if skills is None:
+                skills = loaded
+                self._cache.put(user_id, skills)
+        return skills
+
+    async def add(self, user_id, skill):
+        skills = await self._load(user_id)
+        # Comme InventoryStore.add : le cache suit la base, jamais l'inverse
+        await self.repository.write(_add_skill, user_id, skill)
+        if self._cache.get(user_id) is skills:
+            skills.add(skill)
+        else:
+            self._cache.discard(user_id)
+
+    async def has(self, user_id, skill):
+        return skill in await self._load(user_id)
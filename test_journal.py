@@ -0,0 +1,58 @@
+"""Tests de la restauration des personnages (journal.py).
+
+    python -m pytest -q test_journal.py
+"""
+from contextlib import closing
+
+import pytest
+
+import db
+import journal
+import migrations
+
+CHARACTER = {
+    "name": "Aria", "race": "Elfe", "class": "Mage", "level": 1, "xp": 0, "hp": 10, "strength": 8,
+    "dexterity": 14, "constitution": 12, "intelligence": 16, "wisdom": 13, "charisma": 10,
+    "invisible_until": 0, "last_spell_used": 0
+}
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'rpg_bot.db')
+    with closing(db.connect(path)) as conn:
+        migrations.migrate(conn)
+        with conn:
+            row = db.character_to_row('1', CHARACTER)
+            db._insert_characters(conn, [row])
+            db._append_journal(conn, [journal.entry('1', journal.PUT, dict(zip(db.CHARACTER_COLUMNS[1:], row[1:])), 'create')])
+            # Modification hors journal : la restauration doit la défaire
+            conn.execute("UPDATE characters SET hp = 3 WHERE user_id = '1'")
+    return path
+
+
+def hp(conn):
+    return conn.execute("SELECT hp FROM characters WHERE user_id = '1'").fetchone()[0]
+
+
+def test_restore_rewrites_characters_from_the_journal(database):
+    with closing(db.connect(database)) as conn:
+        assert journal.restore_characters(conn) == 1
+        assert hp(conn) == 10
+
+
+def test_restore_is_refused_while_a_bot_holds_the_database(database):
+    lock = db.hold_cache_lock(database)
+    try:
+        with closing(db.connect(database)) as conn:
+            with pytest.raises(db.DatabaseBusy):
+                journal.restore_characters(conn)
+            assert hp(conn) == 3
+            # Un essai à blanc n'écrit rien : il reste permis
+            assert journal.restore_characters(conn, dry_run=True) == 1
+            assert hp(conn) == 3
+    finally:
+        lock.close()
+    with closing(db.connect(database)) as conn:
+        assert journal.restore_characters(conn) == 1
+        assert hp(conn) == 10
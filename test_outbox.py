@@ -0,0 +1,159 @@
+"""Tests de la file d'envoi (outbox.py) sur le transport local (fakes.py).
+
+    python -m pytest -q test_outbox.py
+"""
+import asyncio
+
+from fakes import FakeChannel, StubTransport
+from outbox import MAX_LENGTH, Outbox
+
+
+class RecordingChannel(FakeChannel):
+    """Salon qui garde ses messages, pour relire leur contenu après les éditions."""
+
+    def __init__(self, id):
+        super().__init__(id)
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        message = await super().send(content, **kwargs)
+        self.sent.append(message)
+        return message
+
+    def lines(self):
+        return [line for message in self.sent for line in message.content.split('\n')]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_messages_within_the_window_are_coalesced():
+    async def scenario():
+        transport = StubTransport()
+        outbox = Outbox(transport=transport, window=0.05)
+        channel = RecordingChannel(1)
+        for text in ("premier", "deuxième", "troisième"):
+            await outbox.send(channel, text)
+        await outbox.close()
+        return transport, outbox, channel
+
+    transport, outbox, channel = run(scenario())
+    assert transport.posts == 1
+    assert [message.content for message in channel.sent] == ["premier\ndeuxième\ntroisième"]
+    assert outbox.stats()["coalesced"] == 2
+
+
+def test_channels_are_not_coalesced_together():
+    async def scenario():
+        outbox = Outbox(transport=StubTransport(), window=0.05)
+        channels = [RecordingChannel(1), RecordingChannel(2)]
+        for channel in channels:
+            await outbox.send(channel, f"salon {channel.id}")
+        await outbox.close()
+        return channels
+
+    assert [[message.content for message in channel.sent] for channel in run(scenario())] == [["salon 1"], ["salon 2"]]
+
+
+def test_long_messages_are_split_at_the_length_limit():
+    lines = [f"ligne {index:04d} " + "x" * 40 for index in range(200)]
+    text = '\n'.join(lines)
+
+    async def scenario():
+        outbox = Outbox(transport=StubTransport(), window=0.01, channel_limit=(100, 1.0))
+        channel = RecordingChannel(1)
+        await outbox.send(channel, text)
+        await outbox.send(channel, "y" * (MAX_LENGTH + 500))  # sans retour à la ligne : coupé net
+        await outbox.close()
+        return channel
+
+    channel = run(scenario())
+    assert len(channel.sent) > 3
+    assert all(len(message.content) <= MAX_LENGTH for message in channel.sent)
+    # Découpage aux retours à la ligne : aucune ligne coupée, rien de perdu
+    assert channel.lines()[:len(lines)] == lines
+    assert ''.join(channel.lines()[len(lines):]) == "y" * (MAX_LENGTH + 500)
+
+
+def test_empty_channel_bucket_falls_back_to_editing_the_last_message():
+    async def scenario():
+        transport = StubTransport()
+        # Un seul envoi par minute dans ce salon : le second message doit compléter le premier
+        outbox = Outbox(transport=transport, window=0.01, channel_limit=(1, 60.0))
+        channel = RecordingChannel(1)
+        await outbox.send(channel, "attaque")
+        await asyncio.sleep(0.05)
+        await outbox.send(channel, "dégâts")
+        await outbox.close(timeout=1.0)
+        return transport, channel
+
+    transport, channel = run(scenario())
+    assert (transport.posts, transport.edits) == (1, 1)
+    assert [message.content for message in channel.sent] == ["attaque\ndégâts"]
+
+
+def test_order_is_kept_within_a_channel():
+    messages = [f"message {index} " + "z" * 40 for index in range(40)]
+
+    async def scenario():
+        transport = StubTransport(latency=0.001)
+        # Budget serré : envois, éditions et attentes se mélangent
+        outbox = Outbox(transport=transport, window=0.01, channel_limit=(2, 0.5), edit_limit=(3, 0.5))
+        channel = RecordingChannel(1)
+        for text in messages:
+            await outbox.send(channel, text)
+            await asyncio.sleep(0.02)
+        await outbox.close()
+        return transport, outbox, channel
+
+    transport, outbox, channel = run(scenario())
+    assert transport.posts > 1 and transport.edits > 0
+    assert channel.lines() == messages
+    assert outbox.depth == 0
+    assert outbox.stats()["errors"] == 0
+
+
+def test_split_keeps_intentional_blank_lines():
+    head = "a" * MAX_LENGTH
+    tail = "\n\nsuite après deux lignes vides"
+
+    async def scenario():
+        outbox = Outbox(transport=StubTransport(), window=0.01, channel_limit=(100, 1.0))
+        channel = RecordingChannel(1)
+        await outbox.send(channel, head + tail)  # coupé net à la limite, juste avant les lignes vides
+        await outbox.send(channel, "x" * 1500 + "\n" + "y" * 1000)  # coupé au retour à la ligne, qui disparaît
+        await outbox.close()
+        return channel
+
+    channel = run(scenario())
+    assert [message.content for message in channel.sent] == [head, tail, "x" * 1500, "y" * 1000]
+
+
+def test_idle_channels_are_forgotten():
+    async def scenario():
+        outbox = Outbox(transport=StubTransport(), window=0.01, channel_limit=(5, 0.05), edit_limit=(5, 0.05), edit_window=0.05)
+        for index in range(10):
+            await outbox.send(RecordingChannel(index), "bonjour")
+        await outbox.close()
+        assert outbox.stats()["channels"] == 10
+        await asyncio.sleep(0.1)
+        await outbox.send(RecordingChannel(99), "encore")
+        await outbox.close()
+        return outbox
+
+    assert run(scenario()).stats()["channels"] == 1
+
+
+def test_flush_sends_queued_text_before_a_direct_send():
+    async def scenario():
+        outbox = Outbox(transport=StubTransport(), window=0.05)
+        channel = RecordingChannel(1)
+        await outbox.send(channel, "texte en file")
+        await outbox.flush(channel)
+        # Comme RPGContext.send avec un embed : envoi direct, après la file
+        await channel.send("embed")
+        await outbox.close()
+        return channel
+
+    assert [message.content for message in run(scenario()).sent] == ["texte en file", "embed"]
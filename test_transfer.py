@@ -0,0 +1,37 @@
+"""Tests de la validation des personnages importés (transfer.py).
+
+    python -m pytest -q test_transfer.py
+"""
+import pytest
+
+import db
+import levels
+import transfer
+
+XP = db.CHARACTER_COLUMNS.index('xp')
+LEVEL = db.CHARACTER_COLUMNS.index('level')
+
+
+def test_missing_columns_take_the_defaults():
+    row = transfer.to_row({"user_id": "1", "name": "Aria"}, levels.LevelTable.linear())
+    assert row[LEVEL] == 1 and row[XP] == 0
+
+
+@pytest.mark.parametrize("record, xp", [
+    ({"level": 5}, 400),  # XP absente : le seuil du niveau
+    ({"level": "5", "xp": "50"}, 400),  # XP sous le seuil : relevée
+    ({"level": 5, "xp": 450}, 450),  # XP cohérente : gardée
+])
+def test_xp_is_raised_to_the_level_threshold(record, xp):
+    table = levels.LevelTable.linear()
+    row = transfer.to_row({"user_id": "1", "name": "Aria", **record}, table)
+    assert row[XP] == xp
+    # Le personnage importé reste à son niveau et passe au suivant au seuil normal
+    assert table.level_for(row[XP]) == 5
+    assert table.level_for(500) == 6
+
+
+def test_custom_table_and_levels_beyond_it():
+    table = levels.LevelTable.parse("0,300,900,2700")
+    assert transfer.to_row({"user_id": "1", "name": "Aria", "level": 3}, table)[XP] == 900
+    assert transfer.to_row({"user_id": "1", "name": "Aria", "level": 50}, table)[XP] == 2700
@@ -0,0 +1,244 @@
+"""Import et export des personnages en masse (CSV ou JSON Lines).
+
+    python transfer.py export roster.csv
+    python transfer.py export roster.jsonl
+    python transfer.py import roster.csv [--dry-run] [--chunk-size 5000]
+
+L'export lit la table par lots (jamais toute la table en mémoire) ; l'import
+valide chaque ligne et écrit par lots avec executemany, un lot par
+transaction (personnages et entrées du journal, voir journal.py). Les mêmes fonctions servent l'interface web (app.py).
+
+Le bot garde en cache les personnages qu'il a déjà lus et les réécrirait
+par-dessus l'import : tant qu'un bot ou un coordinateur tient le verrou de la
+base (db.hold_cache_lock), l'import est refusé avec db.DatabaseBusy. Arrêter
+le bot avant d'importer ; --dry-run reste possible.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+import time
+from contextlib import closing, nullcontext
+
+import db
+import journal
+import levels
+import migrations
+
+CHUNK_SIZE = 5000
+
+# Valeurs des colonnes absentes du fichier (mêmes valeurs que !create)
+DEFAULTS = {
+    "race": "Humain",
+    "class": "Guerrier",
+    "level": 1,
+    "xp": 0,
+    "hp": 10,
+    "strength": 10,
+    "dexterity": 10,
+    "constitution": 10,
+    "intelligence": 10,
+    "wisdom": 10,
+    "charisma": 10,
+    "invisible_until": 0,
+    "last_spell_used": 0
+}
+INTEGER_COLUMNS = frozenset(column for column, value in DEFAULTS.items() if isinstance(value, int))
+
+# Nombre maximal d'erreurs détaillées dans le résultat d'un import
+MAX_REPORTED_ERRORS = 100
+
+
+class TransferError(ValueError):
+    pass
+
+
+def detect_format(filename):
+    if filename.endswith('.csv'):
+        return 'csv'
+    if filename.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise TransferError(f"Format inconnu pour {filename} (attendu : .csv ou .jsonl)")
+
+
+def read_records(stream, format):
+    """Lit un fichier texte ligne par ligne : (numéro de ligne, dict).
+
+    Une ligne JSON illisible arrête la lecture (TransferError) ; les lots déjà
+    importés restent écrits.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif format == 'jsonl':
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise TransferError(f"Ligne {number} : JSON invalide ({e.msg})") from None
+            if not isinstance(record, dict):
+                raise TransferError(f"Ligne {number} : un objet JSON est attendu")
+            yield number, record
+    else:
+        raise TransferError(f"Format inconnu : {format}")
+
+
+def to_row(record, table=None):
+    """Valide un personnage (dict) et renvoie la ligne à insérer, dans l'ordre des colonnes.
+
+    L'XP est cumulée : elle est portée au moins au seuil du niveau importé
+    (table : levels.LevelTable, par défaut celle du bot).
+    """
+    # "id" est le nom du champ dans /api/characters
+    user_id = record.get('user_id', record.get('id'))
+    if user_id is None or str(user_id).strip() == '':
+        raise TransferError("identifiant (user_id) manquant")
+    name = record.get('name')
+    if name is None or str(name).strip() == '':
+        raise TransferError("nom manquant")
+    row = [str(user_id).strip(), str(name)]
+    for column in db.CHARACTER_COLUMNS[2:]:
+        value = record.get(column)
+        if value is None or value == '':
+            value = DEFAULTS[column]
+        elif column in INTEGER_COLUMNS:
+            try:
+                value = int(float(value)) if isinstance(value, str) and '.' in value else int(value)
+            except (TypeError, ValueError):
+                raise TransferError(f"{column} doit être un nombre entier (reçu : {value!r})") from None
+        else:
+            value = str(value)
+        row.append(value)
+    # Sans cela, un personnage importé au niveau 5 avec 0 XP devrait regagner 400 XP avant le niveau 6
+    level_index, xp_index = db.CHARACTER_COLUMNS.index('level'), db.CHARACTER_COLUMNS.index('xp')
+    table = table or levels.from_environment()
+    row[xp_index] = max(row[xp_index], table.threshold(row[level_index]))
+    return tuple(row)
+
+
+def import_characters(conn, records, chunk_size=CHUNK_SIZE, dry_run=False):
+    """Importe des personnages (itérable de (ligne, dict)) ; les lignes invalides sont ignorées.
+
+    Renvoie {"imported", "skipped", "errors", "elapsed_s"} ; errors détaille
+    les premières lignes refusées. Lève db.DatabaseBusy si un bot ou un
+    coordinateur utilise la base (ses personnages en cache écraseraient l'import).
+    """
+    if not dry_run:
+        with db.exclusive_access(conn.execute('PRAGMA database_list').fetchone()[2]):
+            return _import_characters(conn, records, chunk_size, dry_run)
+    return _import_characters(conn, records, chunk_size, dry_run)
+
+
+def _import_characters(conn, records, chunk_size, dry_run):
+    start = time.perf_counter()
+    imported = 0
+    skipped = 0
+    errors = []
+    chunk = []
+    table = levels.from_environment()
+
+    def write(chunk):
+        if not dry_run:
+            now = time.time()
+            with conn:
+                db._insert_characters(conn, chunk)
+                db._append_journal(conn, [
+                    journal.entry(row[0], journal.PUT, dict(zip(db.CHARACTER_COLUMNS[1:], row[1:])), 'import', now)
+                    for row in chunk
+                ])
+
+    for number, record in records:
+        try:
+            chunk.append(to_row(record, table))
+        except TransferError as e:
+            skipped += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"Ligne {number} : {e}")
+            continue
+        if len(chunk) >= chunk_size:
+            write(chunk)
+            imported += len(chunk)
+            chunk = []
+    if chunk:
+        write(chunk)
+        imported += len(chunk)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Import de personnages : {imported} écrit(s), {skipped} ignoré(s) en {elapsed:.2f} s")
+    return {"imported": imported, "skipped": skipped, "errors": errors, "dry_run": dry_run, "elapsed_s": elapsed}
+
+
+def export_characters(conn, format, batch_size=CHUNK_SIZE):
+    """Génère l'export morceau par morceau (texte), dans l'ordre des identifiants."""
+    cursor = conn.execute('SELECT * FROM characters ORDER BY user_id')
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(db.CHARACTER_COLUMNS)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            writer.writerows(tuple(row) for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    elif format == 'jsonl':
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield ''.join(
+                json.dumps(dict(zip(db.CHARACTER_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows
+            )
+    else:
+        raise TransferError(f"Format inconnu : {format}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import et export des personnages (CSV ou JSON Lines)")
+    parser.add_argument('--database', default=db.DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help="exporter tous les personnages")
+    export_parser.add_argument('file', help="fichier .csv ou .jsonl, ou - pour la sortie standard")
+    export_parser.add_argument('--format', choices=('csv', 'jsonl'))
+    import_parser = commands.add_parser('import', help="importer des personnages (remplace ceux qui existent)")
+    import_parser.add_argument('file', help="fichier .csv ou .jsonl")
+    import_parser.add_argument('--format', choices=('csv', 'jsonl'))
+    import_parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    import_parser.add_argument('--dry-run', action='store_true', help="valider sans écrire")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        format = args.format or ('csv' if args.file == '-' else detect_format(args.file))
+        with closing(db.connect(args.database)) as conn:
+            migrations.migrate(conn)
+            if args.command == 'export':
+                start = time.perf_counter()
+                if args.file == '-':
+                    output = nullcontext(sys.stdout)
+                else:
+                    output = open(args.file, 'w', encoding='utf-8', newline='')
+                with output as stream:
+                    for part in export_characters(conn, format):
+                        stream.write(part)
+                logging.info(f"Export terminé en {time.perf_counter() - start:.2f} s")
+            else:
+                with open(args.file, encoding='utf-8-sig', newline='') as stream:
+                    result = import_characters(
+                        conn, read_records(stream, format), chunk_size=args.chunk_size, dry_run=args.dry_run
+                    )
+                print(json.dumps(result, indent=2, ensure_ascii=False))
+    except (TransferError, db.DatabaseBusy, OSError) as e:
+        parser.exit(1, f"Erreur : {e}\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+"""Point d'entrée WSGI de l'interface web en production.
+
+Lancer le bot avec EMBEDDED_WEB=0, puis servir l'interface avec plusieurs
+processus, par exemple :
+
+    gunicorn -w 4 -b 0.0.0.0:5000 wsgi:application
+
+Chaque processus ouvre ses propres connexions en lecture seule sur la base
+(WAL : les lectures ne bloquent pas le bot, qui reste le seul écrivain).
+"""
+import os
+
+os.environ.setdefault('WEB_READ_ONLY', '1')
+
+from app import app as application  # noqa: E402